@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+HTML解析引擎基准测试
+
+对比 BeautifulSoup(html.parser) 与 lxml 两种引擎、完整DOM与只解析表格行两种模式
+解析五个HTML网站页面的耗时和内存峰值，并验证所有组合的提取结果完全一致。
+
+页面来源（可组合使用）：
+    python benchmark_html_parsers.py --bundle fixtures/sources.json.gz   # 录制包中的HTML页面
+    python benchmark_html_parsers.py --page https://cf.090227.xyz/ saved/cf.html
+    python benchmark_html_parsers.py                                     # 未指定时使用生成的示例页面
+"""
+
+import argparse
+import base64
+import gzip
+import json
+import sys
+import time
+import tracemalloc
+
+from ip_extractor import IPExtractor, LXML_AVAILABLE
+
+
+# 生成示例页面时各网站的表格布局：(行class列表, 行生成函数)
+SAMPLE_LAYOUTS = {
+    "https://cf.090227.xyz/": (
+        [""], lambda i: ["电信", f"104.16.{i // 256}.{i % 256}", f"{50 + i % 100}.{i % 10}0ms"]),
+    "https://stock.hostmonit.com/CloudFlareYes": (
+        ["el-table__row", "el-table__row expanded"],
+        lambda i: ["CM", f"172.64.{i // 256}.{i % 256}", f"{60 + i % 90}ms", "10mb/s"]),
+    "https://ip.164746.xyz/": (
+        [""], lambda i: [f"104.17.{i // 256}.{i % 256}", "4", "4", "0.00", f"{70 + i % 50}.5"]),
+    "https://monitor.gacjie.cn/page/cloudflare/ipv4.html": (
+        [""], lambda i: ["联通", f"104.18.{i // 256}.{i % 256}", "0%", "20", f"{40 + i % 80} 毫秒"]),
+    "https://345673.xyz/": (
+        ["line-cm", "line-ct", "line-cu", "line-other"],
+        lambda i: ["移动", f"104.19.{i // 256}.{i % 256}", "0%", f"{30 + i % 70}ms"]),
+}
+
+
+def build_sample_page(url, rows=2000):
+    """生成包含脚本、样式、导航和大表格的示例页面"""
+    row_classes, make_row = SAMPLE_LAYOUTS[url]
+    parts = [
+        "<!DOCTYPE html><html><head><meta charset='utf-8'><title>CF</title>",
+        "<style>" + "td{padding:2px}" * 200 + "</style>",
+        "<script>" + "var x = [1,2,3];" * 500 + "</script></head><body>",
+        "<nav>" + "".join(f"<a href='/p{i}'>链接{i}</a>" for i in range(200)) + "</nav>",
+        "<table><thead><tr><th>线路</th><th>IP</th><th>延迟</th></tr></thead><tbody>",
+    ]
+    for i in range(rows):
+        row_class = row_classes[i % len(row_classes)]
+        class_attr = f" class='{row_class}'" if row_class else ""
+        cells = "".join(f"<td><span>{cell}</span></td>" for cell in make_row(i))
+        parts.append(f"<tr{class_attr}>{cells}</tr>")
+    parts.append("</tbody></table><footer>" + "<p>说明文字</p>" * 300 + "</footer></body></html>")
+    return "".join(parts).encode("utf-8")
+
+
+def load_bundle_pages(path, extractor):
+    """从录制包中读取支持的HTML页面"""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        entries = json.load(f)
+    pages = {}
+    for key, entry in entries.items():
+        method, _, url = key.partition(" ")
+        if method == "GET" and entry.get("status") == 200 and extractor.get_site_spec(url):
+            pages[url] = base64.b64decode(entry["body"])
+    return pages
+
+
+# 参与对比的解析组合：(列名, 解析引擎, 是否只解析表格行)
+PARSE_MODES = [
+    ("bs4完整", "html.parser", False),
+    ("bs4表格行", "html.parser", True),
+    ("lxml完整", "lxml", False),
+    ("lxml表格行", "lxml", True),
+]
+
+
+def time_parser(extractor, url, content, html_parser, repeat, table_only=None):
+    """返回 (最短耗时秒数, 提取结果)"""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = extractor.parse_html_site(url, content, html_parser=html_parser, table_only=table_only)
+        best = min(best, time.perf_counter() - start_time)
+    return best, result
+
+
+def peak_memory(extractor, url, content, html_parser, table_only):
+    """返回解析一次页面的内存峰值（字节）"""
+    tracemalloc.start()
+    try:
+        extractor.parse_html_site(url, content, html_parser=html_parser, table_only=table_only)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTML解析引擎基准测试")
+    parser.add_argument("--bundle", help="录制包路径（FixtureBundle录制的 .json.gz 文件）")
+    parser.add_argument("--page", nargs=2, action="append", metavar=("URL", "FILE"), default=[],
+                        help="已保存的页面及其来源URL，可重复指定")
+    parser.add_argument("--rows", type=int, default=2000, help="示例页面的表格行数")
+    parser.add_argument("--repeat", type=int, default=5, help="每个页面重复解析的次数（取最短耗时）")
+    args = parser.parse_args()
+
+    if not LXML_AVAILABLE:
+        print("错误: 需要安装 lxml 才能运行基准测试: pip install lxml")
+        return 1
+
+    extractor = IPExtractor()
+    pages = {}
+    if args.bundle:
+        pages.update(load_bundle_pages(args.bundle, extractor))
+    for url, file_path in args.page:
+        with open(file_path, "rb") as f:
+            pages[url] = f.read()
+    if not pages:
+        print(f"未指定页面，使用生成的示例页面（每页 {args.rows} 行）")
+        pages = {url: build_sample_page(url, args.rows) for url in SAMPLE_LAYOUTS}
+
+    totals = [0.0] * len(PARSE_MODES)
+    all_identical = True
+    header = "".join(f"{name:>12}" for name, _, _ in PARSE_MODES)
+    print(f"{'页面':<55}{'大小':>10}{header}{'bs4内存(完整/表格行)':>22}  结果")
+    for url, content in pages.items():
+        results = []
+        timings = ""
+        for index, (_, html_parser, table_only) in enumerate(PARSE_MODES):
+            seconds, result = time_parser(extractor, url, content, html_parser, args.repeat, table_only)
+            totals[index] += seconds
+            results.append(result)
+            timings += f"{seconds * 1000:>10.1f}ms"
+        identical = all(result == results[0] for result in results)
+        all_identical = all_identical and identical
+        # lxml的DOM分配在C堆上，tracemalloc无法统计，内存对比使用BeautifulSoup
+        full_memory = peak_memory(extractor, url, content, "html.parser", False)
+        rows_memory = peak_memory(extractor, url, content, "html.parser", True)
+        print(f"{url:<55}{len(content) // 1024:>8}KB{timings}"
+              f"{full_memory // 1024:>12}KB/{rows_memory // 1024:>6}KB"
+              f"  {len(results[0])}条{'一致' if identical else '不一致!'}")
+
+    baseline = totals[0]
+    print("总计: " + ", ".join(f"{name} {total * 1000:.1f}ms ({baseline / total:.1f}x)"
+                             for (name, _, _), total in zip(PARSE_MODES, totals)))
+    if not all_identical:
+        print("错误: 不同解析方式的提取结果不一致")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
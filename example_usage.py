@@ -249,36 +249,27 @@ def example_for_other_programs():
         all_ips = extractor.get_all_ips()
         unique_ips = extractor.remove_duplicates(all_ips)
         
-        # 自定义过滤逻辑
-        filtered_ips = []
-        for line in unique_ips:
-            try:
-                latency_str = line.split('-')[-1].replace('ms', '')
-                latency_value = float(latency_str)
-                if min_latency <= latency_value <= max_latency:
-                    filtered_ips.append(line)
-            except (ValueError, IndexError):
-                continue
+        # 自定义过滤逻辑：直接使用记录中的延迟字段
+        filtered_ips = [
+            record for record in unique_ips
+            if record.latency_ms is not None and min_latency <= record.latency_ms <= max_latency
+        ]
         
         return extractor.extract_ip_addresses(filtered_ips)
     
     # 场景3：获取特定线路的IP（如电信、联通、移动）
-    def get_ips_by_line_type(line_keywords=['电信', '联通', '移动']):
+    def get_ips_by_line_type(line_keywords=['电信', '联通', '移动'], count=None):
         extractor = IPExtractor()
         all_ips = extractor.get_all_ips()
         
-        # 过滤包含特定线路关键词的IP
-        line_filtered_ips = []
-        for line in all_ips:
-            if '#' in line:  # 包含线路信息
-                for keyword in line_keywords:
-                    if keyword in line:
-                        line_filtered_ips.append(line)
-                        break
+        # 按运营商建立索引（移动/电信/联通 规范化为 CM/CT/CU），每个运营商按延迟排好序
+        carrier_index = extractor.build_carrier_index(all_ips)
         
-        unique_ips = extractor.remove_duplicates(line_filtered_ips)
-        filtered_ips = extractor.filter_by_latency(unique_ips, max_latency=100.0)
-        return extractor.extract_ip_addresses(filtered_ips)
+        records = [
+            record for keyword in line_keywords
+            for record in carrier_index.within(keyword, max_latency=100.0, k=count)
+        ]
+        return list(dict.fromkeys(extractor.extract_ip_addresses(records)))
     
     # 测试这些函数
     fastest_ips = get_fastest_ips_for_dns(3)
@@ -22,10 +22,47 @@ IP提取器模块 - 从多个网站提取Cloudflare IP地址和延迟信息
 
 import os
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util import connection as urllib3_connection
+from urllib3.exceptions import ConnectTimeoutError, NameResolutionError, NewConnectionError
+from urllib3.util.retry import Retry
+from bs4 import BeautifulSoup, SoupStrainer
+from bs4.dammit import UnicodeDammit
 import re
-from typing import List, Optional, Tuple
+import gzip
+import csv
+import array
+import struct
+import sys
+import json
+import math
+import base64
+import time
+import socket
+import sqlite3
+import hashlib
+import ipaddress
+import bisect
+import heapq
+import functools
+import statistics
+import threading
+from urllib.parse import urlparse
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Pattern, Set, Tuple
 import concurrent.futures
+import multiprocessing
+try:
+    from lxml import etree
+    LXML_AVAILABLE = True
+except ImportError:
+    LXML_AVAILABLE = False
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
 try:
     from ipwhois import IPWhois
     IPWHOIS_AVAILABLE = True
@@ -34,18 +71,2712 @@ except ImportError:
     print("警告: ipwhois 模块不可用，地区过滤功能将受限")
 
 
+if LXML_AVAILABLE:
+    # 预编译的XPath表达式，所有页面共用
+    _LXML_ROW_XPATH = etree.XPath('//tr')
+    _LXML_CELL_XPATH = etree.XPath('.//td')
+    # 与BeautifulSoup的 td.text 一致：不包含脚本、样式和模板中的文本
+    _LXML_TEXT_XPATH = etree.XPath(
+        './/text()[not(ancestor::script) and not(ancestor::style) and not(ancestor::template)]')
+
+
+def iter_table_rows_bs4(soup: BeautifulSoup, row_class: Optional[Pattern] = None) -> Iterator[List[str]]:
+    """
+    使用BeautifulSoup遍历表格行
+
+    Args:
+        soup: 已解析的页面
+        row_class: 行class的正则表达式，None表示所有行
+
+    Yields:
+        每行所有<td>单元格的文本（未去除空白）
+    """
+    rows = soup.find_all('tr', class_=row_class) if row_class else soup.find_all('tr')
+    for row in rows:
+        yield [td.text for td in row.find_all('td')]
+
+
+def iter_table_rows_lxml(content: bytes, row_class: Optional[Pattern] = None) -> Iterator[List[str]]:
+    """
+    使用lxml遍历表格行，结果与 iter_table_rows_bs4 一致
+
+    页面编码使用与BeautifulSoup相同的UnicodeDammit检测，保证文本解码一致。
+
+    Args:
+        content: 页面原始字节
+        row_class: 行class的正则表达式，None表示所有行
+
+    Yields:
+        每行所有<td>单元格的文本（未去除空白）
+    """
+    markup = UnicodeDammit(content, is_html=True).unicode_markup
+    if not markup:
+        return
+    try:
+        root = etree.HTML(markup)
+    except ValueError:
+        # 带编码声明的XML文档不能以str解析，交给lxml自行解码
+        root = etree.HTML(content)
+    if root is None:
+        return
+    for row in _LXML_ROW_XPATH(root):
+        if row_class is not None and not row_class.search(row.get('class', '')):
+            continue
+        yield [''.join(_LXML_TEXT_XPATH(td)) for td in _LXML_CELL_XPATH(row)]
+
+
+def table_row_strainer(row_class: Optional[Pattern] = None) -> SoupStrainer:
+    """
+    创建只保留表格行的SoupStrainer，BeautifulSoup解析时丢弃其余节点
+
+    Args:
+        row_class: 行class的正则表达式，None表示所有行
+
+    Returns:
+        SoupStrainer对象
+    """
+    return SoupStrainer('tr', class_=row_class) if row_class else SoupStrainer('tr')
+
+
+class _TableRowTarget:
+    """
+    lxml解析器的事件接收器，只收集表格行中的单元格文本而不构建DOM
+
+    与BeautifulSoup的 find_all('tr') / find_all('td') / td.text 语义一致：
+    嵌套的行和单元格都会被收集，单元格文本包含所有后代文本，但不包含脚本、样式和注释。
+    """
+
+    _SKIPPED_TEXT_TAGS = frozenset(('script', 'style', 'template'))
+
+    def __init__(self, row_class: Optional[Pattern] = None):
+        self.row_class = row_class
+        # 按开始标签顺序排列的匹配行，每行是单元格文本片段列表的列表
+        self.rows: List[List[List[str]]] = []
+        # 当前打开的行（不匹配的行为None）和单元格
+        self._open_rows: List[Optional[List[List[str]]]] = []
+        self._open_cells: List[List[str]] = []
+        self._skip_depth = 0
+
+    def start(self, tag, attrib):
+        if tag == 'tr':
+            cells = None
+            if self.row_class is None or self.row_class.search(attrib.get('class', '')):
+                cells = []
+                self.rows.append(cells)
+            self._open_rows.append(cells)
+        elif tag == 'td':
+            buffer: List[str] = []
+            for cells in self._open_rows:
+                if cells is not None:
+                    cells.append(buffer)
+            self._open_cells.append(buffer)
+        elif tag in self._SKIPPED_TEXT_TAGS:
+            self._skip_depth += 1
+
+    def end(self, tag):
+        if tag == 'tr':
+            if self._open_rows:
+                self._open_rows.pop()
+        elif tag == 'td':
+            if self._open_cells:
+                # 单元格结束时合并文本片段，减少行数据的内存占用
+                buffer = self._open_cells.pop()
+                buffer[:] = [''.join(buffer)]
+        elif tag in self._SKIPPED_TEXT_TAGS:
+            if self._skip_depth:
+                self._skip_depth -= 1
+
+    def data(self, data):
+        if self._skip_depth:
+            return
+        for buffer in self._open_cells:
+            buffer.append(data)
+
+    def close(self) -> List[List[str]]:
+        return [[''.join(buffer) for buffer in cells] for cells in self.rows]
+
+
+def iter_table_rows_tokenized(content: bytes, row_class: Optional[Pattern] = None) -> Iterator[List[str]]:
+    """
+    使用lxml的事件解析遍历表格行，只生成匹配的行，不构建页面DOM
+
+    适合包含大量脚本、导航和样式的页面，CPU和内存开销都低于完整DOM解析。
+
+    Args:
+        content: 页面原始字节
+        row_class: 行class的正则表达式，None表示所有行
+
+    Yields:
+        每行所有<td>单元格的文本（未去除空白）
+    """
+    markup = UnicodeDammit(content, is_html=True).unicode_markup
+    if not markup:
+        return
+    parser = etree.HTMLParser(target=_TableRowTarget(row_class))
+    try:
+        parser.feed(markup)
+    except ValueError:
+        # 带编码声明的XML文档不能以str解析，交给lxml自行解码
+        parser = etree.HTMLParser(target=_TableRowTarget(row_class))
+        parser.feed(content)
+    yield from parser.close()
+
+
+class IPRecord:
+    """
+    一条IP数据：地址、线路、延迟、速度、来源、获取时间以及地区
+
+    数据源解析时创建一次，在去重、过滤、地区查询等阶段直接使用字段，
+    只在输出（保存文件、打印）时格式化为 "IP#线路-延迟ms" 等字符串。
+    相等性和哈希只比较 ip、line、latency_ms、speed_mbps，不比较来源和获取时间。
+    """
+
+    __slots__ = ('ip', 'line', 'latency_ms', 'speed_mbps', 'source', 'observed_at', 'region', 'port')
+
+    def __init__(self, ip: str, line: Optional[str] = None, latency_ms: Optional[float] = None,
+                 speed_mbps: Optional[float] = None, source: Optional[str] = None,
+                 observed_at: Optional[float] = None, region: Optional[str] = None,
+                 port: Optional[int] = None):
+        """
+        Args:
+            ip: IP地址
+            line: 线路名称（如 电信、CM）或其他标签
+            latency_ms: 延迟（毫秒）
+            speed_mbps: 速度（mb/s）
+            source: 产出该记录的数据源（URL或文件路径）
+            observed_at: 获取时间（Unix时间戳），None表示当前时间
+            region: 地区代码（如 'SG'），地区查询后填充
+            port: 端口（数据源为 "IP:端口" 格式时）
+        """
+        self.ip = ip
+        self.line = line
+        self.latency_ms = latency_ms
+        self.speed_mbps = speed_mbps
+        self.source = source
+        self.observed_at = time.time() if observed_at is None else observed_at
+        self.region = region
+        self.port = port
+
+    # 旧版字符串格式: "IP#线路-延迟ms"、"IP-延迟ms"、"IP#速度mb/s"、"IP#标签"、"IP"
+    _TEXT_PATTERN = re.compile(
+        r'^(?P<ip>[^#\-\s]+)\s*(?:#(?P<line>.*?))?(?:-(?P<latency>\d+(?:\.\d+)?)\s*ms)?$')
+    _SPEED_PATTERN = re.compile(r'^(\d+(?:\.\d+)?)\s*mb/s$')
+
+    @classmethod
+    def parse(cls, text: str, source: Optional[str] = None, observed_at: Optional[float] = None) -> 'IPRecord':
+        """
+        解析字符串格式的IP数据
+
+        优先按 IngestParser 的严格格式解析（识别端口并规范化IPv6地址），
+        不符合时按旧版规则宽松解析，无法识别的延迟/速度信息作为线路标签保留。
+
+        Args:
+            text: IP数据字符串
+            source: 数据源
+            observed_at: 获取时间，None表示当前时间
+
+        Returns:
+            IPRecord对象
+        """
+        text = text.strip()
+        record, _ = IngestParser.parse_line(text, source, observed_at)
+        if record is not None:
+            return record
+        match = cls._TEXT_PATTERN.match(text)
+        if match is None:
+            # 与旧版提取IP的规则一致："#" 之前，或 "-" 之前的部分
+            ip, separator, rest = text.partition('#')
+            if not separator:
+                ip, _, rest = text.partition('-')
+            return cls(ip.strip(), line=rest.strip() or None, source=source, observed_at=observed_at)
+
+        line = match.group('line')
+        latency = match.group('latency')
+        speed = None
+        if latency is None and line:
+            speed_match = cls._SPEED_PATTERN.match(line.strip())
+            if speed_match:
+                speed = float(speed_match.group(1))
+                line = None
+        return cls(match.group('ip'), line=line.strip() if line else None,
+                   latency_ms=float(latency) if latency is not None else None,
+                   speed_mbps=speed, source=source, observed_at=observed_at)
+
+    @property
+    def address(self) -> str:
+        """带端口的地址：IP、IP:端口 或 [IPv6]:端口"""
+        if self.port is None:
+            return self.ip
+        return f"[{self.ip}]:{self.port}" if ':' in self.ip else f"{self.ip}:{self.port}"
+
+    def __str__(self) -> str:
+        address = self.address
+        if self.latency_ms is not None:
+            prefix = f"{address}#{self.line}" if self.line else address
+            return f"{prefix}-{self.latency_ms:.2f}ms"
+        if self.speed_mbps is not None:
+            return f"{address}#{self.speed_mbps:g}mb/s"
+        if self.line:
+            return f"{address}#{self.line}"
+        return address
+
+    def __repr__(self) -> str:
+        fields = ', '.join(f"{name}={getattr(self, name)!r}"
+                           for name in ('port', 'line', 'latency_ms', 'speed_mbps', 'source', 'region')
+                           if getattr(self, name) is not None)
+        return f"IPRecord({self.ip!r}{', ' + fields if fields else ''})"
+
+    def _key(self) -> tuple:
+        return self.ip, self.port, self.line, self.latency_ms, self.speed_mbps
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, IPRecord):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __hash__(self) -> int:
+        return hash(self._key())
+
+    def to_dict(self) -> dict:
+        """转换为可JSON序列化的字典"""
+        return {name: getattr(self, name) for name in IPRecord.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'IPRecord':
+        """从 to_dict() 的结果创建记录"""
+        return cls(**data)
+
+
+class IngestParser:
+    """
+    数据源文本行的严格解析器
+
+    每行只做一次预编译正则匹配，接受以下格式并拆分为结构化字段：
+        IPv4[:端口][#标签][-延迟ms]、[IPv6][:端口][#标签][-延迟ms]、IPv6[#标签][-延迟ms]
+    标签为 "速度mb/s" 时记为速度，否则作为线路/地区标签（如 ipdb API 的 "IP#国家"）。
+    IPv4要求每段0~255且没有前导零，IPv6规范化为压缩形式，端口要求1~65535。
+
+    注释行、CIDR网段和无效地址会被拒绝并按原因计数，避免进入地区查询等耗时阶段。
+    """
+
+    # 拒绝原因
+    COMMENT = 'comment'
+    CIDR = 'cidr'
+    INVALID_IP = 'invalid_ip'
+    INVALID_PORT = 'invalid_port'
+    MALFORMED = 'malformed'
+
+    _PATTERN = re.compile(r"""
+        ^(?:
+            \[(?P<ip6_bracket>[0-9A-Fa-f:.]+)\](?::(?P<port6>\d{1,5}))?
+          | (?P<ip4>\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})(?::(?P<port4>\d{1,5}))?
+          | (?P<ip6>[0-9A-Fa-f]*:[0-9A-Fa-f:.]*)
+          | (?P<cidr>[0-9A-Fa-f.:]+/\d{1,3})
+        )
+        \s*(?:\#(?P<tag>.*?))?
+        (?:-(?P<latency>\d+(?:\.\d+)?)\s*ms)?$
+    """, re.VERBOSE)
+    _COMMENT_PREFIXES = ('#', '//', ';')
+
+    def __init__(self):
+        self.accepted = 0
+        self.rejects: Dict[str, int] = {}
+
+    @classmethod
+    def parse_line(cls, text: str, source: Optional[str] = None,
+                   observed_at: Optional[float] = None) -> Tuple[Optional[IPRecord], Optional[str]]:
+        """
+        解析一行（不计数）
+
+        Args:
+            text: 已去除首尾空白的行
+            source: 数据源
+            observed_at: 获取时间，None表示当前时间
+
+        Returns:
+            (IPRecord, None)，或被拒绝时 (None, 拒绝原因)
+        """
+        match = cls._PATTERN.match(text)
+        if match is None:
+            return None, cls.COMMENT if text.startswith(cls._COMMENT_PREFIXES) else cls.MALFORMED
+        ip4, ip6, port = match.group('ip4'), match.group('ip6') or match.group('ip6_bracket'), None
+        if ip4 is not None:
+            port = match.group('port4')
+            for octet in ip4.split('.'):
+                if int(octet) > 255 or (len(octet) > 1 and octet[0] == '0'):
+                    return None, cls.INVALID_IP
+            ip = ip4
+        elif ip6 is not None:
+            port = match.group('port6')
+            try:
+                ip = ipaddress.IPv6Address(ip6).compressed
+            except ValueError:
+                return None, cls.INVALID_IP
+        else:
+            return None, cls.CIDR
+        if port is not None:
+            port = int(port)
+            if not 0 < port < 65536:
+                return None, cls.INVALID_PORT
+
+        tag = match.group('tag')
+        tag = tag.strip() if tag else None
+        latency = match.group('latency')
+        speed = None
+        if latency is None and tag:
+            speed_match = IPRecord._SPEED_PATTERN.match(tag)
+            if speed_match:
+                speed = float(speed_match.group(1))
+                tag = None
+        return IPRecord(ip, line=tag or None, latency_ms=float(latency) if latency is not None else None,
+                        speed_mbps=speed, source=source, observed_at=observed_at, port=port), None
+
+    def parse(self, text: str, source: Optional[str] = None,
+              observed_at: Optional[float] = None) -> Optional[IPRecord]:
+        """解析一行并计数，被拒绝时返回None"""
+        record, reason = self.parse_line(text, source, observed_at)
+        if record is None:
+            self.rejects[reason] = self.rejects.get(reason, 0) + 1
+        else:
+            self.accepted += 1
+        return record
+
+    def parse_lines(self, lines: Iterable[str], source: Optional[str] = None,
+                    observed_at: Optional[float] = None) -> Iterator[IPRecord]:
+        """逐行解析，跳过空行，只产出有效的IP数据"""
+        for line in lines:
+            line = line.strip()
+            if line:
+                record = self.parse(line, source, observed_at)
+                if record is not None:
+                    yield record
+
+    @property
+    def rejected(self) -> int:
+        """被拒绝的总行数"""
+        return sum(self.rejects.values())
+
+
+class MergedIPRecord(IPRecord):
+    """
+    同一IP地址的多条数据合并后的记录
+
+    latency_ms 为最低延迟，speed_mbps 为最高速度，line 为最低延迟那条数据的线路（没有延迟时为第一个线路），
+    source 为第一个数据源，observed_at 为最近一次获取时间；
+    另外保留延迟中位数、所有线路、所有数据源和合并的数据条数。
+    """
+
+    __slots__ = ('latency_median_ms', 'carriers', 'sources', 'observations')
+
+    def __init__(self, ip: str, line: Optional[str] = None, latency_ms: Optional[float] = None,
+                 speed_mbps: Optional[float] = None, source: Optional[str] = None,
+                 observed_at: Optional[float] = None, region: Optional[str] = None,
+                 port: Optional[int] = None, latency_median_ms: Optional[float] = None,
+                 carriers: Iterable[str] = (), sources: Iterable[str] = (), observations: int = 1):
+        """
+        Args:
+            latency_median_ms: 所有延迟的中位数
+            carriers: 所有线路（按首次出现顺序）
+            sources: 所有数据源（按首次出现顺序）
+            observations: 合并的数据条数
+            其余参数与 IPRecord 相同
+        """
+        super().__init__(ip, line, latency_ms, speed_mbps, source, observed_at, region, port)
+        self.latency_median_ms = latency_median_ms
+        self.carriers = tuple(carriers)
+        self.sources = tuple(sources)
+        self.observations = observations
+
+    def __repr__(self) -> str:
+        return (f"MergedIPRecord({self.ip!r}, latency_ms={self.latency_ms!r}, speed_mbps={self.speed_mbps!r}, "
+                f"carriers={self.carriers!r}, sources={self.sources!r}, observations={self.observations})")
+
+    def to_dict(self) -> dict:
+        data = super().to_dict()
+        data.update(latency_median_ms=self.latency_median_ms, carriers=list(self.carriers),
+                    sources=list(self.sources), observations=self.observations)
+        return data
+
+
+class _MergeState:
+    """merge_records 中单个IP地址的累计状态"""
+
+    __slots__ = ('first', 'best', 'latencies', 'speed', 'carriers', 'sources', 'observed_at', 'count')
+
+    def __init__(self, record: IPRecord):
+        self.first = record
+        self.best: Optional[IPRecord] = None
+        self.latencies: List[float] = []
+        self.speed: Optional[float] = None
+        self.carriers: Dict[str, None] = {}
+        self.sources: Dict[str, None] = {}
+        self.observed_at = record.observed_at
+        self.count = 0
+
+    def add(self, record: IPRecord) -> None:
+        self.count += 1
+        if record.latency_ms is not None:
+            self.latencies.append(record.latency_ms)
+            if self.best is None or record.latency_ms < self.best.latency_ms:
+                self.best = record
+        if record.speed_mbps is not None and (self.speed is None or record.speed_mbps > self.speed):
+            self.speed = record.speed_mbps
+        if record.line:
+            self.carriers[record.line] = None
+        if record.source:
+            self.sources[record.source] = None
+        if record.observed_at > self.observed_at:
+            self.observed_at = record.observed_at
+
+    def merged(self) -> MergedIPRecord:
+        first = self.first
+        line = self.best.line if self.best is not None else next(iter(self.carriers), None)
+        return MergedIPRecord(
+            first.ip, line,
+            self.best.latency_ms if self.best is not None else None,
+            self.speed, first.source, self.observed_at, first.region, first.port,
+            latency_median_ms=statistics.median(self.latencies) if self.latencies else None,
+            carriers=self.carriers, sources=self.sources, observations=self.count)
+
+
+def merge_records(records: Iterable[IPRecord]) -> List[MergedIPRecord]:
+    """
+    按IP地址合并数据：一次遍历，结果按每个地址首次出现的顺序排列
+
+    Args:
+        records: IP数据
+
+    Returns:
+        每个IP地址一条的合并记录
+    """
+    states: Dict[str, _MergeState] = {}
+    for record in records:
+        state = states.get(record.ip)
+        if state is None:
+            state = states[record.ip] = _MergeState(record)
+        state.add(record)
+    return [state.merged() for state in states.values()]
+
+
+class IPScorer:
+    """
+    DNS候选IP的多指标评分
+
+    每个指标先归一化到0~1（越大越好），再按权重加权平均：
+        latency   - 延迟，0ms为1，达到 latency_scale 及以上为0，没有延迟为0
+        speed     - 速度，达到 speed_scale 及以上为1，没有速度为0
+        sources   - 报告该IP的数据源数量（MergedIPRecord.sources），达到 max_sources 为1
+        freshness - 获取时间的新鲜度，每经过 freshness_half_life 秒减半
+        region    - 地区在 preferred_regions 中为1，否则为0（未指定 preferred_regions 时不参与评分）
+    """
+
+    DEFAULT_WEIGHTS = {'latency': 0.4, 'speed': 0.25, 'sources': 0.15, 'freshness': 0.1, 'region': 0.1}
+
+    def __init__(self, weights: Dict[str, float] = None, latency_scale: float = 200.0,
+                 speed_scale: float = 50.0, max_sources: int = 3, freshness_half_life: float = 6 * 3600,
+                 preferred_regions: List[str] = None, now: float = None):
+        """
+        Args:
+            weights: 各指标的权重，未指定的指标使用 DEFAULT_WEIGHTS，权重为0表示不参与评分
+            latency_scale: 延迟得分为0的延迟（毫秒）
+            speed_scale: 速度得分为1的速度（mb/s）
+            max_sources: 数据源得分为1的数据源数量
+            freshness_half_life: 新鲜度半衰期（秒）
+            preferred_regions: 优先的地区代码列表
+            now: 计算新鲜度的当前时间，None表示每次评分时的当前时间
+        """
+        self.weights = dict(self.DEFAULT_WEIGHTS)
+        self.weights.update(weights or {})
+        unknown = set(self.weights) - set(self.DEFAULT_WEIGHTS)
+        if unknown:
+            raise ValueError(f"未知的评分指标: {sorted(unknown)}")
+        self.latency_scale = latency_scale
+        self.speed_scale = speed_scale
+        self.max_sources = max_sources
+        self.freshness_half_life = freshness_half_life
+        self.preferred_regions = {region.upper() for region in preferred_regions} if preferred_regions else None
+        self.now = now
+
+    def components(self, record: IPRecord, now: float = None) -> Dict[str, float]:
+        """
+        计算各指标的归一化得分
+
+        Args:
+            record: IP数据
+            now: 当前时间，None表示使用实例配置或当前时间
+
+        Returns:
+            指标名到得分（0~1）的映射
+        """
+        now = now if now is not None else (self.now if self.now is not None else time.time())
+        latency = record.latency_ms
+        speed = record.speed_mbps
+        sources = record.sources if isinstance(record, MergedIPRecord) else (record.source,)
+        scores = {
+            'latency': 0.0 if latency is None else max(0.0, 1.0 - latency / self.latency_scale),
+            'speed': 0.0 if speed is None else min(1.0, speed / self.speed_scale),
+            'sources': min(1.0, len([source for source in sources if source]) / self.max_sources),
+            'freshness': 0.5 ** (max(0.0, now - record.observed_at) / self.freshness_half_life),
+        }
+        if self.preferred_regions is not None:
+            scores['region'] = 1.0 if record.region and record.region.upper() in self.preferred_regions else 0.0
+        return scores
+
+    def score(self, record: IPRecord, now: float = None) -> float:
+        """计算加权得分（0~1）"""
+        total = weight_sum = 0.0
+        for name, value in self.components(record, now).items():
+            weight = self.weights[name]
+            total += weight * value
+            weight_sum += weight
+        return total / weight_sum if weight_sum else 0.0
+
+    def top_k(self, records: Iterable[IPRecord], k: int) -> List[IPRecord]:
+        """
+        选出得分最高的k个不同IP，同一IP只保留得分最高的一条，得分相同时保持输入顺序
+
+        使用大小为k的堆（heapq.nlargest），不对全部数据排序。
+
+        Args:
+            records: IP数据（也接受旧版字符串格式）
+            k: 选取数量
+
+        Returns:
+            按得分从高到低排列的IP数据
+        """
+        now = self.now if self.now is not None else time.time()
+        best: Dict[str, Tuple[float, int, IPRecord]] = {}
+        for index, record in enumerate(to_records(records)):
+            entry = (self.score(record, now), -index, record)
+            current = best.get(record.ip)
+            if current is None or entry[:2] > current[:2]:
+                best[record.ip] = entry
+        return [record for _, _, record in heapq.nlargest(k, best.values(), key=lambda entry: entry[:2])]
+
+    def rank(self, records: Iterable[IPRecord]) -> List[IPRecord]:
+        """按得分从高到低排列所有不同的IP"""
+        records = to_records(records)
+        return self.top_k(records, len(records))
+
+
+# 线路名称到运营商代码的映射（移动CM、电信CT、联通CU）
+CARRIER_ALIASES = {
+    'CM': 'CM', 'CMCC': 'CM', 'MOBILE': 'CM', '移动': 'CM',
+    'CT': 'CT', 'CTCC': 'CT', 'TELECOM': 'CT', '电信': 'CT',
+    'CU': 'CU', 'CUCC': 'CU', 'UNICOM': 'CU', '联通': 'CU',
+}
+_CARRIER_KEYWORDS = ('移动', '电信', '联通')
+
+
+def normalize_carrier(line: Optional[str]) -> Optional[str]:
+    """
+    将线路名称规范化为运营商代码
+
+    Args:
+        line: 线路名称（如 电信、CM、中国移动、cucc）
+
+    Returns:
+        'CM'、'CT'、'CU'，无法识别时返回None
+    """
+    if not line:
+        return None
+    name = line.strip().upper()
+    carrier = CARRIER_ALIASES.get(name)
+    if carrier is None:
+        carrier = next((CARRIER_ALIASES[keyword] for keyword in _CARRIER_KEYWORDS if keyword in name), None)
+    return carrier
+
+
+class CarrierIndex:
+    """
+    按运营商分区的IP索引
+
+    每个运营商保存一个按延迟从低到高排列的列表（延迟相同时速度高的优先，再按输入顺序，
+    没有延迟的排在最后），同一运营商下每个IP只保留最佳的一条。
+    构建时排序一次，之后取某运营商前k个IP为O(k)，按延迟上限查询为O(log n + k)。
+    查询无法识别的运营商时返回空结果。
+    MergedIPRecord 会按其所有线路（carriers）建立索引，因此建议传入合并前的数据以保留各线路的延迟。
+    """
+
+    def __init__(self, records: Iterable[IPRecord] = ()):
+        """
+        Args:
+            records: IP数据（也接受旧版字符串格式），无法识别运营商的数据不进入索引
+        """
+        partitions: Dict[str, Dict[str, Tuple[tuple, IPRecord]]] = {}
+        for index, record in enumerate(to_records(records)):
+            key = (math.inf if record.latency_ms is None else record.latency_ms,
+                   -(record.speed_mbps or 0.0), index)
+            lines = record.carriers if isinstance(record, MergedIPRecord) else (record.line,)
+            for carrier in {normalize_carrier(line) for line in lines} - {None}:
+                best = partitions.setdefault(carrier, {})
+                current = best.get(record.ip)
+                if current is None or key < current[0]:
+                    best[record.ip] = (key, record)
+
+        self._records: Dict[str, List[IPRecord]] = {}
+        self._latencies: Dict[str, List[float]] = {}
+        for carrier, best in partitions.items():
+            entries = sorted(best.values(), key=lambda entry: entry[0])
+            self._records[carrier] = [record for _, record in entries]
+            self._latencies[carrier] = [key[0] for key, _ in entries]
+
+    def _carrier_records(self, carrier: str) -> List[IPRecord]:
+        """返回某运营商的IP数据，无法识别的运营商返回空列表"""
+        return self._records.get(normalize_carrier(carrier), [])
+
+    def carriers(self) -> List[str]:
+        """返回索引中的运营商代码"""
+        return sorted(self._records)
+
+    def __len__(self) -> int:
+        return sum(len(records) for records in self._records.values())
+
+    def count(self, carrier: str) -> int:
+        """返回某运营商的IP数量"""
+        return len(self._carrier_records(carrier))
+
+    def best(self, carrier: str, k: int = None) -> List[IPRecord]:
+        """
+        返回某运营商延迟最低的k个IP
+
+        Args:
+            carrier: 运营商（CM/CT/CU，或 移动/电信/联通 等别名）
+            k: 数量，None表示全部
+
+        Returns:
+            按延迟从低到高排列的IP数据
+        """
+        return self._carrier_records(carrier)[:k]
+
+    def within(self, carrier: str, max_latency: float, k: int = None) -> List[IPRecord]:
+        """
+        返回某运营商延迟低于max_latency的IP（不含没有延迟的数据），与 filter_by_latency 一致
+
+        Args:
+            carrier: 运营商
+            max_latency: 延迟上限（毫秒，不含）
+            k: 最多返回的数量，None表示全部
+
+        Returns:
+            按延迟从低到高排列的IP数据
+        """
+        carrier = normalize_carrier(carrier)
+        end = bisect.bisect_left(self._latencies.get(carrier, []), max_latency)
+        if k is not None:
+            end = min(end, k)
+        return self._records.get(carrier, [])[:end]
+
+    def best_per_carrier(self, k: int) -> Dict[str, List[IPRecord]]:
+        """返回每个运营商延迟最低的k个IP"""
+        return {carrier: records[:k] for carrier, records in self._records.items()}
+
+
+def to_records(items: Iterable, source: Optional[str] = None) -> List[IPRecord]:
+    """
+    将IP数据统一转换为IPRecord列表，字符串按旧版格式解析
+
+    Args:
+        items: IPRecord或字符串的可迭代对象
+        source: 字符串记录的数据源
+
+    Returns:
+        IPRecord列表
+    """
+    return [item if isinstance(item, IPRecord) else IPRecord.parse(item, source=source) for item in items]
+
+
+class IPBatch:
+    """
+    列式存储的IP数据批次，适合百万级候选IP（如展开 CloudflareST/ip.txt 中的网段）
+
+    地址以打包整数保存：IPv4 存入 addr_lo（addr_hi 为0），IPv6 拆为高/低64位，family 区分4/6；
+    延迟、速度为 float32（缺失为NaN），线路和数据源保存为整数编号，名称表在 carriers/sources 中（编号0表示无）。
+    每条数据约28字节，去重、排序、过滤和切片都按整列操作。需要安装 numpy。
+    """
+
+    COLUMNS = ('addr_hi', 'addr_lo', 'family', 'latency_ms', 'speed_mbps', 'carrier_id', 'source_id')
+    _DTYPES = {
+        'addr_hi': 'uint64', 'addr_lo': 'uint64', 'family': 'uint8',
+        'latency_ms': 'float32', 'speed_mbps': 'float32', 'carrier_id': 'uint8', 'source_id': 'uint16',
+    }
+
+    def __init__(self, columns: Dict[str, 'np.ndarray'] = None, carriers: List[Optional[str]] = None,
+                 sources: List[Optional[str]] = None):
+        """
+        Args:
+            columns: 列名到数组的映射，缺少的列按空批次创建
+            carriers: 线路名称表，carrier_id 为其下标，下标0固定为None
+            sources: 数据源名称表，source_id 为其下标，下标0固定为None
+        """
+        if not NUMPY_AVAILABLE:
+            raise ImportError("IPBatch 需要安装 numpy: pip install numpy")
+        columns = columns or {}
+        length = len(next(iter(columns.values()))) if columns else 0
+        for name in self.COLUMNS:
+            if name in columns:
+                column = np.asarray(columns[name], dtype=self._DTYPES[name])
+            elif name in ('latency_ms', 'speed_mbps'):
+                column = np.full(length, np.nan, dtype=self._DTYPES[name])
+            else:
+                column = np.zeros(length, dtype=self._DTYPES[name])
+            if len(column) != length:
+                raise ValueError(f"列 {name} 的长度 {len(column)} 与其他列不一致（{length}）")
+            setattr(self, name, column)
+        self.carriers = carriers or [None]
+        self.sources = sources or [None]
+
+    @staticmethod
+    def _pack_address(ip: str) -> Optional[Tuple[int, int, int]]:
+        """将IP地址字符串转换为 (addr_hi, addr_lo, family)，无效地址返回None"""
+        try:
+            return 0, int.from_bytes(socket.inet_pton(socket.AF_INET, ip), 'big'), 4
+        except OSError:
+            pass
+        try:
+            value = int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), 'big')
+        except OSError:
+            return None
+        return value >> 64, value & 0xFFFFFFFFFFFFFFFF, 6
+
+    @classmethod
+    def from_records(cls, records: Iterable) -> 'IPBatch':
+        """
+        从IPRecord（或旧版字符串）创建批次，无效的IP地址会被跳过
+
+        Args:
+            records: IP数据
+
+        Returns:
+            IPBatch对象
+        """
+        carriers: List[Optional[str]] = [None]
+        sources: List[Optional[str]] = [None]
+        carrier_ids = {None: 0}
+        source_ids = {None: 0}
+        rows = []
+        skipped = 0
+        nan = float('nan')
+        for record in to_records(records):
+            packed = cls._pack_address(record.ip)
+            if packed is None:
+                skipped += 1
+                continue
+            carrier_id = carrier_ids.get(record.line)
+            if carrier_id is None:
+                carrier_id = carrier_ids[record.line] = len(carriers)
+                carriers.append(record.line)
+            source_id = source_ids.get(record.source)
+            if source_id is None:
+                source_id = source_ids[record.source] = len(sources)
+                sources.append(record.source)
+            rows.append(packed + (
+                nan if record.latency_ms is None else record.latency_ms,
+                nan if record.speed_mbps is None else record.speed_mbps,
+                carrier_id, source_id))
+        if skipped:
+            print(f"跳过 {skipped} 条无效IP地址")
+        if len(carriers) > 256 or len(sources) > 65536:
+            raise ValueError("线路或数据源种类过多，无法编号")
+        columns = dict(zip(('addr_hi', 'addr_lo', 'family', 'latency_ms', 'speed_mbps', 'carrier_id', 'source_id'),
+                           zip(*rows))) if rows else {}
+        return cls({name: list(values) for name, values in columns.items()}, carriers, sources)
+
+    @classmethod
+    def from_cidrs(cls, cidrs: Iterable[str], source: Optional[str] = None,
+                   max_addresses: int = 16 * 1024 * 1024) -> 'IPBatch':
+        """
+        将网段展开为逐个IP地址的批次（IPv6网段的前缀长度需不小于64）
+
+        Args:
+            cidrs: 网段或单个IP地址，如 "104.16.0.0/13"
+            source: 所有地址的数据源
+            max_addresses: 展开后的最大地址数，超过时抛出ValueError
+
+        Returns:
+            IPBatch对象
+        """
+        his, los, families = [], [], []
+        total = 0
+        for cidr in cidrs:
+            cidr = cidr.strip()
+            if not cidr or cidr.startswith('#'):
+                continue
+            network = ipaddress.ip_network(cidr, strict=False)
+            if network.version == 6 and network.prefixlen < 64:
+                raise ValueError(f"IPv6网段前缀过短，无法展开: {cidr}")
+            total += network.num_addresses
+            if total > max_addresses:
+                raise ValueError(f"展开后的地址数超过上限 {max_addresses}: {cidr}")
+            base = int(network.network_address)
+            lo = np.arange(base & 0xFFFFFFFFFFFFFFFF, (base & 0xFFFFFFFFFFFFFFFF) + network.num_addresses,
+                           dtype=np.uint64)
+            his.append(np.full(len(lo), base >> 64, dtype=np.uint64))
+            los.append(lo)
+            families.append(np.full(len(lo), network.version, dtype=np.uint8))
+        if not los:
+            return cls()
+        sources = [None] if source is None else [None, source]
+        return cls({
+            'addr_hi': np.concatenate(his), 'addr_lo': np.concatenate(los), 'family': np.concatenate(families),
+            'source_id': np.full(total, len(sources) - 1, dtype=np.uint16),
+        }, sources=sources)
+
+    @classmethod
+    def from_file(cls, file_path: str, max_addresses: int = 16 * 1024 * 1024) -> 'IPBatch':
+        """展开网段列表文件（如 CloudflareST/ip.txt，每行一个网段或IP）"""
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return cls.from_cidrs(f, source=file_path, max_addresses=max_addresses)
+
+    @classmethod
+    def concat(cls, batches: List['IPBatch']) -> 'IPBatch':
+        """
+        按顺序合并多个批次，线路和数据源编号会重新映射
+
+        Args:
+            batches: 批次列表
+
+        Returns:
+            合并后的IPBatch对象
+        """
+        carriers: List[Optional[str]] = [None]
+        sources: List[Optional[str]] = [None]
+        columns = {name: [] for name in cls.COLUMNS}
+        for batch in batches:
+            for names, merged, column in ((batch.carriers, carriers, 'carrier_id'),
+                                          (batch.sources, sources, 'source_id')):
+                mapping = np.zeros(len(names), dtype=cls._DTYPES[column])
+                for index, name in enumerate(names[1:], 1):
+                    if name not in merged:
+                        merged.append(name)
+                    mapping[index] = merged.index(name)
+                columns[column].append(mapping[getattr(batch, column)])
+            for name in cls.COLUMNS:
+                if name not in ('carrier_id', 'source_id'):
+                    columns[name].append(getattr(batch, name))
+        if not batches:
+            return cls()
+        return cls({name: np.concatenate(arrays) for name, arrays in columns.items()}, carriers, sources)
+
+    def __len__(self) -> int:
+        return len(self.addr_lo)
+
+    @property
+    def nbytes(self) -> int:
+        """所有列占用的字节数"""
+        return sum(getattr(self, name).nbytes for name in self.COLUMNS)
+
+    def _take(self, index) -> 'IPBatch':
+        return IPBatch({name: getattr(self, name)[index] for name in self.COLUMNS}, self.carriers, self.sources)
+
+    def __getitem__(self, index):
+        """整数下标返回IPRecord；切片、下标数组或布尔掩码返回新的批次"""
+        if isinstance(index, (int, np.integer)):
+            return self._record(int(index))
+        return self._take(index)
+
+    def _format_address(self, index: int) -> str:
+        if self.family[index] == 4:
+            return socket.inet_ntop(socket.AF_INET, int(self.addr_lo[index]).to_bytes(4, 'big'))
+        value = (int(self.addr_hi[index]) << 64) | int(self.addr_lo[index])
+        return socket.inet_ntop(socket.AF_INET6, value.to_bytes(16, 'big'))
+
+    def _record(self, index: int) -> IPRecord:
+        latency = float(self.latency_ms[index])
+        speed = float(self.speed_mbps[index])
+        return IPRecord(self._format_address(index), self.carriers[self.carrier_id[index]],
+                        None if math.isnan(latency) else round(latency, 2),
+                        None if math.isnan(speed) else round(speed, 2),
+                        source=self.sources[self.source_id[index]])
+
+    def ips(self) -> List[str]:
+        """所有IP地址字符串"""
+        return [self._format_address(index) for index in range(len(self))]
+
+    def to_records(self) -> List[IPRecord]:
+        """转换为IPRecord列表（只在输出时使用）"""
+        return [self._record(index) for index in range(len(self))]
+
+    def dedup(self) -> 'IPBatch':
+        """按IP地址去重，保留每个地址首次出现的行，顺序不变"""
+        keys = np.empty(len(self), dtype=[('family', 'u1'), ('hi', 'u8'), ('lo', 'u8')])
+        keys['family'] = self.family
+        keys['hi'] = self.addr_hi
+        keys['lo'] = self.addr_lo
+        _, first_index = np.unique(keys, return_index=True)
+        return self._take(np.sort(first_index))
+
+    def _sort_keys(self, by, descending) -> list:
+        """构建 np.lexsort 使用的排序键（最后一个为主键），缺失值（NaN）总是排在最后"""
+        by = [by] if isinstance(by, str) else list(by)
+        descending = descending if isinstance(descending, (list, tuple)) else [descending] * len(by)
+        keys = []
+        for name, desc in zip(by, descending):
+            if name == 'address':
+                columns = [self.family, self.addr_hi, self.addr_lo]
+                keys.append([~column if desc else column for column in columns])
+                continue
+            column = getattr(self, name)
+            if column.dtype.kind == 'f':
+                keys.append([np.isnan(column), -column if desc else column])
+            else:
+                keys.append([~column if desc else column])
+        return [key for column_keys in reversed(keys) for key in reversed(column_keys)]
+
+    def sort(self, by=('latency_ms',), descending=False) -> 'IPBatch':
+        """
+        按一列或多列稳定排序，缺失值（NaN）总是排在最后
+
+        Args:
+            by: 列名或列名列表，'address' 表示按IP地址
+            descending: 是否降序，可以是与 by 对应的列表
+
+        Returns:
+            排序后的IPBatch对象
+        """
+        flat_keys = self._sort_keys(by, descending)
+        return self._take(np.lexsort(flat_keys)) if flat_keys else self
+
+    def top_k_indices(self, k: int, by=('latency_ms', 'speed_mbps'), descending=(False, True)) -> 'np.ndarray':
+        """
+        选出排序后前k行的下标，结果与 sort(by, descending)[:k] 完全一致
+
+        先用 argpartition 按主键选出候选行（包含与第k名并列的所有行），再只对候选行完整排序，
+        百万行数据只需线性时间。
+
+        Args:
+            k: 选取的行数
+            by: 排序列，第一列为主键
+            descending: 是否降序，可以是与 by 对应的列表
+
+        Returns:
+            按排序顺序排列的下标数组
+        """
+        length = len(self)
+        k = max(0, min(k, length))
+        if k == 0:
+            return np.empty(0, dtype=np.intp)
+        flat_keys = self._sort_keys(by, descending)
+        if k < length:
+            primary_name = by if isinstance(by, str) else by[0]
+            primary_desc = descending if not isinstance(descending, (list, tuple)) else descending[0]
+            primary = self._primary_key(primary_name, primary_desc)
+            kth_value = primary[np.argpartition(primary, k - 1)[k - 1]]
+            candidates = np.flatnonzero(primary <= kth_value)
+        else:
+            candidates = np.arange(length)
+        order = np.lexsort([key[candidates] for key in flat_keys])
+        return candidates[order[:k]]
+
+    def _primary_key(self, name: str, descending: bool) -> 'np.ndarray':
+        """把主排序列转换为可直接比较大小的数组（升序，缺失值为+inf）"""
+        if name == 'address':
+            # 只按地址族和高64位预选，低64位在候选行排序时比较
+            key = self.family.astype(np.float64) * 2.0 ** 64 + self.addr_hi.astype(np.float64)
+            return -key if descending else key
+        column = getattr(self, name).astype(np.float64)
+        if column.dtype.kind == 'f':
+            column = np.where(np.isnan(column), np.inf, -column if descending else column)
+        return column
+
+    def top_k(self, k: int, by=('latency_ms', 'speed_mbps'), descending=(False, True)) -> 'IPBatch':
+        """返回排序后的前k行，默认延迟最低优先、其次速度最高"""
+        return self._take(self.top_k_indices(k, by, descending))
+
+    def latency_mask(self, max_latency: float, keep_no_latency: bool = True) -> 'np.ndarray':
+        """
+        延迟过滤掩码，与 IPExtractor.filter_by_latency 的规则一致
+
+        Args:
+            max_latency: 最大延迟阈值（毫秒），延迟必须小于该值
+            keep_no_latency: 是否保留没有延迟和速度信息的行（只有速度信息的行始终保留）
+
+        Returns:
+            布尔数组
+        """
+        has_latency = ~np.isnan(self.latency_ms)
+        mask = has_latency & (self.latency_ms < max_latency)
+        mask |= ~has_latency & ~np.isnan(self.speed_mbps)
+        if keep_no_latency:
+            mask |= ~has_latency & np.isnan(self.speed_mbps)
+        return mask
+
+    def speed_mask(self, min_speed: float, keep_no_speed: bool = False) -> 'np.ndarray':
+        """速度过滤掩码：速度不低于 min_speed（mb/s）的行"""
+        mask = self.speed_mbps >= min_speed
+        if keep_no_speed:
+            mask |= np.isnan(self.speed_mbps)
+        return mask
+
+    def filter(self, mask) -> 'IPBatch':
+        """按布尔掩码保留行"""
+        return self._take(np.asarray(mask, dtype=bool))
+
+
+# 解析延迟数据的正则表达式
+LATENCY_PATTERN = re.compile(r'(\d+(\.\d+)?)\s*(ms|毫秒)?')
+
+
+class TableSiteSpec:
+    """
+    HTML网站表格的提取规则
+
+    每行按列号取出IP、线路和延迟生成IPRecord。
+    列数少于用到的最大列号或延迟无法解析的行会被跳过。
+    """
+
+    __slots__ = ('host', 'row_class', 'ip_column', 'line_column', 'latency_column', 'min_columns')
+
+    def __init__(self, host: str, ip_column: int, latency_column: int,
+                 line_column: Optional[int] = None, row_class: Optional[str] = None):
+        """
+        Args:
+            host: 网站主机名，用于按URL选择规则
+            ip_column: IP地址所在列（从0开始）
+            latency_column: 延迟所在列
+            line_column: 线路名称所在列，None表示没有线路列
+            row_class: 只提取class匹配该正则表达式的行，None表示所有行
+        """
+        self.host = host
+        self.ip_column = ip_column
+        self.latency_column = latency_column
+        self.line_column = line_column
+        self.row_class = re.compile(row_class) if row_class else None
+        columns = [ip_column, latency_column] + ([line_column] if line_column is not None else [])
+        self.min_columns = max(columns) + 1
+
+    @classmethod
+    def from_dict(cls, spec: dict) -> 'TableSiteSpec':
+        """从配置字典创建规则，键与构造参数相同"""
+        return cls(**spec)
+
+    def parse_rows(self, rows: Iterable[List[str]], source: Optional[str] = None) -> List[IPRecord]:
+        """
+        从表格行中提取IP数据
+
+        Args:
+            rows: 每行单元格文本的可迭代对象
+            source: 数据源URL，记录在每条IP数据中
+
+        Returns:
+            IP数据列表
+        """
+        ip_column = self.ip_column
+        line_column = self.line_column
+        latency_column = self.latency_column
+        min_columns = self.min_columns
+        match_latency = LATENCY_PATTERN.match
+        observed_at = time.time()
+        data = []
+        for columns in rows:
+            if len(columns) < min_columns:
+                continue
+            latency_match = match_latency(columns[latency_column].strip())
+            if not latency_match:
+                continue
+            line = columns[line_column].strip() if line_column is not None else None
+            data.append(IPRecord(columns[ip_column].strip(), line, float(latency_match.group(1)),
+                                 source=source, observed_at=observed_at))
+        return data
+
+    def parse_soup(self, soup: BeautifulSoup, source: Optional[str] = None) -> List[IPRecord]:
+        """从已解析的页面中提取IP数据"""
+        return self.parse_rows(iter_table_rows_bs4(soup, self.row_class), source)
+
+
+# 默认支持的HTML网站表格规则
+DEFAULT_HTML_SITES = [
+    {'host': 'cf.090227.xyz', 'line_column': 0, 'ip_column': 1, 'latency_column': 2},
+    {'host': 'stock.hostmonit.com', 'line_column': 0, 'ip_column': 1, 'latency_column': 2,
+     'row_class': r'el-table__row'},
+    {'host': 'ip.164746.xyz', 'ip_column': 0, 'latency_column': 4},
+    {'host': 'monitor.gacjie.cn', 'line_column': 0, 'ip_column': 1, 'latency_column': 4},
+    {'host': '345673.xyz', 'line_column': 0, 'ip_column': 1, 'latency_column': 3,
+     'row_class': r'line-cm|line-ct|line-cu'},
+]
+
+
+def parse_table_page(content: bytes, spec: TableSiteSpec, html_parser: str = 'html.parser',
+                     table_only: bool = True, source: Optional[str] = None) -> List[IPRecord]:
+    """
+    按表格规则解析HTML页面
+
+    模块级函数，可在解析进程池中执行。
+
+    Args:
+        content: 页面原始字节
+        spec: 表格提取规则
+        html_parser: 解析引擎，'lxml' 或 'html.parser'
+        table_only: 是否只解析表格行
+        source: 数据源URL
+
+    Returns:
+        IP数据列表
+    """
+    row_class = spec.row_class
+    if html_parser == 'lxml':
+        if table_only:
+            return spec.parse_rows(iter_table_rows_tokenized(content, row_class), source)
+        return spec.parse_rows(iter_table_rows_lxml(content, row_class), source)
+    parse_only = table_row_strainer(row_class) if table_only else None
+    soup = BeautifulSoup(content, 'html.parser', parse_only=parse_only)
+    return spec.parse_rows(iter_table_rows_bs4(soup, row_class), source)
+
+
+# 按进程数共享的HTML解析进程池
+_parse_executors: Dict[int, concurrent.futures.ProcessPoolExecutor] = {}
+_parse_executor_lock = threading.Lock()
+
+
+def _get_parse_executor(processes: int) -> concurrent.futures.ProcessPoolExecutor:
+    """获取HTML解析使用的共享进程池"""
+    with _parse_executor_lock:
+        executor = _parse_executors.get(processes)
+        if executor is None:
+            # 获取线程仍在运行时fork不安全，优先使用forkserver
+            start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=processes, mp_context=multiprocessing.get_context(start_method))
+            _parse_executors[processes] = executor
+        return executor
+
+
+def _discard_parse_executor(executor: concurrent.futures.ProcessPoolExecutor) -> None:
+    """丢弃已损坏的解析进程池，下次使用时重新创建"""
+    with _parse_executor_lock:
+        for processes, cached in list(_parse_executors.items()):
+            if cached is executor:
+                del _parse_executors[processes]
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+# 记录当前线程最近一次请求中DNS解析（dns_seconds）和建立连接（TCP+TLS，seconds）所花费的时间
+_connect_timing = threading.local()
+
+
+class _ConnectTimingMixin:
+    """
+    为urllib3连接计时，连接复用时不会调用connect，耗时记为0
+
+    建立连接时先解析一次主机名并单独计时，再依次连接解析出的地址（数字地址不会再次解析）。
+    """
+
+    def connect(self):
+        start_time = time.perf_counter()
+        dns_before = getattr(_connect_timing, 'dns_seconds', 0.0)
+        try:
+            super().connect()
+        finally:
+            dns_seconds = getattr(_connect_timing, 'dns_seconds', 0.0) - dns_before
+            _connect_timing.seconds = (getattr(_connect_timing, 'seconds', 0.0)
+                                       + time.perf_counter() - start_time - dns_seconds)
+
+    def _new_conn(self):
+        host = self._dns_host
+        start_time = time.perf_counter()
+        try:
+            addresses = socket.getaddrinfo(host.strip('[]'), self.port, urllib3_connection.allowed_gai_family(),
+                                           socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            raise NameResolutionError(self.host, self, e) from e
+        finally:
+            _connect_timing.dns_seconds = (getattr(_connect_timing, 'dns_seconds', 0.0)
+                                           + time.perf_counter() - start_time)
+
+        error = None
+        try:
+            for index, (_, _, _, _, sockaddr) in enumerate(addresses):
+                self._dns_host = sockaddr[0]
+                try:
+                    return super()._new_conn()
+                except ConnectTimeoutError as e:
+                    # 与urllib3一致：依次尝试解析出的每个地址，全部失败时抛出最后一个错误
+                    # （NewConnectionError 是 ConnectTimeoutError 的子类）
+                    error = e
+            raise error or NewConnectionError(self, "Failed to establish a new connection: "
+                                                    "getaddrinfo returns an empty list")
+        finally:
+            self._dns_host = host
+
+
+class _TimedHTTPConnection(_ConnectTimingMixin, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_ConnectTimingMixin, HTTPSConnection):
+    pass
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _TimedHTTPAdapter(HTTPAdapter):
+    """使用可计时连接池的HTTPAdapter"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _TimedHTTPConnectionPool,
+            'https': _TimedHTTPSConnectionPool,
+        }
+
+
+_shared_sessions: Dict[Tuple[int, int], requests.Session] = {}
+_shared_sessions_lock = threading.Lock()
+
+
+def create_session(pool_size: int = 10, max_retries: int = 2) -> requests.Session:
+    """
+    创建带连接池和重试机制的HTTP会话
+
+    Args:
+        pool_size: 每个主机保持的最大连接数
+        max_retries: 连接失败或服务端临时错误（429/5xx）时的最大重试次数
+
+    Returns:
+        requests.Session对象
+    """
+    retry = Retry(
+        total=max_retries,
+        backoff_factor=0.3,
+        status_forcelist=(429, 500, 502, 503, 504),
+        raise_on_status=False
+    )
+    adapter = _TimedHTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_shared_session(pool_size: int = 10, max_retries: int = 2) -> requests.Session:
+    """
+    获取进程内共享的HTTP会话，相同配置的IPExtractor实例复用同一个连接池
+
+    Args:
+        pool_size: 每个主机保持的最大连接数
+        max_retries: 最大重试次数
+
+    Returns:
+        共享的requests.Session对象
+    """
+    key = (pool_size, max_retries)
+    with _shared_sessions_lock:
+        session = _shared_sessions.get(key)
+        if session is None:
+            session = create_session(pool_size, max_retries)
+            _shared_sessions[key] = session
+        return session
+
+
+class HTTPCache:
+    """
+    基于磁盘的HTTP响应缓存
+
+    每个URL保存一个JSON文件，记录ETag/Last-Modified和解析后的IP数据。
+    在TTL内直接使用缓存；过期后发送条件请求，服务器返回304时跳过下载和解析。
+    缓存总大小超过上限时按最近访问时间淘汰。
+    """
+
+    def __init__(self, cache_dir: str = '.ip_cache', default_ttl: float = 300,
+                 ttls: Dict[str, float] = None, max_bytes: int = 50 * 1024 * 1024):
+        """
+        初始化HTTP缓存
+
+        Args:
+            cache_dir: 缓存目录
+            default_ttl: 默认缓存有效期（秒），有效期内不发送任何请求
+            ttls: 按URL单独设置的缓存有效期（秒）
+            max_bytes: 缓存目录的最大总字节数
+        """
+        self.cache_dir = cache_dir
+        self.default_ttl = default_ttl
+        self.ttls = dict(ttls or {})
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, url: str) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha1(url.encode('utf-8')).hexdigest() + '.json')
+
+    def get_ttl(self, url: str) -> float:
+        """获取URL的缓存有效期"""
+        return self.ttls.get(url, self.default_ttl)
+
+    def get(self, url: str) -> Optional[dict]:
+        """
+        读取URL的缓存条目
+
+        Returns:
+            缓存条目字典，不存在或损坏时返回None
+        """
+        path = self._path(url)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            os.utime(path)  # 记录访问时间，用于LRU淘汰
+        except (OSError, ValueError):
+            return None
+        return entry if entry.get('url') == url else None
+
+    def is_fresh(self, entry: dict) -> bool:
+        """判断缓存条目是否仍在有效期内"""
+        return time.time() - entry.get('stored_at', 0) < self.get_ttl(entry['url'])
+
+    @staticmethod
+    def conditional_headers(entry: dict) -> Dict[str, str]:
+        """根据缓存条目生成条件请求头"""
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def put(self, url: str, response: requests.Response, data: list) -> None:
+        """保存响应的校验信息和解析结果"""
+        entry = {
+            'url': url,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'stored_at': time.time(),
+            'data': data,
+        }
+        self._write(url, entry)
+        self._evict()
+
+    def refresh(self, url: str, entry: dict, response: requests.Response) -> None:
+        """服务器返回304后更新缓存条目的时间戳和校验信息"""
+        entry['stored_at'] = time.time()
+        entry['etag'] = response.headers.get('ETag') or entry.get('etag')
+        entry['last_modified'] = response.headers.get('Last-Modified') or entry.get('last_modified')
+        self._write(url, entry)
+
+    def _write(self, url: str, entry: dict) -> None:
+        path = self._path(url)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+    def _evict(self) -> None:
+        """缓存总大小超过上限时，按最近访问时间从旧到新删除缓存文件"""
+        with self._lock:
+            files = []
+            total_bytes = 0
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+                total_bytes += stat.st_size
+
+            for _, size, path in sorted(files):
+                if total_bytes <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total_bytes -= size
+                except OSError:
+                    pass
+
+    def clear(self) -> None:
+        """清空缓存目录"""
+        with self._lock:
+            for name in os.listdir(self.cache_dir):
+                if name.endswith('.json'):
+                    os.remove(os.path.join(self.cache_dir, name))
+
+
+class MetricsRegistry:
+    """
+    数据源指标注册表（线程安全）
+
+    按数据源记录DNS/连接/首字节/传输耗时、接收字节数、解析耗时、产出记录数、
+    按原因统计的被拒绝行数，以及每个过滤阶段后仍保留的记录数，可导出为JSON或Prometheus文本格式。
+    """
+
+    # 字段名 -> (Prometheus指标名, 单位换算系数, 说明)
+    FIELDS = {
+        'dns_ms': ('ip_extractor_source_dns_seconds', 0.001, 'DNS解析耗时（秒）'),
+        'connect_ms': ('ip_extractor_source_connect_seconds', 0.001, 'TCP/TLS连接建立耗时（秒）'),
+        'ttfb_ms': ('ip_extractor_source_ttfb_seconds', 0.001, '发送请求到收到响应头的耗时（秒）'),
+        'transfer_ms': ('ip_extractor_source_transfer_seconds', 0.001, '响应体传输耗时（秒）'),
+        'parse_ms': ('ip_extractor_source_parse_seconds', 0.001, '解析耗时（秒）'),
+        'fetch_ms': ('ip_extractor_source_fetch_seconds', 0.001, '获取数据源的总耗时（秒）'),
+        'bytes': ('ip_extractor_source_received_bytes', 1, '接收的字节数'),
+        'records': ('ip_extractor_source_records', 1, '解析产出的记录数'),
+    }
+
+    def __init__(self):
+        self._sources: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def _source(self, source: str) -> dict:
+        return self._sources.setdefault(source, {'filters': {}, 'rejects': {}})
+
+    def update(self, source: str, **values) -> None:
+        """设置数据源的指标值（覆盖旧值）"""
+        with self._lock:
+            self._source(source).update(values)
+
+    def add(self, source: str, field: str, value: float) -> None:
+        """累加数据源的指标值"""
+        with self._lock:
+            metrics = self._source(source)
+            metrics[field] = metrics.get(field, 0) + value
+
+    def record_rejects(self, source: str, rejects: Dict[str, int]) -> None:
+        """
+        累加数据源被拒绝的行数
+
+        Args:
+            source: 数据源
+            rejects: 拒绝原因 -> 行数（见 IngestParser）
+        """
+        with self._lock:
+            counts = self._source(source)['rejects']
+            for reason, count in rejects.items():
+                counts[reason] = counts.get(reason, 0) + count
+
+    def record_filter(self, stage: str, survivors: Dict[str, int]) -> None:
+        """
+        记录过滤阶段后各数据源仍保留的记录数
+
+        Args:
+            stage: 过滤阶段名称（如 'dedup'、'latency'、'region'）
+            survivors: 数据源 -> 保留的记录数
+        """
+        with self._lock:
+            for source in self._sources:
+                self._sources[source]['filters'][stage] = survivors.get(source, 0)
+            for source, count in survivors.items():
+                self._source(source)['filters'][stage] = count
+
+    def get(self, source: str) -> dict:
+        """获取单个数据源的指标副本"""
+        with self._lock:
+            metrics = dict(self._sources.get(source, {'filters': {}, 'rejects': {}}))
+            metrics['filters'] = dict(metrics['filters'])
+            metrics['rejects'] = dict(metrics['rejects'])
+            return metrics
+
+    def to_dict(self) -> Dict[str, dict]:
+        """导出所有数据源的指标"""
+        with self._lock:
+            return {source: dict(metrics, filters=dict(metrics['filters']), rejects=dict(metrics['rejects']))
+                    for source, metrics in self._sources.items()}
+
+    def to_json(self, indent: int = 2) -> str:
+        """导出为JSON字符串"""
+        return json.dumps(self.to_dict(), ensure_ascii=False, indent=indent)
+
+    def to_prometheus(self) -> str:
+        """导出为Prometheus文本格式"""
+        def escape(value: str) -> str:
+            return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        data = self.to_dict()
+        lines = []
+        for field, (name, scale, help_text) in self.FIELDS.items():
+            samples = [(source, metrics[field]) for source, metrics in data.items() if field in metrics]
+            if not samples:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for source, value in samples:
+                lines.append(f'{name}{{source="{escape(source)}"}} {value * scale:g}')
+
+        filter_samples = [(source, stage, count) for source, metrics in data.items()
+                          for stage, count in metrics['filters'].items()]
+        if filter_samples:
+            lines.append("# HELP ip_extractor_source_filter_records 各过滤阶段后仍保留的记录数")
+            lines.append("# TYPE ip_extractor_source_filter_records gauge")
+            for source, stage, count in filter_samples:
+                lines.append(f'ip_extractor_source_filter_records{{source="{escape(source)}",stage="{escape(stage)}"}} {count}')
+
+        reject_samples = [(source, reason, count) for source, metrics in data.items()
+                          for reason, count in metrics['rejects'].items()]
+        if reject_samples:
+            lines.append("# HELP ip_extractor_source_rejected_lines 解析时被拒绝的行数")
+            lines.append("# TYPE ip_extractor_source_rejected_lines counter")
+            for source, reason, count in reject_samples:
+                lines.append(f'ip_extractor_source_rejected_lines{{source="{escape(source)}",reason="{escape(reason)}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        """清空所有指标"""
+        with self._lock:
+            self._sources.clear()
+
+
+_hedge_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+_hedge_executor_lock = threading.Lock()
+
+
+def _get_hedge_executor() -> concurrent.futures.ThreadPoolExecutor:
+    """获取对冲请求使用的共享线程池"""
+    global _hedge_executor
+    with _hedge_executor_lock:
+        if _hedge_executor is None:
+            _hedge_executor = concurrent.futures.ThreadPoolExecutor(max_workers=16, thread_name_prefix='ip-hedge')
+        return _hedge_executor
+
+
+def _close_future_response(future: concurrent.futures.Future) -> None:
+    """关闭未被采用的对冲请求响应"""
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+class FixtureBundle:
+    """
+    数据源响应录制/回放包
+
+    录制模式（'record'）下保存IPExtractor发出的每个HTML、文本、API请求的响应和RDAP查询结果；
+    回放模式（'replay'）下直接返回录制的数据，不访问网络，可选模拟网络延迟。
+    数据以gzip压缩的JSON保存在单个文件中。
+    """
+
+    RECORD = 'record'
+    REPLAY = 'replay'
+    # 录制时保存的响应头
+    RECORDED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+
+    def __init__(self, path: str, mode: str = REPLAY, simulated_latency=None):
+        """
+        初始化录制/回放包
+
+        Args:
+            path: 录制文件路径（如 'fixtures/sources.json.gz'）
+            mode: 'record' 或 'replay'
+            simulated_latency: 回放时模拟的网络延迟：None表示不延迟，
+                               'recorded' 表示使用录制时的实际耗时，数字表示固定延迟（秒）
+        """
+        if mode not in (self.RECORD, self.REPLAY):
+            raise ValueError(f"不支持的模式: {mode}")
+        self.path = path
+        self.mode = mode
+        self.simulated_latency = simulated_latency
+        self._entries: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        if mode == self.REPLAY or os.path.exists(path):
+            self.load()
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == self.REPLAY
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == self.RECORD
+
+    def __enter__(self) -> 'FixtureBundle':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if self.recording:
+            self.save()
+
+    def load(self) -> None:
+        """加载录制文件"""
+        with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+            self._entries = json.load(f)
+
+    def save(self) -> None:
+        """保存录制文件"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            data = json.dumps(self._entries, ensure_ascii=False, separators=(',', ':'), default=str)
+        with gzip.open(self.path, 'wt', encoding='utf-8') as f:
+            f.write(data)
+        print(f"已保存 {len(self._entries)} 条录制数据到 {self.path}")
+
+    @staticmethod
+    def http_key(method: str, url: str, body=None) -> str:
+        """生成HTTP请求的录制键"""
+        key = f"{method.upper()} {url}"
+        if body is not None:
+            key += " " + json.dumps(body, sort_keys=True, ensure_ascii=False)
+        return key
+
+    @staticmethod
+    def rdap_key(ip_address: str) -> str:
+        """生成RDAP查询的录制键"""
+        return f"RDAP {ip_address}"
+
+    def record_response(self, key: str, response: requests.Response, elapsed: float) -> None:
+        """录制HTTP响应（响应体必须已读取）"""
+        entry = {
+            'status': response.status_code,
+            'headers': {name: response.headers[name] for name in self.RECORDED_HEADERS if name in response.headers},
+            'body': base64.b64encode(response.content).decode('ascii'),
+            'elapsed': round(elapsed, 4),
+        }
+        with self._lock:
+            self._entries[key] = entry
+
+    def replay_response(self, key: str, url: str) -> requests.Response:
+        """
+        回放HTTP响应
+
+        Raises:
+            requests.ConnectionError: 录制包中没有该请求
+        """
+        entry = self._get(key)
+        if entry is None:
+            raise requests.ConnectionError(f"录制包中没有该请求: {key}")
+        response = requests.Response()
+        response.status_code = entry['status']
+        response.headers.update(entry['headers'])
+        response._content = base64.b64decode(entry['body'])
+        response._content_consumed = True
+        response.url = url
+        return response
+
+    def record_rdap(self, ip_address: str, results: Optional[dict], elapsed: float) -> None:
+        """录制RDAP查询结果（None表示查询失败）"""
+        with self._lock:
+            self._entries[self.rdap_key(ip_address)] = {'results': results, 'elapsed': round(elapsed, 4)}
+
+    def replay_rdap(self, ip_address: str) -> Optional[dict]:
+        """
+        回放RDAP查询结果
+
+        Raises:
+            LookupError: 录制包中没有该IP的查询结果或录制时查询失败
+        """
+        entry = self._get(self.rdap_key(ip_address))
+        if entry is None or entry['results'] is None:
+            raise LookupError(f"录制包中没有IP {ip_address} 的RDAP查询结果")
+        return entry['results']
+
+    def _get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None:
+            self._simulate_latency(entry)
+        return entry
+
+    def _simulate_latency(self, entry: dict) -> None:
+        if self.simulated_latency == 'recorded':
+            time.sleep(entry.get('elapsed', 0))
+        elif self.simulated_latency:
+            time.sleep(float(self.simulated_latency))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SourceHealth:
+    """
+    数据源健康状态（熔断器 + 自适应超时）
+
+    为每个数据源记录最近的耗时历史和连续失败次数，可持久化到JSON文件以便跨运行复用：
+    - 连续失败达到阈值后熔断（open），冷却期内直接跳过该数据源
+    - 冷却期结束后进入半开状态（half_open），允许一次探测请求，成功则恢复（closed），失败则重新熔断
+    - 请求超时根据该数据源自身的耗时分位数计算，而不是所有数据源使用相同的固定超时
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, path: str = None, failure_threshold: int = 3, cooldown: float = 6 * 3600,
+                 history_size: int = 50, min_samples: int = 3,
+                 min_timeout: float = 2.0, timeout_multiplier: float = 3.0):
+        """
+        初始化数据源健康状态
+
+        Args:
+            path: 持久化JSON文件路径，None表示只在内存中保存
+            failure_threshold: 连续失败多少次后熔断
+            cooldown: 熔断冷却时间（秒）
+            history_size: 每个数据源保留的耗时样本数
+            min_samples: 计算自适应超时所需的最少样本数
+            min_timeout: 自适应超时的下限（秒）
+            timeout_multiplier: 自适应超时 = p95耗时 × 该倍数
+        """
+        self.path = path
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.history_size = history_size
+        self.min_samples = min_samples
+        self.min_timeout = min_timeout
+        self.timeout_multiplier = timeout_multiplier
+        self._sources: Dict[str, dict] = {}
+        # 半开状态下正在进行探测请求的数据源（不持久化）
+        self._probing: Set[str] = set()
+        self._lock = threading.Lock()
+        if path:
+            self.load()
+
+    def load(self) -> None:
+        """从持久化文件加载状态，文件不存在或损坏时忽略"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._sources = json.load(f)
+        except (OSError, ValueError):
+            self._sources = {}
+
+    def save(self) -> None:
+        """保存状态到持久化文件"""
+        if not self.path:
+            return
+        with self._lock:
+            data = json.dumps(self._sources, ensure_ascii=False, indent=2)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+    def _state(self, source: str) -> dict:
+        return self._sources.setdefault(source, {
+            'latencies': [], 'failures': 0, 'state': self.CLOSED, 'opened_at': None
+        })
+
+    def get_state(self, source: str) -> str:
+        """获取数据源的熔断状态"""
+        with self._lock:
+            return self._state(source)['state']
+
+    def allow_request(self, source: str) -> bool:
+        """
+        判断是否允许请求该数据源
+
+        Returns:
+            熔断冷却期内返回False；冷却期结束时进入半开状态并只允许一次探测，
+            探测结果记录之前的其他请求返回False
+        """
+        with self._lock:
+            state = self._state(source)
+            if state['state'] == self.OPEN:
+                if time.time() - (state['opened_at'] or 0) < self.cooldown:
+                    return False
+                state['state'] = self.HALF_OPEN
+            if state['state'] == self.HALF_OPEN:
+                if source in self._probing:
+                    return False
+                self._probing.add(source)
+            return True
+
+    def record_success(self, source: str, latency: Optional[float] = None) -> None:
+        """
+        记录一次成功请求
+
+        Args:
+            source: 数据源标识
+            latency: 网络请求耗时（秒），None表示没有实际发出网络请求（如使用缓存），不计入耗时样本
+        """
+        with self._lock:
+            self._probing.discard(source)
+            state = self._state(source)
+            if latency is not None:
+                state['latencies'] = (state['latencies'] + [round(latency, 4)])[-self.history_size:]
+            state['failures'] = 0
+            state['state'] = self.CLOSED
+            state['opened_at'] = None
+
+    def record_failure(self, source: str) -> None:
+        """记录一次失败请求，达到阈值或半开探测失败时熔断"""
+        with self._lock:
+            self._probing.discard(source)
+            state = self._state(source)
+            state['failures'] += 1
+            if state['state'] == self.HALF_OPEN or state['failures'] >= self.failure_threshold:
+                state['state'] = self.OPEN
+                state['opened_at'] = time.time()
+
+    def percentile(self, source: str, percent: float) -> Optional[float]:
+        """
+        计算数据源网络请求耗时的分位数（秒）
+
+        Args:
+            source: 数据源标识
+            percent: 分位数（0-100）
+
+        Returns:
+            分位数耗时，样本不足时返回None
+        """
+        with self._lock:
+            latencies = sorted(self._state(source)['latencies'])
+        if len(latencies) < self.min_samples:
+            return None
+        index = min(len(latencies) - 1, int(round(percent / 100.0 * (len(latencies) - 1))))
+        return latencies[index]
+
+    def get_timeout(self, source: str, default: float) -> float:
+        """
+        根据数据源的历史耗时计算请求超时
+
+        Args:
+            source: 数据源标识
+            default: 默认超时，同时作为自适应超时的上限
+
+        Returns:
+            超时时间（秒）
+        """
+        p95 = self.percentile(source, 95)
+        if p95 is None:
+            return default
+        return max(self.min_timeout, min(default, p95 * self.timeout_multiplier))
+
+
+def _ip_to_int(ip_address: str) -> Optional[Tuple[int, int]]:
+    """将IP地址字符串转换为 (整数, 地址族)，无效地址返回None"""
+    try:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET, ip_address), 'big'), 4
+    except OSError:
+        pass
+    try:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET6, ip_address), 'big'), 6
+    except OSError:
+        return None
+
+
+class CIDRTrie:
+    """
+    IPv4/IPv6网段的二进制基数树（路径压缩），用于回答"这个IP属于哪个网段"
+
+    节点保存在平行数组中（网络地址、前缀长度、地址族、左右子节点、值编号），没有逐节点的Python对象；
+    只有分叉处才有节点，查找经过的节点数不超过网段的嵌套层数加分叉数，与地址位数无关。
+    可保存为二进制文件，加载时直接读入数组，不需要重新插入。
+    值可以是任意可JSON序列化的对象（如地区代码、True）。
+    """
+
+    _MAGIC = b'CIDRTRIE1'
+    # 节点数、网段数、值列表JSON的字节数
+    _HEADER = struct.Struct('<III')
+    _BITS = {4: 32, 6: 128}
+    # 节点0、1分别为IPv4、IPv6的根节点（前缀长度0）
+    _ROOTS = {4: 0, 6: 1}
+
+    def __init__(self):
+        self._keys: List[int] = [0, 0]
+        self._lengths = array.array('B', [0, 0])
+        self._families = array.array('B', [4, 6])
+        # 子节点编号，-1表示没有子节点
+        self._left = array.array('i', [-1, -1])
+        self._right = array.array('i', [-1, -1])
+        # 值在 _values 中的编号，-1表示该节点只是分叉点，不是插入的网段
+        self._value_ids = array.array('i', [-1, -1])
+        self._values: list = []
+        self._value_index: Dict = {}
+        self._count = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _parse_network(cidr) -> ipaddress._BaseNetwork:
+        if isinstance(cidr, (ipaddress.IPv4Network, ipaddress.IPv6Network)):
+            return cidr
+        return ipaddress.ip_network(cidr.strip(), strict=False)
+
+    def _new_node(self, key: int, length: int, family: int, value_id: int = -1) -> int:
+        self._keys.append(key)
+        self._lengths.append(length)
+        self._families.append(family)
+        self._left.append(-1)
+        self._right.append(-1)
+        self._value_ids.append(value_id)
+        return len(self._keys) - 1
+
+    def _value_id(self, value) -> int:
+        try:
+            value_id = self._value_index.get(value)
+        except TypeError:
+            # 不可哈希的值（如字典）不去重
+            self._values.append(value)
+            return len(self._values) - 1
+        if value_id is None:
+            value_id = self._value_index[value] = len(self._values)
+            self._values.append(value)
+        return value_id
+
+    def insert(self, cidr, value=True) -> None:
+        """
+        插入网段，已存在时覆盖其值
+
+        Args:
+            cidr: 网段（如 '8.219.0.0/16'、'2606:4700::/32'），单个IP视为 /32 或 /128
+            value: 网段对应的值
+        """
+        network = self._parse_network(cidr)
+        bits = self._BITS[network.version]
+        key, length = int(network.network_address), network.prefixlen
+        keys, lengths = self._keys, self._lengths
+        with self._lock:
+            value_id = self._value_id(value)
+            node = self._ROOTS[network.version]
+            while True:
+                node_length = lengths[node]
+                if node_length == length:
+                    if self._value_ids[node] == -1:
+                        self._count += 1
+                    self._value_ids[node] = value_id
+                    return
+                children = self._right if (key >> (bits - node_length - 1)) & 1 else self._left
+                child = children[node]
+                if child == -1:
+                    children[node] = self._new_node(key, length, network.version, value_id)
+                    self._count += 1
+                    return
+                limit = min(lengths[child], length)
+                common = limit - ((keys[child] ^ key) >> (bits - limit)).bit_length()
+                if common == lengths[child]:
+                    node = child
+                    continue
+                # 在共同前缀处分裂：先构建完整的中间节点再挂到树上，并发查找不会看到不完整的结构
+                middle = self._new_node(key >> (bits - common) << (bits - common), common, network.version)
+                child_goes_right = (keys[child] >> (bits - common - 1)) & 1
+                (self._right if child_goes_right else self._left)[middle] = child
+                if common == length:
+                    self._value_ids[middle] = value_id
+                else:
+                    leaf = self._new_node(key, length, network.version, value_id)
+                    (self._left if child_goes_right else self._right)[middle] = leaf
+                self._count += 1
+                children[node] = middle
+                return
+
+    def _match(self, value: int, version: int) -> int:
+        """返回包含该地址的最长网段的节点编号，没有时返回-1"""
+        bits = self._BITS[version]
+        keys, lengths, value_ids = self._keys, self._lengths, self._value_ids
+        left, right = self._left, self._right
+        node = self._ROOTS[version]
+        best = -1
+        while node != -1:
+            length = lengths[node]
+            if length and (value ^ keys[node]) >> (bits - length):
+                break
+            if value_ids[node] != -1:
+                best = node
+            if length == bits:
+                break
+            node = right[node] if (value >> (bits - length - 1)) & 1 else left[node]
+        return best
+
+    def longest_match(self, ip_address: str) -> Optional[Tuple[str, object]]:
+        """
+        最长前缀匹配
+
+        Returns:
+            (网段, 值)，没有包含该IP的网段或地址无效时返回None
+        """
+        parsed = _ip_to_int(ip_address)
+        node = self._match(*parsed) if parsed is not None else -1
+        if node == -1:
+            return None
+        return self._cidr(node), self._values[self._value_ids[node]]
+
+    def _cidr(self, node: int) -> str:
+        network_class = ipaddress.IPv4Network if self._families[node] == 4 else ipaddress.IPv6Network
+        return str(network_class((self._keys[node], self._lengths[node])))
+
+    def lookup(self, ip_address: str, default=None):
+        """返回包含该IP的最长网段的值，没有时返回default"""
+        parsed = _ip_to_int(ip_address)
+        node = self._match(*parsed) if parsed is not None else -1
+        return self._values[self._value_ids[node]] if node != -1 else default
+
+    def lookup_many(self, ip_addresses: Iterable[str], default=None) -> list:
+        """批量查找，返回与输入一一对应的值列表"""
+        return [self.lookup(ip_address, default) for ip_address in ip_addresses]
+
+    def get(self, cidr, default=None):
+        """精确查找网段的值（不做最长前缀匹配）"""
+        network = self._parse_network(cidr)
+        bits = self._BITS[network.version]
+        key, length = int(network.network_address), network.prefixlen
+        node = self._ROOTS[network.version]
+        while node != -1:
+            node_length = self._lengths[node]
+            if node_length > length or (node_length and (key ^ self._keys[node]) >> (bits - node_length)):
+                break
+            if node_length == length:
+                value_id = self._value_ids[node]
+                return self._values[value_id] if value_id != -1 else default
+            node = self._right[node] if (key >> (bits - node_length - 1)) & 1 else self._left[node]
+        return default
+
+    def __contains__(self, ip_address: str) -> bool:
+        parsed = _ip_to_int(ip_address)
+        return parsed is not None and self._match(*parsed) != -1
+
+    def __len__(self) -> int:
+        return self._count
+
+    def items(self) -> Iterator[Tuple[str, object]]:
+        """遍历所有插入的网段及其值（按插入时创建节点的顺序）"""
+        for node, value_id in enumerate(self._value_ids):
+            if value_id != -1:
+                yield self._cidr(node), self._values[value_id]
+
+    @classmethod
+    def from_file(cls, path: str, value=True) -> 'CIDRTrie':
+        """
+        从每行一个网段的文本文件创建（如 CloudflareST/ip.txt、ipv6.txt），跳过空行、注释和无效行
+
+        Args:
+            path: 文件路径
+            value: 每个网段对应的值
+
+        Returns:
+            CIDRTrie对象
+        """
+        trie = cls()
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    try:
+                        trie.insert(line, value)
+                    except ValueError:
+                        continue
+        return trie
+
+    @staticmethod
+    def _little_endian(values: array.array) -> bytes:
+        if sys.byteorder == 'big':
+            values = array.array(values.typecode, values)
+            values.byteswap()
+        return values.tobytes()
+
+    def to_bytes(self) -> bytes:
+        """序列化为二进制格式"""
+        with self._lock:
+            values = json.dumps(self._values, ensure_ascii=False).encode('utf-8')
+            parts = [self._MAGIC, self._HEADER.pack(len(self._keys), self._count, len(values)), values,
+                     self._lengths.tobytes(), self._families.tobytes()]
+            parts.extend(self._little_endian(column) for column in (self._left, self._right, self._value_ids))
+            parts.append(b''.join(key.to_bytes(16, 'big') for key in self._keys))
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'CIDRTrie':
+        """从 to_bytes() 的结果加载"""
+        if not data.startswith(cls._MAGIC):
+            raise ValueError("不是CIDRTrie序列化数据")
+        offset = len(cls._MAGIC)
+        node_count, count, values_size = cls._HEADER.unpack_from(data, offset)
+        offset += cls._HEADER.size
+        trie = cls()
+        trie._values = json.loads(data[offset:offset + values_size].decode('utf-8'))
+        offset += values_size
+        for name, typecode, item_size in (('_lengths', 'B', 1), ('_families', 'B', 1), ('_left', 'i', 4),
+                                          ('_right', 'i', 4), ('_value_ids', 'i', 4)):
+            column = array.array(typecode)
+            column.frombytes(data[offset:offset + node_count * item_size])
+            if item_size > 1 and sys.byteorder == 'big':
+                column.byteswap()
+            setattr(trie, name, column)
+            offset += node_count * item_size
+        if len(data) != offset + node_count * 16:
+            raise ValueError("CIDRTrie序列化数据不完整")
+        trie._keys = [int.from_bytes(data[position:position + 16], 'big')
+                      for position in range(offset, offset + node_count * 16, 16)]
+        trie._count = count
+        for value_id, value in enumerate(trie._values):
+            try:
+                trie._value_index.setdefault(value, value_id)
+            except TypeError:
+                continue
+        return trie
+
+    def save(self, path: str) -> None:
+        """保存为二进制文件（先写临时文件再替换，避免中断时留下不完整的文件）"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(self.to_bytes())
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'CIDRTrie':
+        """从 save() 保存的文件加载"""
+        with open(path, 'rb') as f:
+            return cls.from_bytes(f.read())
+
+
+class RegionPrefixIndex:
+    """
+    按网段回答IP地区的最长前缀匹配索引（线程安全）
+
+    保存RDAP查询返回的网段（如 8.219.0.0/16 -> SG），之后同一网段内的IP直接从内存得到地区，
+    地区查询次数从每个IP一次降为每个网段一次。网段保存在 CIDRTrie 中，查询为最长前缀匹配。
+    比 min_prefixlen 更大的网段（如 /8）不会加入索引：大网段内常有分配给其他地区的子网段，
+    用它回答其中的IP容易出错。
+    """
+
+    def __init__(self, min_prefixlen: Dict[int, int] = None):
+        """
+        Args:
+            min_prefixlen: 各地址族接受的最短前缀长度，默认 {4: 12, 6: 32}
+        """
+        self.min_prefixlen = {4: 12, 6: 32}
+        self.min_prefixlen.update(min_prefixlen or {})
+        self._trie = CIDRTrie()
+
+    @staticmethod
+    def parse_cidrs(cidr: Optional[str]) -> List[ipaddress._BaseNetwork]:
+        """解析RDAP返回的网段（可能是逗号分隔的多个CIDR），忽略无效的部分"""
+        networks = []
+        for part in (cidr or '').split(','):
+            try:
+                networks.append(ipaddress.ip_network(part.strip(), strict=False))
+            except ValueError:
+                continue
+        return networks
+
+    def add(self, cidr: str, country: str, asn: Optional[str] = None,
+            looked_up_at: float = None) -> List[dict]:
+        """
+        加入网段
+
+        Args:
+            cidr: 网段，可以是逗号分隔的多个CIDR
+            country: 地区代码
+            asn: 自治系统号
+            looked_up_at: 查询时间，None表示当前时间
+
+        Returns:
+            实际加入的条目（过大或无效的网段不加入）
+        """
+        added = []
+        looked_up_at = looked_up_at or time.time()
+        for network in self.parse_cidrs(cidr):
+            if network.prefixlen < self.min_prefixlen[network.version]:
+                continue
+            entry = {'cidr': str(network), 'country': country, 'asn': asn, 'looked_up_at': looked_up_at}
+            self._trie.insert(network, entry)
+            added.append(entry)
+        return added
+
+    def lookup(self, ip_address: str) -> Optional[dict]:
+        """
+        查找包含该IP的最长网段
+
+        Returns:
+            条目（cidr、country、asn、looked_up_at），没有已知网段时返回None
+        """
+        return self._trie.lookup(ip_address)
+
+    def entries(self) -> List[dict]:
+        """返回所有条目"""
+        return [entry for _, entry in self._trie.items()]
+
+    def __len__(self) -> int:
+        return len(self._trie)
+
+
+class GeoIPRangeDB:
+    """
+    离线IP地区数据库（IP段 -> 地区代码）
+
+    IP段按起始地址排序后保存为紧凑的平行数组（起始地址、结束地址、地区编号），
+    查询时二分查找，不需要网络，单次查询为微秒级。
+    安装numpy时IPv4数组使用numpy，classify() 对整批IP一次 searchsorted；
+    IPv6地址超出64位整数范围，使用Python整数列表和bisect。
+    IP段之间不能重叠（常见的国家IP库均满足）。
+    """
+
+    _IPV4_MAPPED = 0xFFFF << 32
+    _IGNORED_COUNTRIES = {'', '-', 'ZZ'}
+
+    def __init__(self, ranges: Iterable[Tuple[int, int, str, int]] = ()):
+        """
+        Args:
+            ranges: (起始地址整数, 结束地址整数, 地区代码, 地址族) 的可迭代对象
+        """
+        self.countries: List[str] = []
+        country_ids: Dict[str, int] = {}
+        rows = {4: [], 6: []}
+        for start, end, country, family in ranges:
+            country_id = country_ids.get(country)
+            if country_id is None:
+                country_id = country_ids[country] = len(self.countries)
+                self.countries.append(country)
+            rows[family].append((start, end, country_id))
+        for family_rows in rows.values():
+            family_rows.sort()
+
+        v4 = rows[4]
+        if NUMPY_AVAILABLE:
+            self._v4_starts = np.fromiter((row[0] for row in v4), dtype=np.uint32, count=len(v4))
+            self._v4_ends = np.fromiter((row[1] for row in v4), dtype=np.uint32, count=len(v4))
+            self._v4_codes = np.fromiter((row[2] for row in v4), dtype=np.uint16, count=len(v4))
+        else:
+            self._v4_starts = array.array('I', (row[0] for row in v4))
+            self._v4_ends = array.array('I', (row[1] for row in v4))
+            self._v4_codes = array.array('H', (row[2] for row in v4))
+        self._v6_starts = [row[0] for row in rows[6]]
+        self._v6_ends = [row[1] for row in rows[6]]
+        self._v6_codes = array.array('H', (row[2] for row in rows[6]))
+
+    @classmethod
+    def _parse_address(cls, text: str) -> Optional[Tuple[int, int]]:
+        """解析IP地址或整数形式的地址，IPv4映射的IPv6整数按IPv4处理"""
+        text = text.strip()
+        if text.isdigit():
+            value = int(text)
+            if value <= 0xFFFFFFFF:
+                return value, 4
+            if cls._IPV4_MAPPED <= value <= cls._IPV4_MAPPED | 0xFFFFFFFF:
+                return value - cls._IPV4_MAPPED, 4
+            return value, 6
+        return _ip_to_int(text)
+
+    @classmethod
+    def from_csv(cls, path: str, encoding: str = 'utf-8') -> 'GeoIPRangeDB':
+        """
+        从CSV文件加载（支持 .gz 压缩文件），每行为以下格式之一：
+            起始IP,结束IP,地区代码[,...]          （如 DB-IP、IP2Location 的 Lite 版本，地址可以是整数）
+            CIDR,地区代码[,...]
+
+        无法解析的行（如表头）和地区代码为空、"-"、"ZZ" 的行会被跳过。
+
+        Args:
+            path: CSV文件路径
+            encoding: 文件编码
+
+        Returns:
+            GeoIPRangeDB对象
+        """
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding=encoding, newline='') as f:
+            return cls(cls._parse_csv_rows(csv.reader(f)))
+
+    @classmethod
+    def _parse_csv_rows(cls, rows: Iterable[List[str]]) -> Iterator[Tuple[int, int, str, int]]:
+        for row in rows:
+            if len(row) < 2:
+                continue
+            if '/' in row[0]:
+                try:
+                    network = ipaddress.ip_network(row[0].strip(), strict=False)
+                except ValueError:
+                    continue
+                start, end, family = int(network.network_address), int(network.broadcast_address), network.version
+                country = row[1]
+            else:
+                if len(row) < 3:
+                    continue
+                start, end = cls._parse_address(row[0]), cls._parse_address(row[1])
+                if start is None or end is None or start[1] != end[1]:
+                    continue
+                (start, family), (end, _) = start, end
+                country = row[2]
+            country = country.strip().upper()
+            if country not in cls._IGNORED_COUNTRIES:
+                yield start, end, country, family
+
+    def __len__(self) -> int:
+        return len(self._v4_starts) + len(self._v6_starts)
+
+    def _find(self, value: int, family: int) -> Optional[str]:
+        if family == 4:
+            starts, ends, codes = self._v4_starts, self._v4_ends, self._v4_codes
+        else:
+            starts, ends, codes = self._v6_starts, self._v6_ends, self._v6_codes
+        index = bisect.bisect_right(starts, value) - 1
+        if index >= 0 and value <= ends[index]:
+            return self.countries[codes[index]]
+        return None
+
+    def lookup(self, ip_address: str) -> Optional[str]:
+        """
+        查询单个IP地址的地区代码
+
+        Returns:
+            地区代码，不在任何IP段内或地址无效时返回None
+        """
+        parsed = _ip_to_int(ip_address)
+        return self._find(*parsed) if parsed is not None else None
+
+    def classify(self, ip_addresses: Iterable[str]) -> List[Optional[str]]:
+        """
+        批量查询地区代码
+
+        Args:
+            ip_addresses: IP地址
+
+        Returns:
+            与输入一一对应的地区代码列表，查不到时为None
+        """
+        ips = list(ip_addresses)
+        results: List[Optional[str]] = [None] * len(ips)
+        v4_positions, v4_values = [], []
+        for position, ip_address in enumerate(ips):
+            parsed = _ip_to_int(ip_address)
+            if parsed is None:
+                continue
+            value, family = parsed
+            if family == 4 and NUMPY_AVAILABLE:
+                v4_positions.append(position)
+                v4_values.append(value)
+            else:
+                results[position] = self._find(value, family)
+
+        if v4_values and len(self._v4_starts):
+            values = np.fromiter(v4_values, dtype=np.uint32, count=len(v4_values))
+            indexes = np.searchsorted(self._v4_starts, values, side='right') - 1
+            clipped = np.maximum(indexes, 0)
+            hits = (indexes >= 0) & (values <= self._v4_ends[clipped])
+            codes = self._v4_codes[clipped]
+            countries = self.countries
+            for position, hit, code in zip(v4_positions, hits.tolist(), codes.tolist()):
+                if hit:
+                    results[position] = countries[code]
+        return results
+
+
+class RegionCache:
+    """
+    基于SQLite的IP地区缓存（线程安全）
+
+    按IP地址保存地区代码、RDAP返回的网段CIDR、ASN和查询时间，跨运行复用：
+    - 查询成功的结果在 ttl 内有效（IP的归属地很少变化）
+    - 查询失败或无法确定地区时也会缓存（地区为None），在较短的 negative_ttl 内不再重复查询
+    - RDAP返回的网段单独保存（networks表），用于 RegionPrefixIndex 按网段回答地区
+    """
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS regions (
+            ip TEXT PRIMARY KEY,
+            country TEXT,
+            cidr TEXT,
+            asn TEXT,
+            looked_up_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS networks (
+            cidr TEXT PRIMARY KEY,
+            country TEXT NOT NULL,
+            asn TEXT,
+            looked_up_at REAL NOT NULL
+        );
+    """
+    # SQLite单条语句的参数数量上限较低，批量读取时分块查询
+    _BATCH_SIZE = 500
+
+    def __init__(self, path: str = '.ip_cache/regions.sqlite3', ttl: float = 30 * 86400,
+                 negative_ttl: float = 6 * 3600):
+        """
+        初始化地区缓存
+
+        Args:
+            path: SQLite数据库文件路径，':memory:' 表示只在内存中保存
+            ttl: 查询成功的结果的有效期（秒）
+            negative_ttl: 查询失败（地区为None）的结果的有效期（秒）
+        """
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path) if path != ':memory:' else ''
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.executescript(self._SCHEMA)
+
+    def is_fresh(self, entry: dict, now: float = None) -> bool:
+        """判断缓存条目是否仍在有效期内"""
+        ttl = self.ttl if entry['country'] else self.negative_ttl
+        return (now if now is not None else time.time()) - entry['looked_up_at'] < ttl
+
+    def get(self, ip_address: str) -> Optional[dict]:
+        """
+        读取单个IP的缓存
+
+        Returns:
+            有效期内的条目（ip、country、cidr、asn、looked_up_at），不存在或已过期时返回None
+        """
+        return self.get_many([ip_address]).get(ip_address)
+
+    def get_many(self, ip_addresses: Iterable[str]) -> Dict[str, dict]:
+        """
+        批量读取缓存
+
+        Args:
+            ip_addresses: IP地址
+
+        Returns:
+            IP地址 -> 有效期内的条目，不存在或已过期的IP不在结果中
+        """
+        ips = list(dict.fromkeys(ip_addresses))
+        now = time.time()
+        entries = {}
+        with self._lock:
+            for start in range(0, len(ips), self._BATCH_SIZE):
+                batch = ips[start:start + self._BATCH_SIZE]
+                rows = self._conn.execute(
+                    f"SELECT * FROM regions WHERE ip IN ({','.join('?' * len(batch))})", batch)
+                for row in rows:
+                    entry = dict(row)
+                    if self.is_fresh(entry, now):
+                        entries[entry['ip']] = entry
+        return entries
+
+    def put(self, ip_address: str, country: Optional[str], cidr: Optional[str] = None,
+            asn: Optional[str] = None, looked_up_at: float = None) -> None:
+        """
+        写入单个IP的查询结果
+
+        Args:
+            ip_address: IP地址
+            country: 地区代码，None表示查询失败或无法确定
+            cidr: RDAP返回的网段
+            asn: 自治系统号
+            looked_up_at: 查询时间，None表示当前时间
+        """
+        self.put_many([{'ip': ip_address, 'country': country, 'cidr': cidr, 'asn': asn,
+                        'looked_up_at': looked_up_at}])
+
+    def put_many(self, entries: Iterable[dict]) -> None:
+        """批量写入查询结果，条目的键与 put() 的参数相同（ip 对应 ip_address）"""
+        now = time.time()
+        rows = [(entry['ip'], entry.get('country'), entry.get('cidr'), entry.get('asn'),
+                 entry.get('looked_up_at') or now) for entry in entries]
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO regions VALUES (?, ?, ?, ?, ?)", rows)
+
+    def get_networks(self) -> List[dict]:
+        """
+        读取有效期内的所有网段
+
+        Returns:
+            条目列表（cidr、country、asn、looked_up_at）
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM networks WHERE looked_up_at > ?", (time.time() - self.ttl,))
+            return [dict(row) for row in rows]
+
+    def put_networks(self, entries: Iterable[dict]) -> None:
+        """批量写入网段，条目的键与 get_networks() 的结果相同"""
+        now = time.time()
+        rows = [(entry['cidr'], entry['country'], entry.get('asn'), entry.get('looked_up_at') or now)
+                for entry in entries]
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO networks VALUES (?, ?, ?, ?)", rows)
+
+    def purge_expired(self) -> int:
+        """删除已过期的条目和网段，返回删除的数量"""
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "DELETE FROM regions WHERE (country IS NOT NULL AND looked_up_at <= ?) "
+                "OR (country IS NULL AND looked_up_at <= ?)",
+                (now - self.ttl, now - self.negative_ttl))
+            removed = cursor.rowcount
+            removed += self._conn.execute("DELETE FROM networks WHERE looked_up_at <= ?", (now - self.ttl,)).rowcount
+            return removed
+
+    def clear(self) -> None:
+        """清空缓存"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM regions")
+            self._conn.execute("DELETE FROM networks")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM regions").fetchone()[0]
+
+    def close(self) -> None:
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
+
+
+class SourceSnapshot:
+    """
+    进程内数据源快照缓存（线程安全）
+
+    按数据源缓存获取并解析后的IP数据，在有效期内重复查询直接复用；
+    多个线程同时请求同一个数据源时只会获取一次。
+    """
+
+    def __init__(self, ttl: float = 300):
+        """
+        初始化快照缓存
+
+        Args:
+            ttl: 快照有效期（秒）
+        """
+        self.ttl = ttl
+        self._entries: Dict[str, Tuple[float, List[IPRecord]]] = {}
+        self._key_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _get_fresh(self, key: str) -> Optional[List[IPRecord]]:
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl:
+            return list(entry[1])
+        return None
+
+    def get_or_fetch(self, key: str, fetch: Callable[[], List[IPRecord]]) -> List[IPRecord]:
+        """
+        获取数据源快照，不存在或已过期时调用fetch获取
+
+        Args:
+            key: 数据源标识
+            fetch: 获取数据源的函数
+
+        Returns:
+            数据源IP数据列表（副本）
+        """
+        with self._lock:
+            data = self._get_fresh(key)
+            if data is not None:
+                print(f"使用进程内快照数据: {key}")
+                return data
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            # 等待期间其他线程可能已经完成获取
+            with self._lock:
+                data = self._get_fresh(key)
+            if data is not None:
+                return data
+
+            data = fetch()
+            # 获取失败（空结果）不缓存，下次查询重新获取
+            if data:
+                with self._lock:
+                    self._entries[key] = (time.monotonic(), list(data))
+            return list(data)
+
+    def invalidate(self, key: str = None) -> None:
+        """
+        使快照失效
+
+        Args:
+            key: 数据源标识，None表示清空所有快照
+        """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+
+# 便捷函数共享的数据源快照，连续的地区查询只需获取一次数据源
+source_snapshot = SourceSnapshot()
+
+
+def invalidate_source_snapshot(key: str = None) -> None:
+    """
+    使便捷函数共享的数据源快照失效
+
+    Args:
+        key: 数据源标识（如 "文本URL:https://..."），None表示清空所有快照
+    """
+    source_snapshot.invalidate(key)
+
+
 class IPExtractor:
     """IP提取器类，用于从多个网站提取IP地址和延迟信息"""
     
-    def __init__(self, timeout: int = 10, user_agent: str = None):
+    def __init__(self, timeout: int = 10, user_agent: str = None,
+                 max_workers: int = 8, overall_timeout: float = None,
+                 session: requests.Session = None, pool_size: int = 10, max_retries: int = 2,
+                 http_cache: HTTPCache = None, snapshot: SourceSnapshot = None,
+                 source_health: SourceHealth = None,
+                 hedge_requests: bool = False, hedge_max_ratio: float = 0.2,
+                 metrics: MetricsRegistry = None, fixtures: FixtureBundle = None,
+                 html_parser: str = 'auto', table_only: bool = True,
+                 parse_processes: Optional[int] = None, parse_inline_bytes: int = 256 * 1024,
+                 region_cache: RegionCache = None, region_prefixes: RegionPrefixIndex = None,
+                 geoip_db: GeoIPRangeDB = None):
         """
         初始化IP提取器
         
         Args:
             timeout: 请求超时时间（秒）
             user_agent: 自定义User-Agent，如果为None则使用默认值
+            max_workers: 并发获取数据源的最大线程数
+            overall_timeout: 所有数据源获取的总体截止时间（秒），None表示 timeout ×（max_retries + 1），
+                             使每个请求用完所有重试也不会被截止时间截断；截止时仍在进行的请求随之超时
+            session: 自定义HTTP会话，如果为None则使用进程内共享的连接池会话
+            pool_size: 共享会话中每个主机保持的最大连接数
+            max_retries: 共享会话的最大重试次数
+            http_cache: HTTP响应缓存，用于文本URL和HTML网站，None表示不使用缓存
+            snapshot: 进程内数据源快照，多个实例共享时可避免重复获取，None表示不使用
+            source_health: 数据源健康状态，用于熔断和自适应超时，None表示不使用
+            hedge_requests: 是否启用对冲请求：GET请求超过该数据源历史p90耗时仍未返回时，
+                            再发送一个相同请求并采用先返回的结果（需要source_health提供耗时历史）
+            hedge_max_ratio: 对冲请求数占总请求数的最大比例，用于限制额外负载
+            metrics: 数据源指标注册表，None表示为该实例创建新的注册表
+            fixtures: 录制/回放包，录制模式下保存所有响应，回放模式下不访问网络
+            html_parser: HTML解析引擎：'lxml'（更快）、'html.parser'（BeautifulSoup），
+                         'auto' 表示lxml可用时使用lxml
+            table_only: 是否只解析表格行（lxml使用事件解析，减少解析耗时；BeautifulSoup使用SoupStrainer，
+                        只降低内存峰值），False表示先构建完整DOM再查找表格行
+            parse_processes: HTML解析进程数，大页面在进程池中解析以利用多核；0表示始终在当前线程解析，
+                             None表示自动：使用BeautifulSoup解析且CPU多于1核时使用全部CPU核心
+            parse_inline_bytes: 小于该字节数的页面直接在当前线程解析，避免进程间传输开销
+            region_cache: IP地区缓存，有效期内的IP不再进行RDAP查询，None表示不使用缓存
+            region_prefixes: 网段地区索引，RDAP返回的网段内的IP不再查询；None表示创建新的索引，
+                             启用地区缓存时从缓存加载已知网段
+            geoip_db: 离线IP地区数据库，优先使用，查不到的IP再查询RDAP；None表示不使用
         """
         self.timeout = timeout
+        self.session = session or get_shared_session(pool_size, max_retries)
+        # 每个URL最近一次请求的耗时统计（连接建立与数据传输分开统计）
+        self.fetch_timings: Dict[str, dict] = {}
+        self.http_cache = http_cache
+        self.snapshot = snapshot
+        self.source_health = source_health
+        # 线程本地的请求超时（由自适应超时设置）
+        self._local = threading.local()
+        self.hedge_requests = hedge_requests
+        self.hedge_max_ratio = hedge_max_ratio
+        self.hedge_stats = {'requests': 0, 'hedged': 0, 'hedge_wins': 0}
+        self._hedge_lock = threading.Lock()
+        self.metrics = metrics or MetricsRegistry()
+        self.fixtures = fixtures
+        self.region_cache = region_cache
+        if region_prefixes is None:
+            region_prefixes = RegionPrefixIndex()
+            if region_cache is not None:
+                for entry in region_cache.get_networks():
+                    region_prefixes.add(**entry)
+        self.region_prefixes = region_prefixes
+        self.geoip_db = geoip_db
+        if html_parser == 'auto':
+            html_parser = 'lxml' if LXML_AVAILABLE else 'html.parser'
+        elif html_parser == 'lxml' and not LXML_AVAILABLE:
+            print("警告: lxml 模块不可用，使用 html.parser 解析HTML")
+            html_parser = 'html.parser'
+        self.html_parser = html_parser
+        self.table_only = table_only
+        if parse_processes is None:
+            cpu_count = os.cpu_count() or 1
+            parse_processes = cpu_count if html_parser == 'html.parser' and cpu_count > 1 else 0
+        self.parse_processes = parse_processes
+        self.parse_inline_bytes = parse_inline_bytes
+        self.parse_stats = {'inline': 0, 'offloaded': 0}
+        self._parse_stats_lock = threading.Lock()
+        # 记录 -> 产出该记录的数据源列表（相同记录可能来自多个数据源），用于统计各过滤阶段的保留数
+        self._record_origins: Dict[IPRecord, List[str]] = {}
+        self.max_workers = max_workers
+        self.overall_timeout = overall_timeout if overall_timeout is not None else timeout * (max_retries + 1)
         self.headers = {
             'User-Agent': user_agent or 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         }
@@ -96,25 +2827,302 @@ class IPExtractor:
             'DK': ['DK', 'Denmark', '丹麦', 'denmark']
         }
 
-        # 支持的API接口
-        self.api_sources = [
-            {
-                'url': 'https://api.hostmonit.com/get_optimization_ip',
-                'method': 'POST',
-                'headers': {'Content-Type': 'application/json'},
-                'data': {"key": "o1zrmHAF", "type": "v4"},
-                'parser': 'hostmonit_api'
-            }
-        ]
+        # 支持的API接口
+        self.api_sources = [
+            {
+                'url': 'https://api.hostmonit.com/get_optimization_ip',
+                'method': 'POST',
+                'headers': {'Content-Type': 'application/json'},
+                'data': {"key": "o1zrmHAF", "type": "v4"},
+                'parser': 'hostmonit_api'
+            }
+        ]
+
+        # 本地文件路径
+        self.local_files = [
+            'CloudflareST/sgcs.txt'
+        ]
+        
+        # 解析延迟数据的正则表达式
+        self.latency_pattern = LATENCY_PATTERN
+        # HTML网站表格规则，按主机名索引
+        self.site_specs: Dict[str, TableSiteSpec] = {}
+        for site in DEFAULT_HTML_SITES:
+            self.register_html_site(site)
+    
+    def _http_request(self, method: str, url: str, stream: bool = False, **kwargs) -> requests.Response:
+        """
+        通过共享会话发送HTTP请求，并分别记录连接建立耗时和传输耗时
+
+        Args:
+            method: 请求方法（GET/POST）
+            url: 请求URL
+            stream: 是否流式读取响应体；为True时由调用方通过 _iter_response_lines 读取
+            **kwargs: 传递给 requests.Session.request 的其他参数
+
+        Returns:
+            requests.Response对象，stream为False时已读取完响应体
+        """
+        kwargs.setdefault('timeout', getattr(self._local, 'timeout', None) or self.timeout)
+        deadline = getattr(self._local, 'deadline', None)
+        if deadline is not None:
+            # 总体截止时间之后不再发出请求，之前发出的请求超时不超过剩余时间
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise requests.Timeout(f"超过总体截止时间，不再请求: {url}")
+            kwargs['timeout'] = min(kwargs['timeout'], remaining)
+        hedge_delay = self._get_hedge_delay(method, url, stream)
+        start_time = time.perf_counter()
+        if hedge_delay is None:
+            response = self._send_request(method, url, stream, **kwargs)
+        else:
+            response = self._send_hedged_request(method, url, hedge_delay, **kwargs)
+        # 只有返回了数据的响应计入网络耗时样本；304等响应的耗时与完整下载不可比
+        if response.status_code == 200:
+            self._add_request_latency(time.perf_counter() - start_time)
+        return response
+
+    def _add_request_latency(self, seconds: float) -> None:
+        """记录当前线程正在获取的数据源的网络请求耗时（不含解析），供熔断器计算自适应超时"""
+        latencies = getattr(self._local, 'request_latencies', None)
+        if latencies is not None:
+            latencies.append(seconds)
+
+    def _get_hedge_delay(self, method: str, url: str, stream: bool) -> Optional[float]:
+        """
+        计算对冲请求的等待时间
+
+        Returns:
+            该数据源历史网络请求耗时（不含解析）的p90（秒），不满足对冲条件时返回None
+        """
+        with self._hedge_lock:
+            self.hedge_stats['requests'] += 1
+        # 流式下载的大文件不做对冲，避免重复占用带宽
+        if not self.hedge_requests or self.source_health is None or stream or method.upper() != 'GET':
+            return None
+        return self.source_health.percentile(url, 90)
+
+    def _try_acquire_hedge(self) -> bool:
+        """在额外负载上限内申请一次对冲请求"""
+        with self._hedge_lock:
+            # 向下取整：请求数不足 1/hedge_max_ratio 时不对冲，避免第一个请求就产生额外负载
+            budget = math.floor(self.hedge_max_ratio * self.hedge_stats['requests'] + 1e-9)
+            allowed = self.hedge_stats['hedged'] + 1 <= budget
+            if allowed:
+                self.hedge_stats['hedged'] += 1
+            return allowed
+
+    def _send_hedged_request(self, method: str, url: str, hedge_delay: float, **kwargs) -> requests.Response:
+        """
+        发送对冲请求：主请求超过hedge_delay仍未返回时，再发送一个相同请求，采用先成功返回的结果
+        """
+        executor = _get_hedge_executor()
+        primary = executor.submit(self._send_request, method, url, False, **kwargs)
+        done, _ = concurrent.futures.wait([primary], timeout=hedge_delay)
+        if done or not self._try_acquire_hedge():
+            return primary.result()
+
+        print(f"{url} 超过 p90 耗时 {hedge_delay:.2f}s 未返回，发送对冲请求")
+        hedge = executor.submit(self._send_request, method, url, False, **kwargs)
+        pending = {primary, hedge}
+        winner = None
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            # 优先采用成功的结果；两个请求都失败时抛出最后一个异常
+            successful = [future for future in done if future.exception() is None]
+            if successful:
+                winner = successful[0]
+                break
+            if not pending:
+                winner = next(iter(done))
+
+        for future in (primary, hedge):
+            if future is not winner:
+                future.add_done_callback(_close_future_response)
+        if winner is hedge:
+            with self._hedge_lock:
+                self.hedge_stats['hedge_wins'] += 1
+        return winner.result()
+
+    def _send_request(self, method: str, url: str, stream: bool = False, **kwargs) -> requests.Response:
+        """发送单个HTTP请求并记录耗时（参数同 _http_request）"""
+        if self.fixtures is not None:
+            fixture_key = FixtureBundle.http_key(method, url, kwargs.get('json'))
+            if self.fixtures.replaying:
+                start_time = time.perf_counter()
+                response = self.fixtures.replay_response(fixture_key, url)
+                self.fetch_timings[url] = {'dns_ms': 0.0, 'connect_ms': 0.0,
+                                           'ttfb_ms': (time.perf_counter() - start_time) * 1000,
+                                           'transfer_ms': 0.0, 'bytes': 0, 'reused_connection': True}
+                if not stream:
+                    self._record_transfer(url, 0.0, len(response.content))
+                return response
+            # 录制模式下需要完整读取响应体
+            start_time = time.perf_counter()
+            response = self._send_request_uncached(method, url, False, **kwargs)
+            self.fixtures.record_response(fixture_key, response, time.perf_counter() - start_time)
+            return response
+        return self._send_request_uncached(method, url, stream, **kwargs)
+
+    def _send_request_uncached(self, method: str, url: str, stream: bool = False, **kwargs) -> requests.Response:
+        """通过网络发送单个HTTP请求并记录耗时"""
+        _connect_timing.seconds = 0.0
+        _connect_timing.dns_seconds = 0.0
+        start_time = time.perf_counter()
+        response = self.session.request(method, url, stream=True, **kwargs)
+        headers_time = time.perf_counter()
+
+        dns_seconds = _connect_timing.dns_seconds
+        connect_seconds = min(_connect_timing.seconds, headers_time - start_time - dns_seconds)
+        self.fetch_timings[url] = {
+            'dns_ms': dns_seconds * 1000,
+            'connect_ms': connect_seconds * 1000,
+            'ttfb_ms': (headers_time - start_time - dns_seconds - connect_seconds) * 1000,
+            'transfer_ms': 0.0,
+            'bytes': 0,
+            'reused_connection': connect_seconds == 0.0,
+        }
+        self.metrics.update(url, **{key: value for key, value in self.fetch_timings[url].items()
+                                    if key != 'reused_connection'})
+        if not stream:
+            content = response.content
+            self._record_transfer(url, time.perf_counter() - headers_time, len(content))
+        return response
+
+    def _record_transfer(self, url: str, transfer_seconds: float, received_bytes: int) -> None:
+        """记录响应体的传输耗时和字节数"""
+        timing = self.fetch_timings.setdefault(url, {})
+        timing['transfer_ms'] = transfer_seconds * 1000
+        timing['bytes'] = received_bytes
+        self.metrics.update(url, transfer_ms=timing['transfer_ms'], bytes=received_bytes)
+        print(f"{url} 连接耗时 {timing.get('connect_ms', 0.0):.0f}ms，"
+              f"传输耗时 {transfer_seconds * 1000:.0f}ms，共 {received_bytes} 字节")
+
+    def _iter_response_lines(self, response: requests.Response, url: str,
+                             chunk_size: int = 64 * 1024) -> Iterator[str]:
+        """
+        逐块读取响应体并按行产出非空内容，内存占用与响应大小无关
+
+        传输耗时只统计从响应读取数据块的时间，不含拆分解码以及调用方处理各行的时间；
+        解析耗时由调用方（_timed_parse）统计。
+
+        Args:
+            response: 以stream方式获取的响应
+            url: 请求URL（用于记录耗时）
+            chunk_size: 每次读取的字节数
+
+        Yields:
+            去除首尾空白后的非空行
+        """
+        # 响应头未声明字符集时按UTF-8解码（requests对text/*默认使用ISO-8859-1）
+        content_type = response.headers.get('Content-Type', '')
+        encoding = response.encoding if 'charset' in content_type.lower() and response.encoding else 'utf-8'
+        chunks = response.iter_content(chunk_size=chunk_size)
+        deadline = getattr(self._local, 'deadline', None)
+        transfer_seconds = 0.0
+        received_bytes = 0
+        pending = b''
+        try:
+            while True:
+                read_start = time.perf_counter()
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    break
+                finally:
+                    transfer_seconds += time.perf_counter() - read_start
+                if deadline is not None and time.monotonic() > deadline:
+                    raise requests.Timeout(f"超过总体截止时间，停止读取: {url}")
+                received_bytes += len(chunk)
+                lines = (pending + chunk).split(b'\n')
+                pending = lines.pop()
+                yield from (line for line in (raw.decode(encoding, errors='replace').strip() for raw in lines) if line)
+            line = pending.decode(encoding, errors='replace').strip()
+            if line:
+                yield line
+        finally:
+            response.close()
+            self._record_transfer(url, transfer_seconds, received_bytes)
+            if response.status_code == 200:
+                self._add_request_latency(transfer_seconds)
+
+    def _timed_parse(self, records: Iterator[IPRecord], url: str) -> Iterator[IPRecord]:
+        """
+        产出流式解析的IP数据，并记录解析耗时
+
+        只统计解析器内部（每次next）花费的时间，不含调用方处理结果的时间；
+        其中从响应读取数据块的时间已计入传输耗时，记录时扣除。
+
+        Args:
+            records: 从 _iter_response_lines 的各行解析IP数据的迭代器
+            url: 请求URL
+        """
+        busy_seconds = 0.0
+        try:
+            while True:
+                parse_start = time.perf_counter()
+                try:
+                    record = next(records)
+                except StopIteration:
+                    break
+                finally:
+                    busy_seconds += time.perf_counter() - parse_start
+                yield record
+        finally:
+            # 提前停止迭代时先关闭解析器，使响应体读取的耗时记录完成
+            close_start = time.perf_counter()
+            records.close()
+            busy_seconds += time.perf_counter() - close_start
+            transfer_ms = self.fetch_timings.get(url, {}).get('transfer_ms', 0.0)
+            self.metrics.update(url, parse_ms=max(0.0, busy_seconds * 1000 - transfer_ms))
+
+    def _fetch_parsed(self, url: str, parse: Callable[[requests.Response], List[IPRecord]],
+                      headers: Dict[str, str] = None, stream: bool = False) -> Optional[List[IPRecord]]:
+        """
+        获取URL并解析，启用HTTP缓存时使用条件请求
+
+        Args:
+            url: 请求URL
+            parse: 将200响应解析为IP数据列表的函数
+            headers: 请求头
+            stream: 是否以流式方式获取响应体（由parse负责读取）
+
+        Returns:
+            解析后的IP数据列表，请求失败时返回None
+        """
+        headers = dict(headers or {})
+        entry = self.http_cache.get(url) if self.http_cache else None
+        if entry is not None:
+            if self.http_cache.is_fresh(entry):
+                print(f"使用缓存数据（未过期）: {url}")
+                return self._cached_records(url, entry)
+            headers.update(self.http_cache.conditional_headers(entry))
+
+        response = self._http_request('GET', url, headers=headers, stream=stream)
+        if response.status_code == 304 and entry is not None:
+            response.close()
+            print(f"数据未变化（304），使用缓存数据: {url}")
+            self.http_cache.refresh(url, entry, response)
+            return self._cached_records(url, entry)
+        if response.status_code != 200:
+            response.close()
+            print(f"Failed to fetch data from {url}. Status code: {response.status_code}")
+            return None
+
+        parse_start = time.perf_counter()
+        data = parse(response)
+        if not stream:
+            self.metrics.update(url, parse_ms=(time.perf_counter() - parse_start) * 1000)
+        if self.http_cache:
+            self.http_cache.put(url, response, [record.to_dict() for record in data])
+        return data
+
+    @staticmethod
+    def _cached_records(url: str, entry: dict) -> List[IPRecord]:
+        """将缓存中的数据还原为IPRecord（兼容旧版缓存中的字符串）"""
+        return [IPRecord.parse(item, source=url) if isinstance(item, str) else IPRecord.from_dict(item)
+                for item in entry['data']]
 
-        # 本地文件路径
-        self.local_files = [
-            'CloudflareST/sgcs.txt'
-        ]
-        
-        # 解析延迟数据的正则表达式
-        self.latency_pattern = re.compile(r'(\d+(\.\d+)?)\s*(ms|毫秒)?')
-    
     def fetch_page_content(self, url: str) -> Optional[BeautifulSoup]:
         """
         获取网页内容并解析为BeautifulSoup对象
@@ -126,7 +3134,7 @@ class IPExtractor:
             BeautifulSoup对象，如果获取失败则返回None
         """
         try:
-            response = requests.get(url, headers=self.headers, timeout=self.timeout)
+            response = self._http_request('GET', url, headers=self.headers)
             if response.status_code == 200:
                 return BeautifulSoup(response.content, 'html.parser')
             else:
@@ -135,86 +3143,74 @@ class IPExtractor:
             print(f"Request failed for {url}: {e}")
         return None
     
-    def extract_from_cf_090227(self, soup: BeautifulSoup) -> List[str]:
+    def extract_from_cf_090227(self, soup: BeautifulSoup) -> List[IPRecord]:
         """从cf.090227.xyz提取IP数据"""
-        data = []
-        rows = soup.find_all('tr')
-        for row in rows:
-            columns = row.find_all('td')
-            if len(columns) >= 3:
-                line_name = columns[0].text.strip()
-                ip_address = columns[1].text.strip()
-                latency_text = columns[2].text.strip()
-                latency_match = self.latency_pattern.match(latency_text)
-                if latency_match:
-                    latency_value = latency_match.group(1)
-                    data.append(f"{ip_address}#{line_name}-{latency_value}ms")
-        return data
-    
-    def extract_from_hostmonit(self, soup: BeautifulSoup) -> List[str]:
+        return self.site_specs['cf.090227.xyz'].parse_soup(soup)
+
+    def extract_from_hostmonit(self, soup: BeautifulSoup) -> List[IPRecord]:
         """从stock.hostmonit.com提取IP数据"""
-        data = []
-        rows = soup.find_all('tr', class_=re.compile(r'el-table__row'))
-        for row in rows:
-            columns = row.find_all('td')
-            if len(columns) >= 3:
-                line_name = columns[0].text.strip()
-                ip_address = columns[1].text.strip()
-                latency_text = columns[2].text.strip()
-                latency_match = self.latency_pattern.match(latency_text)
-                if latency_match:
-                    latency_value = latency_match.group(1)
-                    data.append(f"{ip_address}#{line_name}-{latency_value}ms")
-        return data
-    
-    def extract_from_164746(self, soup: BeautifulSoup) -> List[str]:
+        return self.site_specs['stock.hostmonit.com'].parse_soup(soup)
+
+    def extract_from_164746(self, soup: BeautifulSoup) -> List[IPRecord]:
         """从ip.164746.xyz提取IP数据"""
-        data = []
-        rows = soup.find_all('tr')
-        for row in rows:
-            columns = row.find_all('td')
-            if len(columns) >= 5:
-                ip_address = columns[0].text.strip()
-                latency_text = columns[4].text.strip()
-                latency_match = self.latency_pattern.match(latency_text)
-                if latency_match:
-                    latency_value = latency_match.group(1)
-                    data.append(f"{ip_address}-{latency_value}ms")
-        return data
-    
-    def extract_from_gacjie(self, soup: BeautifulSoup) -> List[str]:
+        return self.site_specs['ip.164746.xyz'].parse_soup(soup)
+
+    def extract_from_gacjie(self, soup: BeautifulSoup) -> List[IPRecord]:
         """从monitor.gacjie.cn提取IP数据"""
-        data = []
-        rows = soup.find_all('tr')
-        for row in rows:
-            tds = row.find_all('td')
-            if len(tds) >= 5:
-                line_name = tds[0].text.strip()
-                ip_address = tds[1].text.strip()
-                latency_text = tds[4].text.strip()
-                latency_match = self.latency_pattern.match(latency_text)
-                if latency_match:
-                    latency_value = latency_match.group(1)
-                    data.append(f"{ip_address}#{line_name}-{latency_value}ms")
-        return data
-    
-    def extract_from_345673(self, soup: BeautifulSoup) -> List[str]:
+        return self.site_specs['monitor.gacjie.cn'].parse_soup(soup)
+
+    def extract_from_345673(self, soup: BeautifulSoup) -> List[IPRecord]:
         """从345673.xyz提取IP数据"""
-        data = []
-        rows = soup.find_all('tr', class_=re.compile(r'line-cm|line-ct|line-cu'))
-        for row in rows:
-            tds = row.find_all('td')
-            if len(tds) >= 4:
-                line_name = tds[0].text.strip()
-                ip_address = tds[1].text.strip()
-                latency_text = tds[3].text.strip()
-                latency_match = self.latency_pattern.match(latency_text)
-                if latency_match:
-                    latency_value = latency_match.group(1)
-                    data.append(f"{ip_address}#{line_name}-{latency_value}ms")
+        return self.site_specs['345673.xyz'].parse_soup(soup)
+
+    def iter_text_url(self, url: str) -> Iterator[IPRecord]:
+        """
+        流式获取文本URL中的IP数据，边下载边产出，不在内存中保留完整响应
+
+        启用HTTP缓存时，缓存命中或304会直接产出缓存数据。
+
+        Args:
+            url: 文本文件URL
+
+        Yields:
+            每个有效行对应的IP数据，无效行按原因计入 metrics 的 rejects
+        """
+        if self.http_cache:
+            data = self._fetch_parsed(
+                url,
+                lambda response: self._parse_text_lines(self._iter_response_lines(response, url), url),
+                headers=self.headers,
+                stream=True
+            )
+            yield from data or []
+            return
+
+        response = self._http_request('GET', url, headers=self.headers, stream=True)
+        if response.status_code != 200:
+            response.close()
+            print(f"文本URL请求失败: {url}, 状态码: {response.status_code}")
+            return
+        parser = IngestParser()
+        try:
+            yield from self._timed_parse(parser.parse_lines(self._iter_response_lines(response, url), url, time.time()),
+                                         url)
+        finally:
+            self._record_rejects(url, parser)
+
+    def _parse_text_lines(self, lines: Iterable[str], source: str) -> List[IPRecord]:
+        """将文本数据源的各行（_iter_response_lines）解析为IP数据，丢弃无效行"""
+        parser = IngestParser()
+        data = list(self._timed_parse(parser.parse_lines(lines, source, time.time()), source))
+        self._record_rejects(source, parser)
         return data
-    
-    def extract_from_text_url(self, url: str) -> List[str]:
+
+    def _record_rejects(self, source: str, parser: IngestParser) -> None:
+        """记录数据源被拒绝的行数"""
+        if parser.rejects:
+            self.metrics.record_rejects(source, parser.rejects)
+            print(f"{source} 跳过 {parser.rejected} 行无效数据: {parser.rejects}")
+
+    def extract_from_text_url(self, url: str) -> List[IPRecord]:
         """
         从文本URL获取IP数据（如GitHub上的纯IP列表）
 
@@ -225,20 +3221,14 @@ class IPExtractor:
             IP数据列表
         """
         try:
-            response = requests.get(url, headers=self.headers, timeout=self.timeout)
-            if response.status_code == 200:
-                ip_list = response.text.splitlines()
-                # 过滤空行和无效IP
-                valid_ips = [ip.strip() for ip in ip_list if ip.strip()]
-                print(f"从文本URL {url} 获取到 {len(valid_ips)} 个IP地址")
-                return valid_ips
-            else:
-                print(f"文本URL请求失败: {url}, 状态码: {response.status_code}")
+            valid_ips = list(self.iter_text_url(url))
+            print(f"从文本URL {url} 获取到 {len(valid_ips)} 个IP地址")
+            return valid_ips
         except Exception as e:
             print(f"从文本URL获取IP数据时出错 {url}: {e}")
         return []
 
-    def extract_from_api(self, api_config: dict) -> List[str]:
+    def extract_from_api(self, api_config: dict) -> List[IPRecord]:
         """
         从API接口获取IP数据
 
@@ -250,34 +3240,38 @@ class IPExtractor:
         """
         try:
             if api_config['method'].upper() == 'POST':
-                response = requests.post(
+                response = self._http_request(
+                    'POST',
                     api_config['url'],
                     headers=api_config.get('headers', {}),
-                    json=api_config.get('data', {}),
-                    timeout=self.timeout
+                    json=api_config.get('data', {})
                 )
             else:
-                response = requests.get(
+                response = self._http_request(
+                    'GET',
                     api_config['url'],
-                    headers=api_config.get('headers', {}),
-                    timeout=self.timeout
+                    headers=api_config.get('headers', {})
                 )
 
             if response.status_code == 200:
-                return self.parse_api_response(response.json(), api_config['parser'])
+                parse_start = time.perf_counter()
+                data = self.parse_api_response(response.json(), api_config['parser'], source=api_config['url'])
+                self.metrics.update(api_config['url'], parse_ms=(time.perf_counter() - parse_start) * 1000)
+                return data
             else:
                 print(f"API请求失败: {api_config['url']}, 状态码: {response.status_code}")
         except Exception as e:
             print(f"从API获取IP数据时出错 {api_config['url']}: {e}")
         return []
 
-    def parse_api_response(self, data: dict, parser_type: str) -> List[str]:
+    def parse_api_response(self, data: dict, parser_type: str, source: str = None) -> List[IPRecord]:
         """
         解析API响应数据
 
         Args:
             data: API响应的JSON数据
             parser_type: 解析器类型
+            source: 数据源URL
 
         Returns:
             IP数据列表
@@ -285,19 +3279,37 @@ class IPExtractor:
         if parser_type == 'hostmonit_api':
             ip_list = []
             if data.get('code') == 200 and 'info' in data:
+                observed_at = time.time()
                 # 提取所有线路的IP地址
                 for line_type in ['CM', 'CT', 'CU']:
                     if line_type in data['info']:
                         for item in data['info'][line_type]:
-                            ip_with_speed = f"{item['ip']}#{item['speed']}mb/s"
-                            ip_list.append(ip_with_speed)
+                            ip_list.append(IPRecord(item['ip'], line=line_type, speed_mbps=float(item['speed']),
+                                                    source=source, observed_at=observed_at))
                 print(f"从API获取到 {len(ip_list)} 个IP地址")
                 return ip_list
             else:
                 print("API响应格式异常")
         return []
 
-    def extract_from_local_file(self, file_path: str) -> List[str]:
+    @staticmethod
+    def iter_local_file(file_path: str, parser: IngestParser = None) -> Iterator[IPRecord]:
+        """
+        逐行读取本地文件中的IP数据，内存占用与文件大小无关
+
+        Args:
+            file_path: 本地文件路径
+            parser: 统计被拒绝行数的解析器，None表示不需要统计
+
+        Yields:
+            每个有效行对应的IP数据
+        """
+        parser = parser or IngestParser()
+        observed_at = os.path.getmtime(file_path)
+        with open(file_path, 'r', encoding='utf-8') as f:
+            yield from parser.parse_lines(f, file_path, observed_at)
+
+    def extract_from_local_file(self, file_path: str) -> List[IPRecord]:
         """
         从本地文件获取IP数据
 
@@ -309,9 +3321,12 @@ class IPExtractor:
         """
         try:
             if os.path.exists(file_path):
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    ip_list = f.read().splitlines()
-                valid_ips = [ip.strip() for ip in ip_list if ip.strip()]
+                parse_start = time.perf_counter()
+                parser = IngestParser()
+                valid_ips = list(self.iter_local_file(file_path, parser))
+                self._record_rejects(file_path, parser)
+                self.metrics.update(file_path, bytes=os.path.getsize(file_path),
+                                    parse_ms=(time.perf_counter() - parse_start) * 1000)
                 print(f"从本地文件 {file_path} 获取到 {len(valid_ips)} 个IP地址")
                 return valid_ips
             else:
@@ -320,7 +3335,7 @@ class IPExtractor:
             print(f"读取本地文件时出错 {file_path}: {e}")
         return []
 
-    def extract_from_html_site(self, url: str) -> List[str]:
+    def extract_from_html_site(self, url: str) -> List[IPRecord]:
         """
         从HTML网站提取IP数据
 
@@ -328,35 +3343,112 @@ class IPExtractor:
             url: 网站URL
 
         Returns:
-            IP数据列表，格式为 "IP#线路-延迟ms" 或 "IP-延迟ms"
+            IP数据列表（包含线路和延迟）
         """
-        soup = self.fetch_page_content(url)
-        if not soup:
+        if self.get_site_spec(url) is None:
+            print(f"Unsupported HTML URL: {url}")
             return []
 
-        # 根据URL选择对应的提取方法
-        if "cf.090227.xyz" in url:
-            return self.extract_from_cf_090227(soup)
-        elif "stock.hostmonit.com" in url:
-            return self.extract_from_hostmonit(soup)
-        elif "ip.164746.xyz" in url:
-            return self.extract_from_164746(soup)
-        elif "monitor.gacjie.cn" in url:
-            return self.extract_from_gacjie(soup)
-        elif "345673.xyz" in url:
-            return self.extract_from_345673(soup)
-        else:
-            print(f"Unsupported HTML URL: {url}")
+        try:
+            data = self._fetch_parsed(
+                url,
+                lambda response: self.parse_html_site(url, response.content),
+                headers=self.headers
+            )
+        except requests.RequestException as e:
+            print(f"Request failed for {url}: {e}")
+            return []
+        return data or []
+
+    def parse_html_site(self, url: str, content: bytes, html_parser: str = None,
+                        table_only: bool = None) -> List[IPRecord]:
+        """
+        解析HTML网站页面
+
+        Args:
+            url: 网站URL（用于选择提取规则）
+            content: 页面原始字节
+            html_parser: 解析引擎，None表示使用实例配置
+            table_only: 是否只解析表格行，None表示使用实例配置
+
+        Returns:
+            IP数据列表，不支持的URL返回空列表
+        """
+        spec = self.get_site_spec(url)
+        if spec is None:
             return []
+        html_parser = html_parser or self.html_parser
+        table_only = self.table_only if table_only is None else table_only
+        if self.parse_processes > 0 and len(content) >= self.parse_inline_bytes:
+            executor = _get_parse_executor(self.parse_processes)
+            try:
+                data = executor.submit(parse_table_page, content, spec, html_parser, table_only, url).result()
+            except concurrent.futures.process.BrokenProcessPool as e:
+                print(f"解析进程池不可用，改为直接解析 {url}: {e}")
+                _discard_parse_executor(executor)
+            else:
+                self._count_parse('offloaded')
+                return data
+        self._count_parse('inline')
+        return parse_table_page(content, spec, html_parser, table_only, url)
+
+    def _count_parse(self, mode: str) -> None:
+        with self._parse_stats_lock:
+            self.parse_stats[mode] += 1
+
+    def register_html_site(self, spec) -> TableSiteSpec:
+        """
+        注册HTML网站表格规则，同一主机名的规则会被替换
+
+        Args:
+            spec: TableSiteSpec 或配置字典（键与 TableSiteSpec 构造参数相同）
+
+        Returns:
+            注册的规则
+        """
+        if isinstance(spec, dict):
+            spec = TableSiteSpec.from_dict(spec)
+        self.site_specs[spec.host] = spec
+        return spec
+
+    def get_site_spec(self, url: str) -> Optional[TableSiteSpec]:
+        """
+        根据URL的主机名选择表格提取规则
+
+        Args:
+            url: 网站URL
+
+        Returns:
+            表格提取规则，不支持的URL返回None
+        """
+        return self.site_specs.get(urlparse(url).hostname)
+
+    def get_site_extractor(self, url: str) -> Optional[Callable[[BeautifulSoup], List[IPRecord]]]:
+        """
+        根据URL选择对应的HTML提取方法
+
+        Args:
+            url: 网站URL
+
+        Returns:
+            提取方法，不支持的URL返回None
+        """
+        spec = self.get_site_spec(url)
+        return spec.parse_soup if spec else None
     
     def get_all_ips(self,
                     html_urls: List[str] = None,
                     text_urls: List[str] = None,
                     api_sources: List[dict] = None,
                     local_files: List[str] = None,
-                    include_all_sources: bool = True) -> List[str]:
+                    include_all_sources: bool = True,
+                    max_workers: int = None,
+                    overall_timeout: float = None) -> List[IPRecord]:
         """
-        从所有支持的数据源获取IP数据
+        从所有支持的数据源并发获取IP数据
+
+        各数据源并发获取，结果按数据源顺序（HTML网站、文本URL、API、本地文件）合并，
+        超过总体截止时间仍未返回的数据源会被跳过。
 
         Args:
             html_urls: 自定义HTML网站URL列表
@@ -364,12 +3456,12 @@ class IPExtractor:
             api_sources: 自定义API源列表
             local_files: 自定义本地文件列表
             include_all_sources: 是否包含所有默认数据源
+            max_workers: 最大并发数，None表示使用实例配置
+            overall_timeout: 总体截止时间（秒），None表示使用实例配置
 
         Returns:
             所有IP数据的列表
         """
-        all_data = []
-
         # 如果启用所有数据源，使用默认配置
         if include_all_sources:
             html_urls = html_urls or self.html_urls
@@ -382,59 +3474,206 @@ class IPExtractor:
             api_sources = api_sources or []
             local_files = local_files or []
 
-        # 从HTML网站获取数据
-        for url in html_urls:
-            print(f"正在从HTML网站获取IP数据: {url}")
-            site_data = self.extract_from_html_site(url)
-            all_data.extend(site_data)
-            print(f"从 {url} 获取到 {len(site_data)} 条数据")
+        tasks = self._build_source_tasks(html_urls, text_urls, api_sources, local_files)
+        results = self._run_source_tasks(
+            tasks,
+            max_workers=max_workers if max_workers is not None else self.max_workers,
+            overall_timeout=overall_timeout if overall_timeout is not None else self.overall_timeout
+        )
 
-        # 从文本URL获取数据
-        for url in text_urls:
-            print(f"正在从文本URL获取IP数据: {url}")
-            text_data = self.extract_from_text_url(url)
-            all_data.extend(text_data)
-            print(f"从 {url} 获取到 {len(text_data)} 条数据")
+        # 按数据源顺序合并结果，保证输出顺序与并发完成顺序无关
+        all_data = []
+        self._record_origins = {}
+        for (_, label, _), source_data in zip(tasks, results):
+            all_data.extend(source_data)
+            for record in source_data:
+                self._record_origins.setdefault(record, []).append(label)
+            self.metrics.update(label, records=len(source_data))
+            print(f"从 {label} 获取到 {len(source_data)} 条数据")
 
-        # 从API获取数据
+        if self.source_health is not None:
+            self.source_health.save()
+
+        print(f"总共获取到 {len(all_data)} 条IP数据")
+        return all_data
+
+    def _build_source_tasks(self,
+                            html_urls: List[str],
+                            text_urls: List[str],
+                            api_sources: List[dict],
+                            local_files: List[str]) -> List[Tuple[str, str, Callable[[], List[IPRecord]]]]:
+        """
+        按数据源顺序构建获取任务列表
+
+        Returns:
+            (数据源类型, 数据源标识, 获取函数) 元组列表
+        """
+        tasks = []
+        for url in html_urls:
+            tasks.append(("HTML网站", url, functools.partial(self.extract_from_html_site, url)))
+        for url in text_urls:
+            tasks.append(("文本URL", url, functools.partial(self.extract_from_text_url, url)))
         for api_config in api_sources:
-            print(f"正在从API获取IP数据: {api_config['url']}")
-            api_data = self.extract_from_api(api_config)
-            all_data.extend(api_data)
-            print(f"从 {api_config['url']} 获取到 {len(api_data)} 条数据")
+            tasks.append(("API", api_config['url'], functools.partial(self.extract_from_api, api_config)))
+        if self.source_health is not None:
+            tasks = [
+                (kind, label, functools.partial(self._fetch_with_health, label, fetch))
+                for kind, label, fetch in tasks
+            ]
 
-        # 从本地文件获取数据
         for file_path in local_files:
-            print(f"正在从本地文件获取IP数据: {file_path}")
-            file_data = self.extract_from_local_file(file_path)
-            all_data.extend(file_data)
-            print(f"从 {file_path} 获取到 {len(file_data)} 条数据")
+            tasks.append(("本地文件", file_path, functools.partial(self.extract_from_local_file, file_path)))
 
-        print(f"总共获取到 {len(all_data)} 条IP数据")
-        return all_data
+        if self.snapshot is not None:
+            tasks = [
+                (kind, label, functools.partial(self.snapshot.get_or_fetch, f"{kind}:{label}", fetch))
+                for kind, label, fetch in tasks
+            ]
+        return tasks
+
+    def _fetch_with_health(self, source: str, fetch: Callable[[], List[IPRecord]]) -> List[IPRecord]:
+        """
+        在熔断器保护下获取网络数据源，使用该数据源的自适应超时
+
+        没有返回任何数据（请求失败、超时或解析为空）视为失败。
+        耗时样本只统计实际的网络请求（不含解析），流式响应只计读取数据块的时间，使用缓存时不记录样本。
+        """
+        if not self.source_health.allow_request(source):
+            print(f"数据源已熔断，冷却期内跳过: {source}")
+            return []
+
+        self._local.timeout = self.source_health.get_timeout(source, self.timeout)
+        self._local.request_latencies = []
+        try:
+            data = fetch()
+        except Exception:
+            self.source_health.record_failure(source)
+            raise
+        finally:
+            self._local.timeout = None
+            latencies, self._local.request_latencies = self._local.request_latencies, None
+
+        if data:
+            # 使用缓存（未过期或304）时没有网络耗时，不计入耗时样本
+            self.source_health.record_success(source, sum(latencies) if latencies else None)
+        else:
+            self.source_health.record_failure(source)
+            if self.source_health.get_state(source) == SourceHealth.OPEN:
+                print(f"数据源连续失败，已熔断: {source}")
+        return data
+
+    def _fetch_before_deadline(self, deadline: Optional[float], source: str,
+                               fetch: Callable[[], List[IPRecord]]) -> List[IPRecord]:
+        """
+        在工作线程中执行数据源获取，期间的HTTP请求超时不超过到 deadline（time.monotonic()）的剩余时间
+
+        Args:
+            deadline: 总体截止时间，None表示不限制
+            source: 数据源标识
+            fetch: 获取函数
+        """
+        self._local.deadline = deadline
+        try:
+            return self._timed_fetch(source, fetch)
+        finally:
+            self._local.deadline = None
+
+    def _timed_fetch(self, source: str, fetch: Callable[[], List[IPRecord]]) -> List[IPRecord]:
+        """执行数据源获取并记录总耗时"""
+        start_time = time.perf_counter()
+        try:
+            return fetch()
+        finally:
+            self.metrics.update(source, fetch_ms=(time.perf_counter() - start_time) * 1000)
+
+    def _record_filter_stage(self, stage: str, records: List[IPRecord]) -> None:
+        """统计过滤阶段后各数据源仍保留的记录数"""
+        survivors: Dict[str, int] = {}
+        for record in records:
+            if isinstance(record, MergedIPRecord):
+                origins = record.sources
+            else:
+                origins = self._record_origins.get(record, ())
+            for source in origins:
+                survivors[source] = survivors.get(source, 0) + 1
+        self.metrics.record_filter(stage, survivors)
+
+    def _run_source_tasks(self,
+                          tasks: List[Tuple[str, str, Callable[[], List[IPRecord]]]],
+                          max_workers: int,
+                          overall_timeout: Optional[float]) -> List[List[IPRecord]]:
+        """
+        并发执行数据源获取任务
+
+        Args:
+            tasks: _build_source_tasks 生成的任务列表
+            max_workers: 最大并发线程数
+            overall_timeout: 总体截止时间（秒），None表示不限制
+
+        Returns:
+            与 tasks 一一对应的结果列表，失败或超时的数据源对应空列表
+        """
+        results = [[] for _ in tasks]
+        if not tasks:
+            return results
+
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, min(max_workers, len(tasks))),
+            thread_name_prefix='ip-source'
+        )
+        futures = {}
+        start_time = time.monotonic()
+        deadline = start_time + overall_timeout if overall_timeout is not None else None
+        for index, (kind, label, fetch) in enumerate(tasks):
+            print(f"正在从{kind}获取IP数据: {label}")
+            futures[executor.submit(self._fetch_before_deadline, deadline, label, fetch)] = index
+
+        try:
+            done, not_done = concurrent.futures.wait(futures, timeout=overall_timeout)
+        finally:
+            # 不等待超时的数据源，避免单个慢速网站拖住整个流程；
+            # 仍在进行的请求受总体截止时间限制，很快结束，不会拖住解释器退出
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        for future in done:
+            index = futures[future]
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                print(f"从 {tasks[index][1]} 获取IP数据时出错: {e}")
+
+        for future in not_done:
+            print(f"数据源超过总体截止时间 {overall_timeout}s，已跳过: {tasks[futures[future]][1]}")
+
+        print(f"并发获取 {len(tasks)} 个数据源完成，耗时 {time.monotonic() - start_time:.2f}s")
+        return results
     
-    def remove_duplicates(self, ip_list: List[str]) -> List[str]:
+    def remove_duplicates(self, ip_list: List[IPRecord], merge_by_ip: bool = True) -> List[IPRecord]:
         """
-        去除重复的IP数据
+        去除重复的IP数据，保留首次出现的顺序
         
         Args:
-            ip_list: IP数据列表
+            ip_list: IP数据列表（也接受旧版字符串格式）
+            merge_by_ip: 是否按IP地址合并（见 merge_records），False表示只去除完全相同的数据
             
         Returns:
-            去重后的IP数据列表
+            去重后的IP数据列表，按IP地址合并时为 MergedIPRecord 列表
         """
-        unique_data = list(set(ip_list))
+        records = to_records(ip_list)
+        unique_data = merge_records(records) if merge_by_ip else list(dict.fromkeys(records))
         print(f"去重前: {len(ip_list)} 条数据，去重后: {len(unique_data)} 条数据")
+        self._record_filter_stage('dedup', unique_data)
         return unique_data
     
-    def filter_by_latency(self, ip_list: List[str], max_latency: float = 100.0, keep_no_latency: bool = True) -> List[str]:
+    def filter_by_latency(self, ip_list: List[IPRecord], max_latency: float = 100.0,
+                          keep_no_latency: bool = True) -> List[IPRecord]:
         """
         根据延迟过滤IP数据
 
         Args:
-            ip_list: IP数据列表
+            ip_list: IP数据列表（也接受旧版字符串格式）
             max_latency: 最大延迟阈值（毫秒）
-            keep_no_latency: 是否保留没有延迟信息的IP
+            keep_no_latency: 是否保留没有延迟信息的IP（只有速度信息的IP始终保留）
 
         Returns:
             过滤后的IP数据列表
@@ -442,135 +3681,385 @@ class IPExtractor:
         filtered_data = []
         no_latency_count = 0
 
-        for line in ip_list:
-            try:
-                # 检查是否包含延迟信息
-                if 'ms' in line or 'mb/s' in line:
-                    # 尝试提取延迟值
-                    if 'ms' in line:
-                        # 格式如: "IP#线路-25ms" 或 "IP-25ms"
-                        latency_str = line.split('-')[-1].replace('ms', '')
-                        latency_value = float(latency_str)
-                        if latency_value < max_latency:
-                            filtered_data.append(line)
-                    elif 'mb/s' in line:
-                        # 格式如: "IP#5mb/s" (来自API的速度信息，保留所有)
-                        filtered_data.append(line)
-                else:
-                    # 纯IP地址，没有延迟信息
-                    if keep_no_latency:
-                        filtered_data.append(line)
-                        no_latency_count += 1
-            except (ValueError, IndexError):
-                # 如果无法解析延迟值，根据设置决定是否保留
-                if keep_no_latency:
-                    filtered_data.append(line)
-                    no_latency_count += 1
+        for record in to_records(ip_list):
+            if record.latency_ms is not None:
+                if record.latency_ms < max_latency:
+                    filtered_data.append(record)
+            elif record.speed_mbps is not None:
+                # 来自API的速度信息，保留所有
+                filtered_data.append(record)
+            elif keep_no_latency:
+                filtered_data.append(record)
+                no_latency_count += 1
 
         print(f"延迟过滤前: {len(ip_list)} 条数据，过滤后: {len(filtered_data)} 条数据（延迟 < {max_latency}ms）")
+        self._record_filter_stage('latency', filtered_data)
         if no_latency_count > 0:
             print(f"其中 {no_latency_count} 条数据没有延迟信息{'（已保留）' if keep_no_latency else '（已过滤）'}")
         return filtered_data
     
-    def extract_ip_addresses(self, ip_list: List[str]) -> List[str]:
+    def select_best_ips(self, ip_list: List[IPRecord], count: int) -> List[IPRecord]:
+        """
+        选出最佳的count个不同IP：延迟最低优先，延迟相同（或都没有延迟）时速度最高优先，
+        仍然相同时保持输入顺序，结果是确定的
+
+        每个IP地址先保留其最佳的一条数据，再用大小为count的堆选出前count个，一次遍历，复杂度O(n log count)。
+
+        Args:
+            ip_list: IP数据列表（也接受旧版字符串格式）
+            count: 选取的IP数量
+
+        Returns:
+            按优先顺序排列的IP数据，每个IP地址只出现一次
+        """
+        if count <= 0:
+            return []
+        best: Dict[str, Tuple[tuple, IPRecord]] = {}
+        for index, record in enumerate(to_records(ip_list)):
+            key = (record.latency_ms is None, record.latency_ms or 0.0,
+                   record.speed_mbps is None, -(record.speed_mbps or 0.0), index)
+            current = best.get(record.ip)
+            if current is None or key < current[0]:
+                best[record.ip] = (key, record)
+        return [record for _, record in heapq.nsmallest(count, best.values(), key=lambda entry: entry[0])]
+
+    def build_carrier_index(self, ip_list: List[IPRecord]) -> CarrierIndex:
+        """
+        按运营商（移动CM、电信CT、联通CU）建立索引
+
+        Args:
+            ip_list: IP数据列表
+
+        Returns:
+            CarrierIndex，可按运营商查询延迟最低的IP
+        """
+        return CarrierIndex(ip_list)
+
+    def extract_ip_addresses(self, ip_list: List[IPRecord]) -> List[str]:
         """
         从IP数据中提取纯IP地址
 
         Args:
-            ip_list: IP数据列表（支持多种格式）
+            ip_list: IP数据列表（也接受旧版字符串格式）
 
         Returns:
             纯IP地址列表
         """
-        ip_addresses = []
-        for line in ip_list:
-            # 提取IP地址部分（去除线路、延迟、速度等信息）
-            ip = line.strip()
+        return [record.ip for record in to_records(ip_list) if record.ip]
 
-            # 处理不同格式
-            if '#' in ip:
-                # 格式如: "IP#线路-延迟ms" 或 "IP#速度mb/s"
-                ip = ip.split('#')[0]
-            elif '-' in ip:
-                # 格式如: "IP-延迟ms"
-                ip = ip.split('-')[0]
-            # 否则就是纯IP地址
+    def region_lookup_available(self) -> bool:
+        """地区查询是否可用（需要离线IP地区数据库、ipwhois模块，或使用回放模式）"""
+        return self.geoip_db is not None or self.rdap_available()
 
-            ip = ip.strip()
-            if ip:  # 确保不是空字符串
-                ip_addresses.append(ip)
+    def rdap_available(self) -> bool:
+        """RDAP查询是否可用（需要ipwhois模块，或使用回放模式）"""
+        return IPWHOIS_AVAILABLE or (self.fixtures is not None and self.fixtures.replaying)
+
+    def _lookup_rdap(self, ip_address: str) -> dict:
+        """
+        执行RDAP查询，支持录制/回放
+
+        Returns:
+            IPWhois.lookup_rdap() 的结果
+        """
+        if self.fixtures is not None and self.fixtures.replaying:
+            return self.fixtures.replay_rdap(ip_address)
 
-        return ip_addresses
+        start_time = time.perf_counter()
+        try:
+            results = IPWhois(ip_address).lookup_rdap()
+        except Exception:
+            if self.fixtures is not None:
+                self.fixtures.record_rdap(ip_address, None, time.perf_counter() - start_time)
+            raise
+        if self.fixtures is not None:
+            self.fixtures.record_rdap(ip_address, results, time.perf_counter() - start_time)
+        return results
 
     def get_ip_region(self, ip_address: str) -> Optional[str]:
         """
         获取IP地址的地区代码
 
+        依次使用离线IP地区数据库（geoip_db）、地区缓存、网段索引（region_prefixes）和RDAP查询；
+        RDAP返回的网段加入网段索引，结果写入地区缓存（包括查询失败的结果）。
+        缓存中的失败结果只在网段索引也无法回答时使用，之后查到的网段仍能覆盖它。
+
         Args:
             ip_address: IP地址
 
         Returns:
             地区代码（如 'SG', 'TW', 'JP'），如果无法确定则返回None
         """
-        if not IPWHOIS_AVAILABLE:
-            print(f"警告: 无法查询IP {ip_address} 的地区信息，ipwhois模块不可用")
+        if self.geoip_db is not None:
+            region = self.geoip_db.lookup(ip_address)
+            if region is not None:
+                return region
+
+        entry = self.region_cache.get(ip_address) if self.region_cache is not None else None
+        if entry is not None and entry['country'] is not None:
+            return entry['country']
+
+        network = self.region_prefixes.lookup(ip_address)
+        if network is not None:
+            return network['country']
+        if entry is not None:
+            return None
+
+        if not self.rdap_available():
+            if self.geoip_db is None:
+                print(f"警告: 无法查询IP {ip_address} 的地区信息，ipwhois模块不可用")
             return None
 
+        info = self.lookup_region_info(ip_address)
+        if info and info['country'] and info['cidr']:
+            added = self.region_prefixes.add(info['cidr'], info['country'], info['asn'])
+            if added and self.region_cache is not None:
+                self.region_cache.put_networks(added)
+        if self.region_cache is not None:
+            self.region_cache.put(ip_address, **(info or {'country': None}))
+        return info['country'] if info else None
+
+    def lookup_region_info(self, ip_address: str) -> Optional[dict]:
+        """
+        通过RDAP查询IP地址的地区信息（不使用缓存）
+
+        Args:
+            ip_address: IP地址
+
+        Returns:
+            字典：country（地区代码，无法确定时为None）、cidr（网段）、asn，查询失败时返回None
+        """
         try:
             # 使用IPWhois查询IP地理信息
-            obj = IPWhois(ip_address)
-            results = obj.lookup_rdap()
+            results = self._lookup_rdap(ip_address)
 
             if not results:
                 return None
 
+            network = results.get('network') or {}
+            info = {'country': None, 'cidr': network.get('cidr') or results.get('asn_cidr'),
+                    'asn': results.get('asn')}
+
             # 尝试从network字段获取国家代码
-            country = None
-            if 'network' in results and results['network']:
-                country = results['network'].get('country')
+            country = network.get('country')
 
             # 如果没有找到，尝试从其他字段获取
             if not country and 'objects' in results:
-                for _, obj_data in results['objects'].items():
-                    if 'contact' in obj_data and 'address' in obj_data['contact']:
+                for _, obj_data in (results['objects'] or {}).items():
+                    if obj_data and obj_data.get('contact') and obj_data['contact'].get('address'):
                         for addr in obj_data['contact']['address']:
                             if 'value' in addr:
                                 address_text = addr['value'].lower()
                                 # 检查地址中是否包含地区关键词
-                                for region_code, keywords in self.region_codes.items():
-                                    for keyword in keywords:
-                                        if keyword.lower() in address_text:
-                                            return region_code
+                                country = self._match_region_keywords(address_text)
+                                if country:
+                                    break
+                    if country:
+                        break
 
             # 检查网络名称是否包含地区标识
-            if not country and 'network' in results and results['network']:
-                network_name = results['network'].get('name', '').lower()
-                for region_code, keywords in self.region_codes.items():
-                    for keyword in keywords:
-                        if keyword.lower() in network_name:
-                            return region_code
+            if not country and network:
+                country = self._match_region_keywords((network.get('name') or '').lower())
 
-            return country.upper() if country else None
+            info['country'] = country.upper() if country else None
+            return info
 
         except Exception as e:
             print(f"查询IP {ip_address} 地区信息时出错: {e}")
             return None
 
-    def filter_by_regions(self, ip_list: List[str], target_regions: List[str],
-                         max_workers: int = 10, show_progress: bool = True) -> List[str]:
+    def _match_region_keywords(self, text: str) -> Optional[str]:
+        """在文本中查找地区关键词，返回对应的地区代码"""
+        for region_code, keywords in self.region_codes.items():
+            for keyword in keywords:
+                if keyword.lower() in text:
+                    return region_code
+        return None
+
+    def iter_ip_regions(self, ip_addresses: Iterable[str], max_workers: int = 10,
+                        timeout: Optional[float] = 15.0, cancel_event: threading.Event = None,
+                        progress: Callable[[dict], None] = None) -> Iterator[Tuple[str, Optional[str]]]:
+        """
+        并发查询IP地区，按完成顺序产出结果
+
+        同时进行的查询不超过 max_workers 个，完成一个再提交下一个；
+        单个IP的查询从开始执行起超过 timeout 秒即放弃（产出None），不阻塞其他IP。
+        设置 cancel_event 或提前停止迭代时取消尚未开始的查询。
+        启用离线IP地区数据库时先批量查询数据库，再批量读取地区缓存，命中的IP直接产出，只查询未命中的IP；
+        提交查询前先查网段索引，已完成的查询返回的网段内的IP不再提交。
+        缓存中的失败结果与 get_ip_region 一样，只在网段索引无法回答时产出None。
+
+        Args:
+            ip_addresses: IP地址（重复的地址只查询一次）
+            max_workers: 最大并发查询数
+            timeout: 单个IP的查询超时（秒），None表示不限制
+            cancel_event: 设置后停止查询
+            progress: 每完成一个IP调用一次，参数为统计字典：
+                total、done、resolved、unresolved、timed_out、offline、cached、prefix_hits、in_flight、elapsed
+
+        Yields:
+            (IP地址, 地区代码)，无法确定或超时时地区代码为None
+        """
+        ips = list(dict.fromkeys(ip_addresses))
+        if not ips:
+            return
+        stats = {'total': len(ips), 'done': 0, 'resolved': 0, 'unresolved': 0, 'timed_out': 0,
+                 'offline': 0, 'cached': 0, 'prefix_hits': 0, 'in_flight': 0, 'elapsed': 0.0}
+        started: Dict[str, float] = {}
+        futures: Dict[concurrent.futures.Future, str] = {}
+        start_time = time.monotonic()
+
+        def lookup(ip_address: str) -> Optional[str]:
+            started[ip_address] = time.monotonic()
+            return self.get_ip_region(ip_address)
+
+        def finish(field: str) -> None:
+            stats['done'] += 1
+            stats[field] += 1
+            stats['in_flight'] = len(futures)
+            stats['elapsed'] = time.monotonic() - start_time
+            if progress is not None:
+                progress(dict(stats))
+
+        if self.geoip_db is not None:
+            offline = dict(zip(ips, self.geoip_db.classify(ips)))
+            for ip_address in ips:
+                if offline[ip_address] is not None:
+                    stats['offline'] += 1
+                    finish('resolved')
+                    yield ip_address, offline[ip_address]
+            ips = [ip_address for ip_address in ips if offline[ip_address] is None]
+            if not ips:
+                return
+
+        # 缓存中查询失败的IP，留到提交查询时先查网段索引
+        negative = set()
+        if self.region_cache is not None:
+            cached = self.region_cache.get_many(ips)
+            for ip_address in ips:
+                if ip_address not in cached:
+                    continue
+                region = cached[ip_address]['country']
+                if region is None:
+                    negative.add(ip_address)
+                    continue
+                stats['cached'] += 1
+                finish('resolved')
+                yield ip_address, region
+            ips = [ip_address for ip_address in ips if ip_address not in cached or ip_address in negative]
+            if not ips:
+                return
+
+        # 每个/16（IPv6为/48）的第一个IP先查询，同网段的其余IP提交时多半已能由网段索引回答
+        ips = self._spread_by_network(ips)
+        max_workers = max(1, min(max_workers, len(ips)))
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ip-region')
+        # 超时后仍在执行的查询，占用线程直到返回
+        abandoned = set()
+        next_index = 0
+        try:
+            while futures or next_index < len(ips):
+                if cancel_event is not None and cancel_event.is_set():
+                    break
+                abandoned = {future for future in abandoned if not future.done()}
+                while next_index < len(ips) and len(futures) + len(abandoned) < max_workers:
+                    ip_address = ips[next_index]
+                    next_index += 1
+                    network = self.region_prefixes.lookup(ip_address)
+                    if network is not None:
+                        stats['prefix_hits'] += 1
+                        finish('resolved')
+                        yield ip_address, network['country']
+                        continue
+                    if ip_address in negative:
+                        stats['cached'] += 1
+                        finish('unresolved')
+                        yield ip_address, None
+                        continue
+                    futures[executor.submit(lookup, ip_address)] = ip_address
+                if not futures and not abandoned:
+                    continue
+
+                wait_timeout = None
+                if timeout is not None:
+                    deadlines = [started[ip] + timeout for ip in futures.values() if ip in started]
+                    wait_timeout = max(0.0, min(deadlines) - time.monotonic()) if deadlines else timeout
+                if cancel_event is not None:
+                    wait_timeout = min(wait_timeout, 0.1) if wait_timeout is not None else 0.1
+                done, _ = concurrent.futures.wait(list(futures) or abandoned, timeout=wait_timeout,
+                                                  return_when=concurrent.futures.FIRST_COMPLETED)
+
+                for future in done:
+                    ip_address = futures.pop(future, None)
+                    if ip_address is None:
+                        continue
+                    try:
+                        region = future.result()
+                    except Exception as e:
+                        print(f"查询IP {ip_address} 地区信息时出错: {e}")
+                        region = None
+                    finish('resolved' if region else 'unresolved')
+                    yield ip_address, region
+
+                if timeout is not None:
+                    now = time.monotonic()
+                    for future, ip_address in list(futures.items()):
+                        if ip_address in started and now - started[ip_address] >= timeout and not future.done():
+                            del futures[future]
+                            abandoned.add(future)
+                            print(f"查询IP {ip_address} 地区信息超时（{timeout}s），已跳过")
+                            finish('timed_out')
+                            yield ip_address, None
+        finally:
+            # 不等待超时或已取消的查询，未开始的查询直接取消
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def _spread_by_network(ip_addresses: List[str]) -> List[str]:
+        """按在所属/16（IPv6为/48）中出现的次序排列IP：先排每个网段的第一个IP，再排第二个，依此类推"""
+        seen: Dict[bytes, int] = {}
+        ranks = []
+        for ip_address in ip_addresses:
+            try:
+                packed = ipaddress.ip_address(ip_address).packed
+                key = packed[:2] if len(packed) == 4 else packed[:6]
+            except ValueError:
+                key = ip_address.encode('utf-8')
+            rank = seen.get(key, 0)
+            seen[key] = rank + 1
+            ranks.append(rank)
+        return [ip_address for _, ip_address in sorted(zip(ranks, ip_addresses), key=lambda item: item[0])]
+
+    @staticmethod
+    def _print_region_progress(stats: dict) -> None:
+        """每完成约10%打印一次地区查询进度"""
+        step = max(1, stats['total'] // 10)
+        if stats['done'] % step == 0 or stats['done'] == stats['total']:
+            print(f"地区查询进度: {stats['done']}/{stats['total']}，已识别 {stats['resolved']}，"
+                  f"缓存命中 {stats['cached']}，超时 {stats['timed_out']}，耗时 {stats['elapsed']:.1f}s")
+
+    def filter_by_regions(self, ip_list: List[IPRecord], target_regions: List[str],
+                         max_workers: int = 10, show_progress: bool = True,
+                         timeout: Optional[float] = 15.0, cancel_event: threading.Event = None,
+                         progress: Callable[[dict], None] = None) -> List[IPRecord]:
         """
         根据地区过滤IP地址
 
+        每个IP地址只查询一次，查询到的地区记录在 record.region 中。
+
         Args:
             ip_list: IP数据列表
             target_regions: 目标地区代码列表（如 ['SG', 'TW', 'JP']）
             max_workers: 最大并发查询数
             show_progress: 是否显示进度
+            timeout: 单个IP的查询超时（秒），None表示不限制
+            cancel_event: 设置后停止查询，只返回已查询到的结果
+            progress: 进度回调，参数见 iter_ip_regions，指定后不再打印进度
 
         Returns:
-            过滤后的IP数据列表，如果没有符合条件的IP则返回空列表
+            过滤后的IP数据列表（保持输入顺序），如果没有符合条件的IP则返回空列表
         """
-        if not IPWHOIS_AVAILABLE:
+        if not self.region_lookup_available():
             print("错误: ipwhois模块不可用，无法进行地区过滤")
             print("请安装ipwhois模块: pip install ipwhois")
             return []  # 严格返回空列表，不返回原始数据
@@ -579,16 +4068,28 @@ class IPExtractor:
             print("警告: 未指定目标地区，返回空列表")
             return []
 
-        # 提取纯IP地址进行查询
-        ip_addresses = self.extract_ip_addresses(ip_list)
-        filtered_data = []
+        records = to_records(ip_list)
+        ip_addresses = list(dict.fromkeys(self.extract_ip_addresses(records)))
+        targets = {region.upper() for region in target_regions}
 
         print(f"开始地区过滤，目标地区: {target_regions}")
         print(f"需要查询 {len(ip_addresses)} 个IP地址...")
 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # 实现并发IP地区查询
-            pass
+        if progress is None and show_progress:
+            progress = self._print_region_progress
+        regions = dict(self.iter_ip_regions(ip_addresses, max_workers=max_workers, timeout=timeout,
+                                            cancel_event=cancel_event, progress=progress))
+
+        filtered_data = []
+        for record in records:
+            region = regions.get(record.ip)
+            if region is not None:
+                record.region = region
+                if region in targets:
+                    filtered_data.append(record)
+        self._record_filter_stage('region', filtered_data)
+        print(f"地区过滤完成: {len(filtered_data)}/{len(records)} 条数据属于 {target_regions}")
+        return filtered_data
 
     def get_ips_by_regions(self, target_regions: List[str],
                           max_latency: float = 100.0,
@@ -596,7 +4097,7 @@ class IPExtractor:
                           include_text: bool = True,
                           include_api: bool = True,
                           include_local: bool = True,
-                          max_workers: int = 10) -> Tuple[List[str], List[str]]:
+                          max_workers: int = 10) -> Tuple[List[IPRecord], List[str]]:
         """
         获取指定地区的IP地址
 
@@ -614,7 +4115,7 @@ class IPExtractor:
             如果没有符合条件的IP，返回 ([], [])
         """
         # 严格检查前置条件
-        if not IPWHOIS_AVAILABLE:
+        if not self.region_lookup_available():
             print("错误: ipwhois模块不可用，无法进行地区过滤")
             print("请安装ipwhois模块: pip install ipwhois")
             return [], []
@@ -649,23 +4150,23 @@ class IPExtractor:
 
         return region_filtered, ip_addresses
     
-    def save_to_file(self, ip_list: List[str], filename: str) -> None:
+    def save_to_file(self, ip_list: List[IPRecord], filename: str) -> None:
         """
-        将IP数据保存到文件
+        将IP数据保存到文件，每行一条 "IP#线路-延迟ms" 格式的数据
         
         Args:
-            ip_list: IP数据列表
+            ip_list: IP数据列表（也接受字符串）
             filename: 文件名
         """
         try:
             with open(filename, 'w', encoding='utf-8') as f:
-                for line in ip_list:
-                    f.write(line + '\n')
+                for record in ip_list:
+                    f.write(f"{record}\n")
             print(f"成功将 {len(ip_list)} 条IP数据保存到 {filename}")
         except Exception as e:
             print(f"保存文件时出错: {e}")
     
-    def get_processed_ips(self, max_latency: float = 100.0, remove_duplicates: bool = True) -> Tuple[List[str], List[str]]:
+    def get_processed_ips(self, max_latency: float = 100.0, remove_duplicates: bool = True) -> Tuple[List[IPRecord], List[str]]:
         """
         获取处理后的IP数据（一站式处理）
         
@@ -696,7 +4197,7 @@ class IPExtractor:
                                     include_text: bool = True,
                                     include_api: bool = True,
                                     include_local: bool = True,
-                                    max_latency: float = 100.0) -> Tuple[List[str], List[str]]:
+                                    max_latency: float = 100.0) -> Tuple[List[IPRecord], List[str]]:
         """
         从特定数据源获取IP数据
 
@@ -744,13 +4245,13 @@ def get_cloudflare_ips(max_latency: float = 100.0, limit: int = None, include_al
     Returns:
         IP地址列表
     """
-    extractor = IPExtractor()
+    extractor = IPExtractor(snapshot=source_snapshot)
 
     if include_all_sources:
-        _, ip_addresses = extractor.get_processed_ips(max_latency=max_latency)
+        filtered_data, ip_addresses = extractor.get_processed_ips(max_latency=max_latency)
     else:
         # 只使用HTML网站数据源（原有的5个网站）
-        _, ip_addresses = extractor.get_ips_from_specific_sources(
+        filtered_data, ip_addresses = extractor.get_ips_from_specific_sources(
             include_html=True,
             include_text=False,
             include_api=False,
@@ -759,8 +4260,8 @@ def get_cloudflare_ips(max_latency: float = 100.0, limit: int = None, include_al
         )
 
     if limit:
-        ip_addresses = ip_addresses[:limit]
-        print(f"限制返回前 {limit} 个IP地址")
+        ip_addresses = extractor.extract_ip_addresses(extractor.select_best_ips(filtered_data, limit))
+        print(f"限制返回最佳的 {limit} 个IP地址")
 
     return ip_addresses
 
@@ -777,11 +4278,11 @@ def get_singapore_ips(max_latency: float = 100.0, limit: int = None, use_region_
     Returns:
         IP地址列表
     """
-    extractor = IPExtractor()
+    extractor = IPExtractor(snapshot=source_snapshot)
 
     if use_region_filter and IPWHOIS_AVAILABLE:
         # 使用地区过滤获取新加坡IP
-        _, ip_addresses = extractor.get_ips_by_regions(
+        filtered_data, ip_addresses = extractor.get_ips_by_regions(
             target_regions=['SG'],
             max_latency=max_latency,
             include_html=False,
@@ -791,7 +4292,7 @@ def get_singapore_ips(max_latency: float = 100.0, limit: int = None, use_region_
         )
     else:
         # 主要从API、文本文件和本地文件获取数据（原有方法）
-        _, ip_addresses = extractor.get_ips_from_specific_sources(
+        filtered_data, ip_addresses = extractor.get_ips_from_specific_sources(
             include_html=False,
             include_text=True,
             include_api=True,
@@ -800,8 +4301,8 @@ def get_singapore_ips(max_latency: float = 100.0, limit: int = None, use_region_
         )
 
     if limit:
-        ip_addresses = ip_addresses[:limit]
-        print(f"限制返回前 {limit} 个新加坡IP地址")
+        ip_addresses = extractor.extract_ip_addresses(extractor.select_best_ips(filtered_data, limit))
+        print(f"限制返回最佳的 {limit} 个新加坡IP地址")
 
     return ip_addresses
 
@@ -827,10 +4328,10 @@ def get_ips_by_regions(target_regions: List[str], max_latency: float = 100.0, li
         print("错误: 未指定目标地区")
         return []
 
-    extractor = IPExtractor()
+    extractor = IPExtractor(snapshot=source_snapshot)
 
     # 使用地区过滤获取指定地区的IP
-    _, ip_addresses = extractor.get_ips_by_regions(
+    filtered_data, ip_addresses = extractor.get_ips_by_regions(
         target_regions=target_regions,
         max_latency=max_latency,
         include_html=True,
@@ -844,8 +4345,8 @@ def get_ips_by_regions(target_regions: List[str], max_latency: float = 100.0, li
         return []
 
     if limit and len(ip_addresses) > limit:
-        ip_addresses = ip_addresses[:limit]
-        print(f"限制返回前 {limit} 个IP地址")
+        ip_addresses = extractor.extract_ip_addresses(extractor.select_best_ips(filtered_data, limit))
+        print(f"限制返回最佳的 {limit} 个IP地址")
 
     return ip_addresses
 
@@ -1,25 +1,35 @@
 import requests
 import os
-from ip_extractor import IPExtractor
+from ip_extractor import GeoIPRangeDB, HTTPCache, IPExtractor, IPRecord, IPScorer, RegionCache, SourceHealth
 
 # 配置
 CF_API_KEY = os.getenv('CF_API_KEY')
 CF_ZONE_ID = os.getenv('CF_ZONE_ID')
 CF_DOMAIN_NAME = os.getenv('CF_DOMAIN_NAME')
+# 数据源缓存目录：HTTP响应缓存（ETag/Last-Modified）和数据源健康状态（熔断、自适应超时）
+CACHE_DIR = os.getenv('IP_CACHE_DIR', '.ip_cache')
 FILE_PATH = 'sgfd_ips.txt'
+# 可选的离线IP地区数据库（CSV），设置后优先使用，查不到的IP再进行RDAP查询
+GEOIP_CSV = os.getenv('GEOIP_CSV')
 
 # 第一步：从多个数据源获取IP数据（使用IP提取器）
 def get_ip_data():
     print("=== 使用IP提取器获取IP数据 ===")
 
     # 创建IP提取器实例
-    extractor = IPExtractor()
+    extractor = IPExtractor(
+        http_cache=HTTPCache(os.path.join(CACHE_DIR, 'http')),
+        source_health=SourceHealth(os.path.join(CACHE_DIR, 'source_health.json')),
+        # IP归属地很少变化，跨运行缓存地区查询结果，重复运行时几乎不需要RDAP查询
+        region_cache=RegionCache(os.path.join(CACHE_DIR, 'regions.sqlite3')),
+        geoip_db=GeoIPRangeDB.from_csv(GEOIP_CSV) if GEOIP_CSV and os.path.exists(GEOIP_CSV) else None
+    )
 
     # 严格按照参数获取新加坡、台湾、日本的IP（延迟小于200ms）
     print("正在获取新加坡、台湾、日本的IP数据（延迟<200ms）...")
     print("注意: 将严格按照地区和延迟条件过滤，如果没有符合条件的IP将返回空")
 
-    _, ip_addresses = extractor.get_ips_by_regions(
+    region_records, _ = extractor.get_ips_by_regions(
         target_regions=['SG', 'TW', 'JP'],  # 新加坡、台湾、日本
         max_latency=200.0,                  # 延迟小于200ms
         include_html=True,                  # 使用HTML网站数据源
@@ -29,6 +39,11 @@ def get_ip_data():
         max_workers=10                      # 并发查询数
     )
 
+    # 按延迟、速度、数据源数量、新鲜度和地区综合评分，从高到低排列
+    # 写入文件的顺序即为排名，update_dns_records 取文件中的前两个IP
+    scorer = IPScorer(preferred_regions=['SG', 'TW', 'JP'])
+    ip_addresses = extractor.extract_ip_addresses(scorer.rank(region_records or []))
+
     if ip_addresses:
         print(f"✓ 成功获取到 {len(ip_addresses)} 个符合条件的IP")
     else:
@@ -44,7 +59,7 @@ def get_ip_data():
 
     print(f"IP提取器获取到总共 {len(ip_list)} 个IP地址")
 
-    # 显示前几个IP作为示例
+    # 显示排名前几的IP作为示例
     if ip_list:
         print(f"前5个IP示例: {ip_list[:5]}")
 
@@ -52,12 +67,12 @@ def get_ip_data():
 
 
 
-# 将IP地址写入到sgfd_ips.txt文件
+# 将IP数据写入到sgfd_ips.txt文件
 def write_to_file(ip_addresses):
     try:
         with open(FILE_PATH, 'w', encoding='utf-8') as f:
-            for ip in ip_addresses:
-                f.write(ip + '\n')
+            for record in ip_addresses:
+                f.write(f"{record}\n")
         print(f"成功写入 {len(ip_addresses)} 个IP地址到文件 {FILE_PATH}")
     except Exception as e:
         print(f"写入文件时出错: {e}")
@@ -121,7 +136,7 @@ def update_dns_records():
 
     try:
         with open(FILE_PATH, 'r', encoding='utf-8') as f:
-            ips_to_update = [line.split('#')[0].strip() for line in f if line.strip()]
+            ips_to_update = [IPRecord.parse(line).ip for line in f if line.strip()]
     except Exception as e:
         print(f"读取IP文件时出错: {e}")
         return
@@ -138,7 +153,7 @@ def update_dns_records():
     dns_records_url = f'https://api.cloudflare.com/client/v4/zones/{CF_ZONE_ID}/dns_records'
     success_count = 0
 
-    for ip in ips_to_update[:2]:  # 只取前两个IP
+    for ip in ips_to_update[:2]:  # 只取排名前两个IP
         if not ip:  # 跳过空行
             continue
 
@@ -177,7 +192,7 @@ def main():
 
     # 为IP添加地区标识（IP提取器已经进行了地区过滤和去重）
     print("\n步骤2: 格式化IP数据")
-    formatted_ips = [f"{ip}#SGTWJP" for ip in ip_list]  # 添加地区标识
+    formatted_ips = [IPRecord(ip, line='SGTWJP') for ip in ip_list]  # 添加地区标识
     print(f"格式化后有 {len(formatted_ips)} 个IP地址")
 
     # 严格检查：如果没有找到符合条件的IP，则停止执行
@@ -191,7 +206,7 @@ def main():
         print("  4. 考虑调整延迟阈值或目标地区")
         return
 
-    print(f"最终的IP列表: {formatted_ips}")
+    print(f"最终的IP列表: {[str(record) for record in formatted_ips]}")
 
     # 将IP地址写入文件
     print("\n步骤3: 写入IP地址到文件")
@@ -4,7 +4,90 @@ IP提取器测试文件
 用于测试ip_extractor.py模块的功能
 """
 
-from ip_extractor import IPExtractor, get_cloudflare_ips
+import functools
+import gzip
+import ipaddress
+import os
+import random
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from bs4 import BeautifulSoup
+
+from benchmark_html_parsers import SAMPLE_LAYOUTS, build_sample_page
+from ip_extractor import (
+    NUMPY_AVAILABLE, CarrierIndex, CIDRTrie, FixtureBundle, GeoIPRangeDB, HTTPCache, IngestParser, IPBatch, IPExtractor, IPRecord, IPScorer,
+    MergedIPRecord, RegionCache, RegionPrefixIndex,
+    SourceHealth, SourceSnapshot, create_session, get_cloudflare_ips, get_shared_session, normalize_carrier
+)
+
+
+class _TextHandler(BaseHTTPRequestHandler):
+    """本地测试用的HTTP服务，返回固定的IP列表"""
+    protocol_version = "HTTP/1.1"
+    body = b"1.1.1.1\n2.2.2.2\n"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _ETagHandler(_TextHandler):
+    """支持ETag条件请求的本地HTTP服务"""
+    etag = '"v1"'
+    requests_seen = []
+
+    def do_GET(self):
+        self.requests_seen.append(self.headers.get("If-None-Match"))
+        if self.headers.get("If-None-Match") == self.etag:
+            self.send_response(304)
+            self.send_header("ETag", self.etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", self.etag)
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+
+class _StreamHandler(_TextHandler):
+    """分块返回较大IP列表的本地HTTP服务（CRLF换行，含中文标签）"""
+    body = "".join(f"10.0.{i // 256}.{i % 256}#香港\r\n" for i in range(20000)).encode("utf-8")
+
+
+class _SlowFirstHandler(_TextHandler):
+    """第一次请求很慢、之后的请求立即返回的本地HTTP服务"""
+    lock = threading.Lock()
+    count = 0
+
+    def do_GET(self):
+        with self.lock:
+            type(self).count += 1
+            is_first = type(self).count == 1
+        if is_first:
+            time.sleep(1.0)
+        super().do_GET()
+
+
+def as_text(records):
+    """将IP数据格式化为字符串列表，便于断言"""
+    return [str(record) for record in records]
+
+
+def start_local_server(handler=_TextHandler):
+    """启动本地HTTP服务，返回 (server, base_url)"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
 
 
 def test_basic_functionality():
@@ -163,6 +246,1095 @@ def test_error_handling():
         return False
 
 
+def test_concurrent_fetch():
+    """测试并发获取的顺序合并与总体截止时间"""
+    print("\n=== 测试并发获取 ===")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_a = os.path.join(tmp_dir, "a.txt")
+        file_b = os.path.join(tmp_dir, "b.txt")
+        with open(file_a, 'w', encoding='utf-8') as f:
+            f.write("1.1.1.1\n2.2.2.2\n")
+        with open(file_b, 'w', encoding='utf-8') as f:
+            f.write("3.3.3.3\n")
+
+        extractor = IPExtractor(max_workers=4, overall_timeout=0.5)
+
+        # 模拟一个很慢的文本数据源
+        def slow_text_url(url):
+            time.sleep(2)
+            return ["9.9.9.9"]
+        extractor.extract_from_text_url = slow_text_url
+
+        start_time = time.monotonic()
+        all_data = extractor.get_all_ips(
+            text_urls=["https://slow.example.com/ips.txt"],
+            local_files=[file_a, file_b],
+            include_all_sources=False
+        )
+        elapsed = time.monotonic() - start_time
+
+    print(f"✓ 获取结果: {all_data}，耗时 {elapsed:.2f}s")
+    assert as_text(all_data) == ["1.1.1.1", "2.2.2.2", "3.3.3.3"]
+    assert elapsed < 1.5
+
+    # 截止时仍在进行的请求随之超时，工作线程不会继续运行
+    server, base_url = start_local_server(_SlowFirstHandler)
+    try:
+        _SlowFirstHandler.count = 0
+        threads_before = set(threading.enumerate())
+        extractor = IPExtractor(overall_timeout=0.3, session=create_session(max_retries=0))
+        assert extractor.get_all_ips(text_urls=[f"{base_url}/ips.txt"], include_all_sources=False) == []
+        time.sleep(0.3)
+        assert not [thread for thread in set(threading.enumerate()) - threads_before
+                    if thread.name.startswith('ip-source')]
+    finally:
+        server.shutdown()
+    assert IPExtractor(timeout=10, max_retries=2).overall_timeout == 30
+    print("✓ 截止后没有残留的获取线程")
+    return True
+
+
+def test_shared_session():
+    """测试共享连接池会话"""
+    print("\n=== 测试共享连接池会话 ===")
+
+    server, base_url = start_local_server()
+    try:
+        extractor_a = IPExtractor()
+        extractor_b = IPExtractor()
+        assert extractor_a.session is extractor_b.session
+        assert extractor_a.session is get_shared_session()
+
+        url = f"{base_url}/ips.txt"
+        assert as_text(extractor_a.extract_from_text_url(url)) == ["1.1.1.1", "2.2.2.2"]
+        assert as_text(extractor_b.extract_from_text_url(url)) == ["1.1.1.1", "2.2.2.2"]
+
+        timing = extractor_b.fetch_timings[url]
+        print(f"✓ 第二次请求耗时统计: {timing}")
+        assert timing['reused_connection']
+        assert timing['bytes'] == len(_TextHandler.body)
+    finally:
+        server.shutdown()
+    return True
+
+
+def test_http_cache():
+    """测试HTTP缓存与条件请求"""
+    print("\n=== 测试HTTP缓存 ===")
+
+    server, base_url = start_local_server(_ETagHandler)
+    url = f"{base_url}/bestcfv4.txt"
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # 有效期为0，每次都会发送条件请求
+            cache = HTTPCache(tmp_dir, default_ttl=0)
+            health = SourceHealth(min_samples=1)
+            extractor = IPExtractor(http_cache=cache, source_health=health)
+            fetch = functools.partial(extractor.extract_from_text_url, url)
+            _ETagHandler.requests_seen.clear()
+
+            assert as_text(extractor._fetch_with_health(url, fetch)) == ["1.1.1.1", "2.2.2.2"]
+            p95 = health.percentile(url, 95)
+            assert p95 is not None
+            assert as_text(extractor._fetch_with_health(url, fetch)) == ["1.1.1.1", "2.2.2.2"]
+            print(f"✓ 条件请求头: {_ETagHandler.requests_seen}")
+            assert _ETagHandler.requests_seen == [None, _ETagHandler.etag]
+            assert extractor.fetch_timings[url]['bytes'] == 0
+
+            # 有效期内不发送请求
+            cache.ttls[url] = 3600
+            assert as_text(extractor._fetch_with_health(url, fetch)) == ["1.1.1.1", "2.2.2.2"]
+            assert len(_ETagHandler.requests_seen) == 2
+
+            # 304和未过期的缓存命中不计入耗时样本
+            assert health.percentile(url, 95) == p95
+            assert len(health._sources[url]['latencies']) == 1
+
+            # 超过大小上限时淘汰旧条目
+            cache.max_bytes = 1
+            cache.put("https://example.com/other.txt", extractor.session.get(url), ["3.3.3.3"])
+            assert len(os.listdir(tmp_dir)) == 0
+    finally:
+        server.shutdown()
+    return True
+
+
+def test_source_snapshot():
+    """测试进程内数据源快照"""
+    print("\n=== 测试数据源快照 ===")
+
+    snapshot = SourceSnapshot(ttl=60)
+    calls = []
+
+    def slow_fetch():
+        calls.append(1)
+        time.sleep(0.2)
+        return ["1.1.1.1"]
+
+    # 多个线程同时请求同一个数据源，只获取一次
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(snapshot.get_or_fetch("src", slow_fetch)))
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [["1.1.1.1"]] * 5
+    assert len(calls) == 1
+
+    snapshot.invalidate("src")
+    snapshot.get_or_fetch("src", slow_fetch)
+    assert len(calls) == 2
+
+    # 多个提取器实例共享快照
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, "ips.txt")
+        with open(file_path, 'w', encoding='utf-8') as f:
+            f.write("2.2.2.2\n")
+        first = IPExtractor(snapshot=snapshot).get_all_ips(local_files=[file_path], include_all_sources=False)
+        with open(file_path, 'w', encoding='utf-8') as f:
+            f.write("3.3.3.3\n")
+        second = IPExtractor(snapshot=snapshot).get_all_ips(local_files=[file_path], include_all_sources=False)
+        assert as_text(first) == as_text(second) == ["2.2.2.2"]
+
+        snapshot.invalidate()
+        third = IPExtractor(snapshot=snapshot).get_all_ips(local_files=[file_path], include_all_sources=False)
+        assert as_text(third) == ["3.3.3.3"]
+
+    print("✓ 快照复用与失效正常")
+    return True
+
+
+def test_streaming_lines():
+    """测试文本URL和本地文件的流式解析"""
+    print("\n=== 测试流式解析 ===")
+
+    server, base_url = start_local_server(_StreamHandler)
+    url = f"{base_url}/large.txt"
+    try:
+        extractor = IPExtractor()
+        stream = extractor.iter_text_url(url)
+        first = next(stream)
+        assert (first.ip, first.line, first.source) == ("10.0.0.0", "香港", url)
+        remaining = as_text(stream)
+        assert len(remaining) == 19999
+        assert remaining[-1] == "10.0.78.31#香港"
+        assert extractor.fetch_timings[url]['bytes'] == len(_StreamHandler.body)
+
+        # 很小的分块大小，验证跨块的行拼接
+        response = extractor._http_request('GET', url, stream=True)
+        lines = list(extractor._iter_response_lines(response, url, chunk_size=7))
+        assert lines == ["10.0.0.0#香港"] + remaining
+    finally:
+        server.shutdown()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, "ips.txt")
+        with open(file_path, 'w', encoding='utf-8') as f:
+            f.write("\n 1.1.1.1 \n\n2.2.2.2")
+        assert as_text(IPExtractor.iter_local_file(file_path)) == ["1.1.1.1", "2.2.2.2"]
+
+    print("✓ 流式解析结果正确")
+    return True
+
+
+def test_source_health():
+    """测试数据源熔断与自适应超时"""
+    print("\n=== 测试数据源熔断 ===")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "source_health.json")
+        health = SourceHealth(path, failure_threshold=2, cooldown=3600)
+        extractor = IPExtractor(source_health=health)
+
+        calls = []
+
+        def dead_source(url):
+            calls.append(url)
+            return []
+        extractor.extract_from_text_url = dead_source
+
+        dead_url = "https://dead.example.com/ips.txt"
+        for _ in range(3):
+            extractor.get_all_ips(text_urls=[dead_url], include_all_sources=False)
+        # 连续失败2次后熔断，第3次不再请求
+        assert len(calls) == 2
+        assert health.get_state(dead_url) == SourceHealth.OPEN
+
+        # 熔断状态跨运行保留；冷却结束后半开探测，成功后恢复
+        reloaded = SourceHealth(path, cooldown=0)
+        assert reloaded.get_state(dead_url) == SourceHealth.OPEN
+        assert reloaded.allow_request(dead_url)
+        assert reloaded.get_state(dead_url) == SourceHealth.HALF_OPEN
+        # 探测结果记录之前，半开状态不允许其他请求
+        assert not reloaded.allow_request(dead_url)
+        reloaded.record_success(dead_url, 0.5)
+        assert reloaded.get_state(dead_url) == SourceHealth.CLOSED
+        assert reloaded.allow_request(dead_url)
+
+        # 探测失败时重新熔断
+        reloaded.cooldown = 3600
+        for _ in range(3):
+            reloaded.record_failure(dead_url)
+        reloaded.cooldown = 0
+        assert reloaded.allow_request(dead_url)
+        assert not reloaded.allow_request(dead_url)
+        reloaded.record_failure(dead_url)
+        assert reloaded.get_state(dead_url) == SourceHealth.OPEN
+        assert reloaded.allow_request(dead_url)
+
+    # 自适应超时由数据源自身的p95耗时决定
+    health = SourceHealth(min_samples=3, min_timeout=1.0, timeout_multiplier=3.0)
+    assert health.get_timeout("fast", 10) == 10
+    for latency in (0.4, 0.5, 0.6):
+        health.record_success("fast", latency)
+    assert abs(health.get_timeout("fast", 10) - 1.8) < 1e-9
+    for latency in (5.0, 6.0, 7.0):
+        health.record_success("slow", latency)
+    assert health.get_timeout("slow", 10) == 10
+
+    # 流式读取时调用方处理数据的时间不计入网络耗时
+    server, base_url = start_local_server()
+    url = f"{base_url}/ips.txt"
+    try:
+        health = SourceHealth(min_samples=1)
+        extractor = IPExtractor(source_health=health)
+
+        def stalled_fetch():
+            records = []
+            for record in extractor.iter_text_url(url):
+                time.sleep(0.3)
+                records.append(record)
+            return records
+
+        assert len(extractor._fetch_with_health(url, stalled_fetch)) == 2
+        latency = health._sources[url]['latencies'][0]
+        print(f"✓ 调用方停顿0.6s，记录的网络耗时 {latency:.3f}s")
+        assert latency < 0.3
+        assert extractor.metrics.get(url)['transfer_ms'] < 300
+    finally:
+        server.shutdown()
+
+    print("✓ 熔断状态与自适应超时正确")
+    return True
+
+
+def test_hedged_requests():
+    """测试对冲请求"""
+    print("\n=== 测试对冲请求 ===")
+
+    server, base_url = start_local_server(_SlowFirstHandler)
+    url = f"{base_url}/page.html"
+    try:
+        health = SourceHealth()
+        for latency in (0.05, 0.05, 0.06):
+            health.record_success(url, latency)
+
+        # 不允许额外负载时不发送对冲请求
+        _SlowFirstHandler.count = 0
+        extractor = IPExtractor(source_health=health, hedge_requests=True, hedge_max_ratio=0)
+        start_time = time.monotonic()
+        extractor._http_request('GET', url)
+        assert time.monotonic() - start_time >= 0.9
+        assert extractor.hedge_stats['hedged'] == 0
+
+        # 对冲预算向下取整，第一个请求不会对冲
+        extractor = IPExtractor(source_health=health, hedge_requests=True, hedge_max_ratio=0.5)
+        assert not extractor._try_acquire_hedge()
+        extractor.hedge_stats['requests'] = 1
+        assert not extractor._try_acquire_hedge()
+        extractor.hedge_stats['requests'] = 2
+        assert extractor._try_acquire_hedge()
+        assert not extractor._try_acquire_hedge()
+
+        _SlowFirstHandler.count = 0
+        extractor = IPExtractor(source_health=health, hedge_requests=True, hedge_max_ratio=1.0)
+        start_time = time.monotonic()
+        response = extractor._http_request('GET', url)
+        elapsed = time.monotonic() - start_time
+        print(f"✓ 对冲请求耗时 {elapsed:.2f}s，统计: {extractor.hedge_stats}")
+        assert response.content == _SlowFirstHandler.body
+        assert elapsed < 0.8
+        assert extractor.hedge_stats['hedge_wins'] == 1
+    finally:
+        server.shutdown()
+    return True
+
+
+def test_metrics_registry():
+    """测试数据源指标统计与导出"""
+    print("\n=== 测试数据源指标 ===")
+
+    server, base_url = start_local_server()
+    url = f"{base_url}/ips.txt"
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, "ips.txt")
+            with open(file_path, 'w', encoding='utf-8') as f:
+                f.write("3.3.3.3#电信-20ms\n4.4.4.4#电信-300ms\n")
+
+            extractor = IPExtractor()
+            all_data = extractor.get_all_ips(text_urls=[url], local_files=[file_path], include_all_sources=False)
+            unique_data = extractor.remove_duplicates(all_data)
+            extractor.filter_by_latency(unique_data, max_latency=100.0, keep_no_latency=False)
+    finally:
+        server.shutdown()
+
+    url_metrics = extractor.metrics.get(url)
+    file_metrics = extractor.metrics.get(file_path)
+    print(f"✓ 文本URL指标: {url_metrics}")
+    for field in ('dns_ms', 'connect_ms', 'ttfb_ms', 'transfer_ms', 'parse_ms', 'fetch_ms'):
+        assert url_metrics[field] >= 0
+    assert url_metrics['bytes'] == len(_TextHandler.body)
+    assert url_metrics['records'] == 2
+    assert url_metrics['filters'] == {'dedup': 2, 'latency': 0}
+    assert file_metrics['records'] == 2
+    assert file_metrics['filters'] == {'dedup': 2, 'latency': 1}
+
+    prometheus_text = extractor.metrics.to_prometheus()
+    assert f'ip_extractor_source_records{{source="{url}"}} 2' in prometheus_text
+    assert f'ip_extractor_source_filter_records{{source="{file_path}",stage="latency"}} 1' in prometheus_text
+    assert '"records": 2' in extractor.metrics.to_json()
+    return True
+
+
+def test_fixture_record_replay():
+    """测试录制/回放模式"""
+    print("\n=== 测试录制/回放 ===")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        bundle_path = os.path.join(tmp_dir, "sources.json.gz")
+
+        server, base_url = start_local_server()
+        url = f"{base_url}/ips.txt"
+        try:
+            with FixtureBundle(bundle_path, mode=FixtureBundle.RECORD) as bundle:
+                recorded = IPExtractor(fixtures=bundle).get_all_ips(text_urls=[url], include_all_sources=False)
+                bundle.record_rdap("1.1.1.1", {"network": {"country": "au"}}, 0.01)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        # 服务已关闭，回放不访问网络
+        bundle = FixtureBundle(bundle_path, simulated_latency=0.05)
+        extractor = IPExtractor(fixtures=bundle)
+        start_time = time.monotonic()
+        replayed = extractor.get_all_ips(text_urls=[url], include_all_sources=False)
+        assert time.monotonic() - start_time >= 0.05
+        assert as_text(replayed) == as_text(recorded) == ["1.1.1.1", "2.2.2.2"]
+        assert extractor.get_ip_region("1.1.1.1") == "AU"
+        assert extractor.get_ip_region("2.2.2.2") is None
+
+        # 未录制的请求按请求失败处理
+        assert extractor.extract_from_text_url(f"{base_url}/missing.txt") == []
+
+    print("✓ 回放结果与录制一致")
+    return True
+
+
+def test_html_parser_engines():
+    """测试lxml与BeautifulSoup解析结果一致"""
+    print("\n=== 测试HTML解析引擎 ===")
+
+    extractor = IPExtractor()
+    for url in SAMPLE_LAYOUTS:
+        content = build_sample_page(url, rows=50)
+        bs4_result = extractor.parse_html_site(url, content, html_parser='html.parser')
+        lxml_result = extractor.parse_html_site(url, content, html_parser='lxml')
+        print(f"✓ {url}: {len(lxml_result)} 条，示例: {lxml_result[0]}")
+        assert bs4_result == lxml_result
+        assert bs4_result
+
+    assert as_text(extractor.parse_html_site("https://cf.090227.xyz/", build_sample_page("https://cf.090227.xyz/", 1))) == [
+        "104.16.0.0#电信-50.00ms"
+    ]
+    # 345673只保留 line-cm/line-ct/line-cu 行
+    assert len(extractor.parse_html_site("https://345673.xyz/", build_sample_page("https://345673.xyz/", 8))) == 6
+    return True
+
+
+def test_table_only_parsing():
+    """测试只解析表格行的模式与完整DOM解析结果一致"""
+    print("\n=== 测试表格行解析 ===")
+
+    extractor = IPExtractor()
+    for url in SAMPLE_LAYOUTS:
+        content = build_sample_page(url, rows=50)
+        expected = extractor.parse_html_site(url, content, html_parser='html.parser', table_only=False)
+        for html_parser in ('html.parser', 'lxml'):
+            assert extractor.parse_html_site(url, content, html_parser=html_parser, table_only=True) == expected
+        print(f"✓ {url}: {len(expected)} 条")
+
+    # 单元格中的脚本和注释不计入文本，嵌套表格的行和单元格与BeautifulSoup一致
+    page = ("<html><head><script>var row = '<tr><td>1.1.1.1</td></tr>';</script></head><body>"
+            "<table><tr class='line-cm'><td>移动</td><td>104.19.0.1<script>x()</script><!-- c --></td>"
+            "<td>0%</td><td>30ms<table><tr><td>内嵌</td></tr></table></td></tr>"
+            "<tr class='line-other'><td>其他</td><td>104.19.0.2</td><td>0%</td><td>40ms</td></tr>"
+            "</table></body></html>").encode('utf-8')
+    url = "https://345673.xyz/"
+    results = [extractor.parse_html_site(url, page, html_parser=html_parser, table_only=table_only)
+               for html_parser in ('html.parser', 'lxml') for table_only in (False, True)]
+    print(f"✓ 嵌套表格: {results[-1]}")
+    assert as_text(results[0]) == ["104.19.0.1#移动-30.00ms"]
+    assert all(result == results[0] for result in results)
+    return True
+
+
+def test_table_site_specs():
+    """测试声明式HTML网站表格规则"""
+    print("\n=== 测试表格提取规则 ===")
+
+    extractor = IPExtractor()
+    assert set(extractor.site_specs) == {
+        "cf.090227.xyz", "stock.hostmonit.com", "ip.164746.xyz", "monitor.gacjie.cn", "345673.xyz"
+    }
+    assert extractor.get_site_spec("https://stock.hostmonit.com/CloudFlareYes").row_class.pattern == "el-table__row"
+    # 按主机名匹配，路径或查询参数中包含主机名的URL不会误匹配
+    assert extractor.get_site_spec("https://example.com/?from=cf.090227.xyz") is None
+    assert extractor.get_site_extractor("https://example.com/") is None
+
+    # 新网站只需注册规则
+    spec = extractor.register_html_site({
+        'host': 'cf.example.com', 'ip_column': 2, 'latency_column': 0, 'line_column': 1, 'row_class': r'^ok$'
+    })
+    assert spec.min_columns == 3
+    page = ("<table><tr class='ok'><td>88ms</td><td>CT</td><td>1.0.0.1</td></tr>"
+            "<tr class='ok bad'><td>10ms</td><td>CU</td><td>1.0.0.2</td></tr>"
+            "<tr class='ok'><td>--</td><td>CM</td><td>1.0.0.3</td></tr>"
+            "<tr class='ok'><td>20ms</td><td>CM</td></tr></table>").encode('utf-8')
+    for html_parser in ('html.parser', 'lxml'):
+        result = extractor.parse_html_site("https://cf.example.com/list", page, html_parser=html_parser)
+        print(f"✓ {html_parser}: {result}")
+        assert as_text(result) == ["1.0.0.1#CT-88.00ms"]
+
+    soup_extractor = extractor.get_site_extractor("https://ip.164746.xyz/")
+    content = build_sample_page("https://ip.164746.xyz/", rows=3)
+    assert as_text(soup_extractor(BeautifulSoup(content, 'html.parser'))) == [
+        "104.17.0.0-70.50ms", "104.17.0.1-71.50ms", "104.17.0.2-72.50ms"
+    ]
+    return True
+
+
+def test_parse_process_pool():
+    """测试大页面在进程池中解析，小页面直接解析"""
+    print("\n=== 测试进程池解析 ===")
+
+    pages = {url: build_sample_page(url, rows=200) for url in SAMPLE_LAYOUTS}
+    inline = IPExtractor(parse_processes=0)
+    expected = {url: inline.parse_html_site(url, content) for url, content in pages.items()}
+    assert inline.parse_stats == {'inline': 5, 'offloaded': 0}
+
+    small_page = min(len(content) for content in pages.values())
+    extractor = IPExtractor(parse_processes=2, parse_inline_bytes=small_page + 1)
+    for html_parser in ('html.parser', 'lxml'):
+        for url, content in pages.items():
+            assert extractor.parse_html_site(url, content, html_parser=html_parser) == expected[url]
+    print(f"✓ 解析统计: {extractor.parse_stats}")
+    assert extractor.parse_stats == {'inline': 2, 'offloaded': 8}
+    return True
+
+
+def test_ip_record():
+    """测试IP数据记录的解析、格式化和处理流程"""
+    print("\n=== 测试IP数据记录 ===")
+
+    cases = {
+        "1.1.1.1#电信-25ms": ("1.1.1.1", "电信", 25.0, None, "1.1.1.1#电信-25.00ms"),
+        "4.4.4.4-30.5ms": ("4.4.4.4", None, 30.5, None, "4.4.4.4-30.50ms"),
+        "5.5.5.5#10mb/s": ("5.5.5.5", None, None, 10.0, "5.5.5.5#10mb/s"),
+        "6.6.6.6#香港": ("6.6.6.6", "香港", None, None, "6.6.6.6#香港"),
+        "2606:4700::1#HK-88ms": ("2606:4700::1", "HK", 88.0, None, "2606:4700::1#HK-88.00ms"),
+        "7.7.7.7#测试-invalid": ("7.7.7.7", "测试-invalid", None, None, "7.7.7.7#测试-invalid"),
+        " 8.8.8.8 ": ("8.8.8.8", None, None, None, "8.8.8.8"),
+    }
+    for text, (ip, line, latency, speed, formatted) in cases.items():
+        record = IPRecord.parse(text, source="test")
+        assert (record.ip, record.line, record.latency_ms, record.speed_mbps) == (ip, line, latency, speed), text
+        assert str(record) == formatted
+        assert IPRecord.parse(formatted) == record
+        assert IPRecord.from_dict(record.to_dict()).source == "test"
+    print("✓ 字符串格式解析与输出正确")
+
+    # 相等性不比较来源和获取时间，去重保留首次出现的记录
+    extractor = IPExtractor()
+    records = [
+        IPRecord("1.1.1.1", "电信", 25.0, source="a"),
+        IPRecord("3.3.3.3", "移动", 120.0, source="a"),
+        IPRecord("1.1.1.1", "电信", 25.0, source="b"),
+        IPRecord("5.5.5.5", speed_mbps=10.0, source="b"),
+        IPRecord("6.6.6.6", source="b"),
+    ]
+    unique = extractor.remove_duplicates(records)
+    assert [record.source for record in unique] == ["a", "a", "b", "b"]
+    assert as_text(extractor.filter_by_latency(unique, 50.0)) == ["1.1.1.1#电信-25.00ms", "5.5.5.5#10mb/s", "6.6.6.6"]
+    assert extractor.filter_by_latency(unique, 50.0, keep_no_latency=False)[-1].ip == "5.5.5.5"
+    assert extractor.extract_ip_addresses(unique) == ["1.1.1.1", "3.3.3.3", "5.5.5.5", "6.6.6.6"]
+    # 旧版字符串输入仍然可用
+    assert extractor.extract_ip_addresses(["9.9.9.9#电信-5ms"]) == ["9.9.9.9"]
+
+    # 旧版缓存中的字符串数据可以还原为记录
+    restored = IPExtractor._cached_records("http://x/ips.txt", {'data': ["1.1.1.1#电信-25ms"]})
+    assert restored[0].source == "http://x/ips.txt" and restored[0].latency_ms == 25.0
+    print("✓ 去重、过滤与缓存兼容正确")
+    return True
+
+
+def test_ip_batch():
+    """测试列式IP批次"""
+    print("\n=== 测试列式IP批次 ===")
+    if not NUMPY_AVAILABLE:
+        print("⚠ numpy 不可用，跳过")
+        return True
+
+    records = [
+        IPRecord("1.1.1.1", "电信", 25.0, source="a"),
+        IPRecord("2.2.2.2", speed_mbps=10.0, source="b"),
+        IPRecord("2606:4700::1", "HK", 88.0, source="a"),
+        IPRecord("1.1.1.1:443", source="a"),
+        IPRecord("1.1.1.1", "联通", 5.0, source="b"),
+    ]
+    batch = IPBatch.from_records(records)
+    assert len(batch) == 4
+    assert batch.nbytes == 4 * 28
+    assert as_text(batch.to_records()) == ["1.1.1.1#电信-25.00ms", "2.2.2.2#10mb/s", "2606:4700::1#HK-88.00ms",
+                                           "1.1.1.1#联通-5.00ms"]
+    assert batch[2].source == "a" and batch[1].source == "b"
+
+    # 去重保留首次出现的行；排序稳定且缺失值在最后
+    assert as_text(batch.dedup().to_records())[0] == "1.1.1.1#电信-25.00ms"
+    assert batch.dedup().ips() == ["1.1.1.1", "2.2.2.2", "2606:4700::1"]
+    assert batch.sort().ips() == ["1.1.1.1", "1.1.1.1", "2606:4700::1", "2.2.2.2"]
+    assert batch.sort('speed_mbps', descending=True).ips()[0] == "2.2.2.2"
+    assert batch.sort(['address', 'latency_ms']).ips() == ["1.1.1.1", "1.1.1.1", "2.2.2.2", "2606:4700::1"]
+    assert batch.sort(['address', 'latency_ms'])[0].latency_ms == 5.0
+    assert batch.filter(batch.latency_ms < 50).ips() == ["1.1.1.1", "1.1.1.1"]
+    assert batch[1:3].ips() == ["2.2.2.2", "2606:4700::1"]
+
+    # 展开网段
+    ranges = IPBatch.from_cidrs(["104.16.0.0/30", "# 注释", "2606:4700::/126", "1.0.0.1"], source="ranges")
+    assert ranges.ips() == ["104.16.0.0", "104.16.0.1", "104.16.0.2", "104.16.0.3",
+                            "2606:4700::", "2606:4700::1", "2606:4700::2", "2606:4700::3", "1.0.0.1"]
+    try:
+        IPBatch.from_cidrs(["104.16.0.0/13"], max_addresses=1000)
+        assert False, "应当超过展开上限"
+    except ValueError:
+        pass
+
+    merged = IPBatch.concat([batch, ranges[:2]])
+    assert len(merged) == 6 and merged[5].source == "ranges" and merged[0].line == "电信"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, "ip.txt")
+        with open(file_path, 'w', encoding='utf-8') as f:
+            f.write("173.245.48.0/20\n103.21.244.0/22\n")
+        large = IPBatch.from_file(file_path)
+    assert len(large) == 4096 + 1024 and len(large.dedup()) == len(large)
+    print(f"✓ 展开 {len(large)} 个地址，占用 {large.nbytes} 字节")
+    return True
+
+
+def test_best_ip_selection():
+    """测试向量化过滤与最佳IP选择"""
+    print("\n=== 测试最佳IP选择 ===")
+
+    records = [
+        IPRecord("1.1.1.1", "电信", 80.0),
+        IPRecord("2.2.2.2", speed_mbps=5.0),
+        IPRecord("3.3.3.3", "联通", 30.0),
+        IPRecord("3.3.3.3", "移动", 20.0),
+        IPRecord("4.4.4.4", speed_mbps=9.0),
+        IPRecord("5.5.5.5"),
+        IPRecord("6.6.6.6", "电信", 30.0),
+    ]
+    expected = ["3.3.3.3", "6.6.6.6", "1.1.1.1", "4.4.4.4", "2.2.2.2", "5.5.5.5"]
+    extractor = IPExtractor()
+    best = extractor.select_best_ips(records, 3)
+    assert [record.ip for record in best] == expected[:3]
+    assert best[0].line == "移动"
+    assert [record.ip for record in extractor.select_best_ips(records, 10)] == expected
+
+    # 延迟按原始精度比较
+    close = [IPRecord("7.7.7.7", latency_ms=30.000002), IPRecord("8.8.8.8", latency_ms=30.000001)]
+    assert [record.ip for record in extractor.select_best_ips(close, 1)] == ["8.8.8.8"]
+    print(f"✓ 最佳IP: {[str(record) for record in best]}")
+
+    if not NUMPY_AVAILABLE:
+        return True
+
+    batch = IPBatch.from_records(records)
+    assert batch.filter(batch.latency_mask(50.0)).ips() == ["2.2.2.2", "3.3.3.3", "3.3.3.3", "4.4.4.4",
+                                                            "5.5.5.5", "6.6.6.6"]
+    assert batch.filter(batch.latency_mask(50.0, keep_no_latency=False)).ips()[-1] == "6.6.6.6"
+    assert batch.filter(batch.speed_mask(6.0)).ips() == ["4.4.4.4"]
+
+    # top_k 与完整排序结果一致（含大量并列值）
+    rng = random.Random(7)
+    large = IPBatch.from_records(
+        IPRecord(f"10.{i // 65536}.{i // 256 % 256}.{i % 256}",
+                 latency_ms=rng.choice([None, float(rng.randint(10, 30))]),
+                 speed_mbps=float(rng.randint(1, 5)))
+        for i in range(20000))
+    for by, descending in ((('latency_ms', 'speed_mbps'), (False, True)), ('speed_mbps', True), ('address', True)):
+        for k in (1, 10, 500, 20000):
+            assert large.top_k(k, by, descending).ips() == large.sort(by, descending)[:k].ips()
+    print("✓ top_k 与完整排序一致")
+    return True
+
+
+def test_merge_by_ip():
+    """测试按IP地址合并去重"""
+    print("\n=== 测试按IP合并去重 ===")
+
+    records = [
+        IPRecord("1.1.1.1", "电信", 80.0, source="html", observed_at=100.0),
+        IPRecord("2.2.2.2", "CM", speed_mbps=5.0, source="api", observed_at=100.0),
+        IPRecord("1.1.1.1", "移动", 20.0, source="text", observed_at=300.0),
+        IPRecord("2.2.2.2", "CT", speed_mbps=9.0, source="api", observed_at=100.0),
+        IPRecord("1.1.1.1", "电信", 50.0, source="html", observed_at=200.0),
+        IPRecord("3.3.3.3", source="local", observed_at=100.0),
+    ]
+    extractor = IPExtractor()
+    merged = extractor.remove_duplicates(records)
+    assert [record.ip for record in merged] == ["1.1.1.1", "2.2.2.2", "3.3.3.3"]
+    assert all(isinstance(record, MergedIPRecord) for record in merged)
+
+    first = merged[0]
+    assert (first.latency_ms, first.latency_median_ms, first.line) == (20.0, 50.0, "移动")
+    assert first.carriers == ("电信", "移动") and first.sources == ("html", "text")
+    assert (first.observations, first.observed_at, first.source) == (3, 300.0, "html")
+    assert str(first) == "1.1.1.1#移动-20.00ms"
+    second = merged[1]
+    assert (second.speed_mbps, second.latency_ms, second.line, second.carriers) == (9.0, None, "CM", ("CM", "CT"))
+    assert merged[2].carriers == () and merged[2].line is None
+
+    # 下游阶段使用最佳观测值
+    assert [record.ip for record in extractor.filter_by_latency(merged, 30.0, keep_no_latency=False)] == [
+        "1.1.1.1", "2.2.2.2"]
+    # 不合并时只去除完全相同的数据
+    assert len(extractor.remove_duplicates(records + records[:1], merge_by_ip=False)) == 6
+    print(f"✓ 合并结果: {merged[0]!r}")
+    return True
+
+
+def test_ip_scorer():
+    """测试多指标评分和top-k选择"""
+    print("\n=== 测试IP评分 ===")
+
+    now = 10000.0
+    records = [
+        IPRecord("1.1.1.1", "电信", 100.0, source="html", observed_at=now),
+        IPRecord("2.2.2.2", "CM", 20.0, speed_mbps=50.0, source="api", observed_at=now),
+        IPRecord("3.3.3.3", "CT", 20.0, source="text", observed_at=now - 10 ** 6),
+        IPRecord("1.1.1.1", "移动", 60.0, source="html", observed_at=now),
+        IPRecord("4.4.4.4", speed_mbps=25.0, source="local", observed_at=now, region="SG"),
+    ]
+    scorer = IPScorer(now=now)
+    components = scorer.components(records[1])
+    assert components == {"latency": 0.9, "speed": 1.0, "sources": 1 / 3, "freshness": 1.0}
+    assert scorer.score(IPRecord("5.5.5.5", latency_ms=500.0, observed_at=now - 10 ** 7)) < 0.1
+
+    # 同一IP只保留得分最高的一条，结果按得分从高到低
+    ranked = scorer.rank(records)
+    assert [record.ip for record in ranked][:2] == ["2.2.2.2", "1.1.1.1"]
+    assert len(ranked) == 4 and ranked[1].latency_ms == 60.0
+    assert scorer.top_k(records, 2) == ranked[:2]
+    scores = [scorer.score(record) for record in ranked]
+    assert scores == sorted(scores, reverse=True)
+
+    # 多个数据源报告的IP得分更高
+    merged = IPExtractor().remove_duplicates([records[2], IPRecord("3.3.3.3", "CT", 20.0, source="api",
+                                                                   observed_at=now - 10 ** 6)])
+    assert scorer.score(merged[0]) > scorer.score(records[2])
+
+    # 优先地区和自定义权重
+    regional = IPScorer(weights={"latency": 0, "speed": 0, "sources": 0, "freshness": 0},
+                        preferred_regions=["sg"], now=now)
+    assert regional.top_k(records, 1)[0].ip == "4.4.4.4"
+    # 得分相同时保持输入顺序，兼容旧版字符串格式
+    assert [record.ip for record in IPScorer(now=now).top_k(["9.9.9.9", "8.8.8.8"], 2)] == ["9.9.9.9", "8.8.8.8"]
+    try:
+        IPScorer(weights={"unknown": 1})
+        assert False, "未知指标应报错"
+    except ValueError:
+        pass
+    print(f"✓ 排名: {as_text(ranked)}")
+    return True
+
+
+def test_carrier_index():
+    """测试按运营商分区的索引"""
+    print("\n=== 测试运营商索引 ===")
+
+    assert [normalize_carrier(line) for line in ["电信", "cm", "中国联通", " CUCC ", "SGTWJP", None]] == [
+        "CT", "CM", "CU", "CU", None, None]
+    records = [
+        IPRecord("1.1.1.1", "电信", 80.0),
+        IPRecord("2.2.2.2", "CT", 30.0),
+        IPRecord("3.3.3.3", "移动", 50.0),
+        IPRecord("1.1.1.1", "CT", 40.0),
+        IPRecord("4.4.4.4", "电信"),
+        IPRecord("5.5.5.5", "CM", 50.0, speed_mbps=10.0),
+        IPRecord("6.6.6.6", "SG", 10.0),
+        "7.7.7.7#联通-60.00ms",
+    ]
+    index = IPExtractor().build_carrier_index(records)
+    assert index.carriers() == ["CM", "CT", "CU"] and len(index) == 6
+    # 同一运营商每个IP只保留延迟最低的一条，没有延迟的排在最后
+    assert as_text(index.best("电信")) == ["2.2.2.2#CT-30.00ms", "1.1.1.1#CT-40.00ms", "4.4.4.4#电信"]
+    # 延迟相同时速度高的优先
+    assert [record.ip for record in index.best("CM", 2)] == ["5.5.5.5", "3.3.3.3"]
+    # 延迟上限不含本身，与 filter_by_latency 一致
+    assert [record.ip for record in index.within("ct", 40.0)] == ["2.2.2.2"]
+    assert [record.ip for record in index.within("ct", 80.5)] == ["2.2.2.2", "1.1.1.1"]
+    assert [record.ip for record in index.within("CT", 100.0, k=1)] == ["2.2.2.2"]
+    assert {carrier: len(best) for carrier, best in index.best_per_carrier(1).items()} == {"CM": 1, "CT": 1, "CU": 1}
+    assert index.count("联通") == 1
+
+    # 合并后的数据按所有线路建立索引
+    merged = IPExtractor().remove_duplicates([IPRecord("8.8.8.8", "CM", 20.0), IPRecord("8.8.8.8", "CU", 90.0)])
+    merged_index = CarrierIndex(merged)
+    assert merged_index.count("CM") == 1 and merged_index.count("CU") == 1
+    # 无法识别的运营商返回空结果
+    assert index.best("SG") == [] and index.within("SG", 100.0) == [] and index.count("SG") == 0
+    best = {carrier: as_text(records) for carrier, records in index.best_per_carrier(1).items()}
+    print(f"✓ 各运营商最佳IP: {best}")
+    return True
+
+
+def test_ingest_parser():
+    """测试数据源文本行的严格解析"""
+    print("\n=== 测试严格解析 ===")
+
+    parser = IngestParser()
+    lines = {
+        "1.2.3.4": ("1.2.3.4", None, None),
+        "1.2.3.4:443#SG": ("1.2.3.4", 443, "SG"),
+        "104.17.165.60#移动-76.00ms": ("104.17.165.60", None, "移动"),
+        "[2606:4700:0:0::1]:8443#US": ("2606:4700::1", 8443, "US"),
+        "2606:4700::6810:84E5#HK": ("2606:4700::6810:84e5", None, "HK"),
+    }
+    for line, expected in lines.items():
+        record = parser.parse(line, source="test")
+        assert (record.ip, record.port, record.line) == expected, line
+    assert parser.parse("1.2.3.4#12.5mb/s").speed_mbps == 12.5
+
+    rejected = {
+        "# 注释": "comment", "1.2.3.0/24": "cidr", "2606:4700::/32": "cidr",
+        "256.1.1.1": "invalid_ip", "01.2.3.4": "invalid_ip", "fe80::1::2": "invalid_ip",
+        "1.2.3.4:70000": "invalid_port", "garbage": "malformed", "1.2.3.4 备注": "malformed",
+    }
+    for line, reason in rejected.items():
+        assert IngestParser.parse_line(line) == (None, reason), line
+    assert parser.rejected == 0 and parser.accepted == 6
+
+    # 端口在输出中保留，读回时结果一致
+    record = IPRecord.parse("[2606:4700::1]:443#US-50.00ms")
+    assert str(record) == "[2606:4700::1]:443#US-50.00ms" and record.port == 443
+    assert IPRecord.from_dict(record.to_dict()) == record
+    assert record != IPRecord("2606:4700::1", "US", 50.0)
+
+    # 本地文件：无效行在解析阶段丢弃，按原因计入指标
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, "ips.txt")
+        with open(file_path, 'w', encoding='utf-8') as f:
+            f.write("# 优选IP\n1.1.1.1:443\n\n173.245.48.0/20\n999.1.1.1\n1.0.0.1#SG\nnot an ip\n")
+        extractor = IPExtractor()
+        records = extractor.extract_from_local_file(file_path)
+        assert extractor.extract_ip_addresses(records) == ["1.1.1.1", "1.0.0.1"]
+        assert extractor.metrics.get(file_path)['rejects'] == {
+            "comment": 1, "cidr": 1, "invalid_ip": 1, "malformed": 1}
+        assert 'ip_extractor_source_rejected_lines{' in extractor.metrics.to_prometheus()
+    print("✓ 无效行已在解析阶段丢弃")
+    return True
+
+
+def test_region_classifier():
+    """测试并发地区查询与地区过滤"""
+    print("\n=== 测试并发地区查询 ===")
+
+    regions = {"1.1.1.1": "SG", "2.2.2.2": "US", "3.3.3.3": "JP", "4.4.4.4": None, "5.5.5.5": "TW"}
+    delays = {"1.1.1.1": 0.3, "3.3.3.3": 0.05}
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    def fake_region(ip_address):
+        with lock:
+            active.append(ip_address)
+            peak.append(len(active))
+        try:
+            if ip_address == "6.6.6.6":
+                time.sleep(2)
+            time.sleep(delays.get(ip_address, 0.01))
+            return regions.get(ip_address)
+        finally:
+            with lock:
+                active.remove(ip_address)
+
+    extractor = IPExtractor()
+    extractor.region_lookup_available = lambda: True
+    extractor.get_ip_region = fake_region
+
+    # 按完成顺序产出，并发数不超过上限，超时的IP产出None且不阻塞其他IP
+    updates = []
+    start_time = time.monotonic()
+    results = list(extractor.iter_ip_regions(
+        ["1.1.1.1", "2.2.2.2", "6.6.6.6", "3.3.3.3", "1.1.1.1", "4.4.4.4", "5.5.5.5"],
+        max_workers=3, timeout=0.5, progress=updates.append))
+    assert time.monotonic() - start_time < 1.5
+    assert dict(results) == {"1.1.1.1": "SG", "2.2.2.2": "US", "6.6.6.6": None, "3.3.3.3": "JP",
+                             "4.4.4.4": None, "5.5.5.5": "TW"}
+    assert results[0][0] != "1.1.1.1" and max(peak) <= 3
+    assert [update['done'] for update in updates] == list(range(1, 7))
+    assert (updates[-1]['resolved'], updates[-1]['unresolved'], updates[-1]['timed_out']) == (4, 1, 1)
+
+    # 取消后不再提交新的查询
+    cancel_event = threading.Event()
+    cancel_event.set()
+    assert list(extractor.iter_ip_regions(["1.1.1.1", "2.2.2.2"], cancel_event=cancel_event)) == []
+
+    # 地区过滤保持输入顺序，并记录地区
+    records = extractor.remove_duplicates([
+        IPRecord("5.5.5.5", "电信", 30.0), IPRecord("2.2.2.2", "CM", 20.0),
+        IPRecord("1.1.1.1", "CT", 40.0), IPRecord("4.4.4.4", "CU", 10.0),
+    ])
+    filtered = extractor.filter_by_regions(records, ["sg", "TW", "JP"], max_workers=4, show_progress=False)
+    assert [(record.ip, record.region) for record in filtered] == [("5.5.5.5", "TW"), ("1.1.1.1", "SG")]
+    assert records[1].region == "US" and records[3].region is None
+    print(f"✓ 地区查询结果: {results}")
+    return True
+
+
+def test_region_cache():
+    """测试SQLite地区缓存"""
+    print("\n=== 测试地区缓存 ===")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "cache", "regions.sqlite3")
+        cache = RegionCache(path, ttl=100, negative_ttl=10)
+        now = time.time()
+        cache.put("8.219.1.1", "SG", cidr="8.219.0.0/16", asn="45102")
+        cache.put("1.1.1.1", None, looked_up_at=now - 20)      # 失败结果已超过 negative_ttl
+        cache.put_many([{"ip": "2.2.2.2", "country": "JP", "looked_up_at": now - 50},
+                        {"ip": "3.3.3.3", "country": "US", "looked_up_at": now - 200}])
+        assert cache.get("8.219.1.1")["cidr"] == "8.219.0.0/16"
+        assert cache.get("1.1.1.1") is None and cache.get("3.3.3.3") is None
+        assert set(cache.get_many(["2.2.2.2", "8.219.1.1", "1.1.1.1", "9.9.9.9"])) == {"2.2.2.2", "8.219.1.1"}
+        assert len(cache.get_many([f"10.0.{i // 256}.{i % 256}" for i in range(1200)] + ["2.2.2.2"])) == 1
+        assert cache.purge_expired() == 2 and len(cache) == 2
+        cache.close()
+
+        # 跨运行复用：只有未命中的IP进行RDAP查询，查询失败的结果也会缓存
+        lookups = []
+        rdap = {"8.219.2.2": {"asn": "45102", "network": {"cidr": "8.219.0.0/16", "country": "sg"}},
+                "5.5.5.5": None}
+
+        def fake_rdap(ip_address):
+            lookups.append(ip_address)
+            return rdap[ip_address]
+
+        extractor = IPExtractor(region_cache=RegionCache(path))
+        extractor.region_lookup_available = lambda: True
+        extractor._lookup_rdap = fake_rdap
+        results = dict(extractor.iter_ip_regions(["8.219.1.1", "8.219.2.2", "5.5.5.5"], timeout=None))
+        assert results == {"8.219.1.1": "SG", "8.219.2.2": "SG", "5.5.5.5": None}
+        assert sorted(lookups) == ["5.5.5.5", "8.219.2.2"]
+        entry = extractor.region_cache.get("8.219.2.2")
+        assert (entry["country"], entry["cidr"], entry["asn"]) == ("SG", "8.219.0.0/16", "45102")
+
+        extractor = IPExtractor(region_cache=RegionCache(path))
+        extractor.region_lookup_available = lambda: True
+        extractor._lookup_rdap = fake_rdap
+        updates = []
+        assert dict(extractor.iter_ip_regions(["8.219.2.2", "5.5.5.5"], progress=updates.append)) == {
+            "8.219.2.2": "SG", "5.5.5.5": None}
+        assert len(lookups) == 2 and updates[-1]["cached"] == 2
+    print("✓ 重复运行时命中缓存，不再查询")
+    return True
+
+
+def test_region_prefixes():
+    """测试按RDAP网段回答地区"""
+    print("\n=== 测试网段地区索引 ===")
+
+    index = RegionPrefixIndex()
+    assert [entry['cidr'] for entry in index.add("8.208.0.0/12", "US")] == ["8.208.0.0/12"]
+    index.add("8.219.0.0/16, 8.222.128.0/17", "SG", asn="45102")
+    index.add("2400:cb00::/32", "HK")
+    assert index.add("8.0.0.0/8", "US") == [] and index.add("无效", "US") == []
+    assert index.lookup("8.219.40.1")["country"] == "SG"        # 最长前缀优先
+    assert index.lookup("8.222.200.5")["asn"] == "45102"
+    assert index.lookup("8.210.0.1")["country"] == "US"
+    assert index.lookup("8.222.1.1")["country"] == "US"
+    assert index.lookup("2400:cb00:1::1")["country"] == "HK"
+    assert index.lookup("1.1.1.1") is None and index.lookup("bad") is None
+    assert len(index) == 4
+
+    rdap = {
+        "8.219.": {"asn": "45102", "network": {"cidr": "8.219.0.0/16", "country": "SG"}},
+        "47.74.": {"asn": "45102", "network": {"cidr": "47.74.0.0/15", "country": "SG"}},
+        "47.75.": {"asn": "45102", "network": {"cidr": "47.74.0.0/15", "country": "SG"}},
+        "1.1.": {"asn": "13335", "network": {"cidr": "1.1.1.0/24", "country": "AU"}},
+    }
+    lookups = []
+
+    def fake_rdap(ip_address):
+        lookups.append(ip_address)
+        return next(result for prefix, result in rdap.items() if ip_address.startswith(prefix))
+
+    ips = [f"8.219.{i}.{i}" for i in range(40)] + [f"47.74.{i}.1" for i in range(20)] + ["1.1.1.1", "47.75.0.9"]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "regions.sqlite3")
+        extractor = IPExtractor(region_cache=RegionCache(path))
+        extractor.region_lookup_available = lambda: True
+        extractor._lookup_rdap = fake_rdap
+        updates = []
+        results = dict(extractor.iter_ip_regions(ips, max_workers=2, progress=updates.append))
+        assert len(results) == len(ips) and results["47.75.0.9"] == "SG" and results["1.1.1.1"] == "AU"
+        # 每个网段只查询一次
+        assert len(lookups) == 3 and updates[-1]["prefix_hits"] == len(ips) - 3
+
+        # 网段持久化在地区缓存中，下次运行直接从内存回答
+        extractor = IPExtractor(region_cache=RegionCache(path))
+        extractor.region_lookup_available = lambda: True
+        extractor._lookup_rdap = fake_rdap
+        assert len(extractor.region_prefixes) == 3
+        assert extractor.get_ip_region("8.219.200.200") == "SG" and len(lookups) == 3
+
+        # 缓存的失败结果不覆盖之后查到的网段
+        extractor.region_cache.put("47.76.0.1", None)
+        extractor.region_cache.put("9.9.9.9", None)
+        assert extractor.get_ip_region("47.76.0.1") is None
+        extractor.region_prefixes.add("47.76.0.0/16", "HK")
+        assert extractor.get_ip_region("47.76.0.1") == "HK"
+        updates = []
+        assert dict(extractor.iter_ip_regions(["47.76.0.1", "9.9.9.9"], progress=updates.append)) == {
+            "47.76.0.1": "HK", "9.9.9.9": None}
+        assert len(lookups) == 3
+        assert updates[-1]["prefix_hits"] == 1 and updates[-1]["cached"] == 1
+    print(f"✓ {len(ips)} 个IP只进行了 {len(lookups)} 次RDAP查询")
+    return True
+
+
+def test_geoip_range_db():
+    """测试离线IP地区数据库"""
+    print("\n=== 测试离线IP地区数据库 ===")
+
+    csv_text = "\n".join([
+        "ip_start,ip_end,country",
+        "8.219.0.0,8.219.255.255,SG",
+        "1.0.0.0,1.0.0.255,AU",
+        "16777472,16777727,CN",                      # 1.0.1.0 - 1.0.1.255（整数形式）
+        "281470698521088,281470698521343,JP",         # ::ffff:1.0.2.0 - ::ffff:1.0.2.255
+        "47.74.0.0/15,sg",
+        "2400:cb00::,2400:cb00:ffff:ffff:ffff:ffff:ffff:ffff,HK",
+        "10.0.0.0,10.255.255.255,ZZ",
+        "坏的行",
+    ])
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "geoip.csv.gz")
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            f.write(csv_text)
+        db = GeoIPRangeDB.from_csv(path)
+    assert len(db) == 6
+
+    expected = {
+        "8.219.40.1": "SG", "1.0.0.255": "AU", "1.0.1.7": "CN", "1.0.2.9": "JP", "47.75.1.1": "SG",
+        "2400:cb00::1": "HK", "1.0.3.1": None, "10.1.1.1": None, "9.9.9.9": None, "bad": None, "::1": None,
+    }
+    assert {ip: db.lookup(ip) for ip in expected} == expected
+    assert db.classify(list(expected)) == list(expected.values())
+
+    # 作为地区查询的离线后端：命中的IP不进行RDAP查询
+    lookups = []
+    extractor = IPExtractor(geoip_db=db)
+    extractor._lookup_rdap = lambda ip_address: lookups.append(ip_address) or {"network": {"country": "US"}}
+    assert extractor.region_lookup_available()
+    assert extractor.get_ip_region("1.0.1.7") == "CN" and lookups == []
+    updates = []
+    results = dict(extractor.iter_ip_regions(["8.219.1.1", "47.74.1.1", "1.0.0.1"], progress=updates.append))
+    assert results == {"8.219.1.1": "SG", "47.74.1.1": "SG", "1.0.0.1": "AU"} and lookups == []
+    assert updates[-1]["offline"] == 3
+    filtered = extractor.filter_by_regions([IPRecord("1.0.0.1"), IPRecord("8.219.1.1", "CM", 50.0)], ["SG"],
+                                           show_progress=False)
+    assert [(record.ip, record.region) for record in filtered] == [("8.219.1.1", "SG")]
+    print(f"✓ 离线查询结果: {results}")
+    return True
+
+
+def test_cidr_trie():
+    """测试IPv4/IPv6网段基数树"""
+    print("\n=== 测试网段基数树 ===")
+
+    trie = CIDRTrie()
+    trie.insert("8.208.0.0/12", "US")
+    trie.insert("8.219.0.0/16", "SG")
+    trie.insert("8.219.40.0/24", "SG-40")
+    trie.insert("2606:4700::/32", "CF")
+    trie.insert("2606:4700:3000::/44", {"cdn": True})
+    trie.insert("0.0.0.0/0", "ANY")
+    assert trie.longest_match("8.219.40.1") == ("8.219.40.0/24", "SG-40")
+    assert trie.longest_match("8.219.41.1") == ("8.219.0.0/16", "SG")
+    assert trie.lookup("8.210.0.1") == "US" and trie.lookup("1.1.1.1") == "ANY"
+    assert trie.lookup("2606:4700:3001::1") == {"cdn": True} and trie.lookup("2606:4700:1::1") == "CF"
+    assert trie.lookup("2400::1") is None and "2400::1" not in trie and "bad" not in trie
+    assert trie.get("8.219.0.0/16") == "SG" and trie.get("8.219.0.0/17") is None
+    trie.insert("8.219.0.0/16", "SG2")
+    assert len(trie) == 6 and trie.get("8.219.0.0/16") == "SG2"
+    assert dict(trie.items())["2606:4700:3000::/44"] == {"cdn": True}
+
+    # 与逐个比较网段的结果一致
+    rng = random.Random(7)
+    expected = {}
+    for index in range(400):
+        if index % 2:
+            network = ipaddress.ip_network((rng.getrandbits(32), rng.randint(8, 32)), strict=False)
+        else:
+            network = ipaddress.ip_network((rng.getrandbits(128), rng.randint(16, 128)), strict=False)
+        expected[network] = index
+        trie.insert(network, index)
+    addresses = [str(network.network_address + 1) for network in expected if network.num_addresses > 2]
+    addresses += [str(ipaddress.ip_address(rng.getrandbits(32))) for _ in range(100)]
+
+    def brute_force(ip_address):
+        address = ipaddress.ip_address(ip_address)
+        matches = [network for network in expected if network.version == address.version and address in network]
+        return expected[max(matches, key=lambda network: network.prefixlen)] if matches else None
+
+    results = trie.lookup_many(addresses)
+    for ip_address, result in zip(addresses, results):
+        brute = brute_force(ip_address)
+        if brute is not None:
+            assert result == brute, ip_address
+
+    # 二进制序列化
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "index", "trie.bin")
+        trie.save(path)
+        loaded = CIDRTrie.load(path)
+    assert loaded.lookup_many(addresses) == results and len(loaded) == len(trie)
+    assert loaded.longest_match("8.219.40.1") == ("8.219.40.0/24", "SG-40")
+    loaded.insert("9.9.9.0/24", "SG")
+    assert loaded.lookup("9.9.9.9") == "SG"
+    try:
+        CIDRTrie.from_bytes(b"not a trie")
+        assert False, "无效数据应报错"
+    except ValueError:
+        pass
+
+    # Cloudflare官方IP段
+    cloudflare = CIDRTrie.from_file("CloudflareST/ip.txt")
+    for network, value in CIDRTrie.from_file("CloudflareST/ipv6.txt").items():
+        cloudflare.insert(network, value)
+    assert "104.16.1.1" in cloudflare and "2606:4700::6810:1" in cloudflare
+    assert "8.8.8.8" not in cloudflare
+    print(f"✓ 基数树共 {len(trie)} 个网段，查询结果与逐个比较一致")
+    return True
+
+
 def run_all_tests():
     """运行所有测试"""
     print("IP提取器功能测试")
@@ -173,7 +1345,32 @@ def run_all_tests():
         ("数据处理", test_data_processing),
         ("便捷函数", test_convenience_function),
         ("文件操作", test_file_operations),
-        ("错误处理", test_error_handling)
+        ("错误处理", test_error_handling),
+        ("并发获取", test_concurrent_fetch),
+        ("共享连接池", test_shared_session),
+        ("HTTP缓存", test_http_cache),
+        ("数据源快照", test_source_snapshot),
+        ("流式解析", test_streaming_lines),
+        ("数据源熔断", test_source_health),
+        ("对冲请求", test_hedged_requests),
+        ("数据源指标", test_metrics_registry),
+        ("录制回放", test_fixture_record_replay),
+        ("HTML解析引擎", test_html_parser_engines),
+        ("表格行解析", test_table_only_parsing),
+        ("表格提取规则", test_table_site_specs),
+        ("进程池解析", test_parse_process_pool),
+        ("IP数据记录", test_ip_record),
+        ("列式IP批次", test_ip_batch),
+        ("最佳IP选择", test_best_ip_selection),
+        ("按IP合并去重", test_merge_by_ip),
+        ("IP评分", test_ip_scorer),
+        ("运营商索引", test_carrier_index),
+        ("严格解析", test_ingest_parser),
+        ("并发地区查询", test_region_classifier),
+        ("地区缓存", test_region_cache),
+        ("网段地区索引", test_region_prefixes),
+        ("离线IP地区数据库", test_geoip_range_db),
+        ("网段基数树", test_cidr_trie)
     ]
     
     passed = 0
@@ -1,11 +1,13 @@
 import os
 import requests
-from ip_extractor import IPExtractor
+from ip_extractor import HTTPCache, IPExtractor, IPScorer, SourceHealth
 
 # Cloudflare API配置信息 - 与sgfdip.py保持一致
 CF_API_KEY = os.getenv('CF_API_KEY')
 CF_ZONE_ID = os.getenv('CF_ZONE_ID')
 CF_DOMAIN_NAME = os.getenv('CF_DOMAIN_NAME')
+# 数据源缓存目录：HTTP响应缓存（ETag/Last-Modified）和数据源健康状态（熔断、自适应超时）
+CACHE_DIR = os.getenv('IP_CACHE_DIR', '.ip_cache')
 
 # IP提取功能已移至ip_extractor.py模块
 
@@ -19,10 +21,13 @@ def main():
     print("=== 开始提取IP数据 ===")
 
     # 创建IP提取器实例
-    extractor = IPExtractor()
+    extractor = IPExtractor(
+        http_cache=HTTPCache(os.path.join(CACHE_DIR, 'http')),
+        source_health=SourceHealth(os.path.join(CACHE_DIR, 'source_health.json'))
+    )
 
     # 获取处理后的IP数据（延迟低于100ms，去重）
-    filtered_data, ip_addresses = extractor.get_processed_ips(max_latency=100.0, remove_duplicates=True)
+    filtered_data, _ = extractor.get_processed_ips(max_latency=100.0, remove_duplicates=True)
 
     if not filtered_data:
         print("没有获取到符合条件的IP数据")
@@ -34,8 +39,8 @@ def main():
     # 执行清空DNS记录的操作
     clear_dns_records()
 
-    # 只选择前2个IP地址用于DNS记录
-    selected_ips = ip_addresses[:2]
+    # 按延迟、速度、数据源数量和新鲜度综合评分，选择得分最高的2个IP地址用于DNS记录
+    selected_ips = extractor.extract_ip_addresses(IPScorer().top_k(filtered_data, 2))
 
     # 执行添加DNS记录的操作
     print(f"将添加 {len(selected_ips)} 个DNS记录（最多2个）")